@@ -0,0 +1,74 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Binary attachments.
+
+Messages in 3.0 envelopes may include buffer, memoryview and bytearray
+objects. These are not encoded into a message's body; each is replaced in the
+body by a placeholder referring to an entry in the envelope's list of
+attachments. Drivers which
+deliver messages within a process pass the attachments by reference, without
+copying them. Other drivers send them alongside the body, as binary data.
+"""
+
+BINARY_TYPES = (buffer, memoryview, bytearray)
+
+_PLACEHOLDER_KEY = 'oslo.attachment'
+
+
+def _extract(obj, attachments):
+    if isinstance(obj, BINARY_TYPES):
+        attachments.append(obj)
+        return {_PLACEHOLDER_KEY: len(attachments) - 1}
+    if isinstance(obj, dict):
+        items = [(k, _extract(v, attachments)) for k, v in obj.iteritems()]
+        if any(v is not obj[k] for k, v in items):
+            return dict(items)
+    elif isinstance(obj, (list, tuple)):
+        values = [_extract(v, attachments) for v in obj]
+        if any(v is not o for v, o in zip(values, obj)):
+            return values
+    return obj
+
+
+def extract(obj):
+    """Replace the binary objects in obj with placeholders.
+
+    Containers are only copied if they hold binary objects, so an object
+    without any is returned unchanged.
+
+    :param obj: a message, or part of one
+    :returns: the object with placeholders, and the list of binary objects
+    """
+    attachments = []
+    return _extract(obj, attachments), attachments
+
+
+def restore(obj, attachments):
+    """Replace the placeholders in obj with the binary objects they refer to.
+
+    :param obj: a message, or part of one, with placeholders
+    :param attachments: the binary objects
+    :type attachments: list
+    """
+    if not attachments:
+        return obj
+    if isinstance(obj, dict):
+        if len(obj) == 1 and _PLACEHOLDER_KEY in obj:
+            return attachments[obj[_PLACEHOLDER_KEY]]
+        return dict([(k, restore(v, attachments))
+                     for k, v in obj.iteritems()])
+    if isinstance(obj, list):
+        return [restore(v, attachments) for v in obj]
+    return obj
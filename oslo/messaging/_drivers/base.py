@@ -26,12 +26,19 @@ class IncomingMessage(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # A server may hold many messages at once, so messages have no __dict__.
+    # Subclasses should declare __slots__ for their own attributes too.
+    __slots__ = ('listener', 'ctxt', 'message')
+
     def __init__(self, listener, ctxt, message):
-        self.conf = listener.conf
         self.listener = listener
         self.ctxt = ctxt
         self.message = message
 
+    @property
+    def conf(self):
+        return self.listener.conf
+
     @abc.abstractmethod
     def reply(self, reply=None, failure=None):
         "Send a reply or failure back to the client."
@@ -41,6 +48,31 @@ class IncomingMessage(object):
         "The message has been dispatched and replied to."
 
 
+class ReplyWaiter(object):
+
+    __metaclass__ = abc.ABCMeta
+
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def wait(self, timeout=None):
+        "Block until the reply to a request arrives and return it."
+
+
+class _DeferredReplyWaiter(ReplyWaiter):
+
+    __slots__ = ('_driver', '_args', '_kwargs')
+
+    def __init__(self, driver, target, ctxt, message, envelope, priority):
+        self._driver = driver
+        self._args = (target, ctxt, message)
+        self._kwargs = dict(envelope=envelope, priority=priority)
+
+    def wait(self, timeout=None):
+        return self._driver.send(*self._args, wait_for_reply=True,
+                                 timeout=timeout, **self._kwargs)
+
+
 class Listener(object):
 
     __metaclass__ = abc.ABCMeta
@@ -66,8 +98,30 @@ class BaseDriver(object):
 
     @abc.abstractmethod
     def send(self, target, ctxt, message,
-             wait_for_reply=None, timeout=None, envelope=False):
-        """Send a message to the given target."""
+             wait_for_reply=None, timeout=None, envelope=None,
+             priority=None):
+        """Send a message to the given target.
+
+        The message is sent in the envelope format whose version is given by
+        envelope - see the _drivers.common module - or without an envelope if
+        envelope is None.
+
+        Messages with a higher priority should be delivered to listeners
+        ahead of any lower priority messages queued for the same target. A
+        priority of None is equivalent to a priority of zero.
+        """
+
+    def send_async(self, target, ctxt, message, envelope=None,
+                   priority=None):
+        """Send a request to the given target without waiting for a reply.
+
+        Returns a ReplyWaiter for the reply, so that a client may have several
+        requests awaiting replies at once. Drivers should override this if
+        they can; by default, the request is only sent once its reply is
+        waited for.
+        """
+        return _DeferredReplyWaiter(self, target, ctxt, message,
+                                    envelope, priority)
 
     @abc.abstractmethod
     def listen(self, target):
@@ -0,0 +1,192 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Splitting of large messages into chunks.
+
+A message in a 3.0 envelope whose body is larger than the chunk size is sent
+as a sequence of chunks, so that it doesn't hold up other messages while it
+is transferred. Each chunk is an envelope whose 'oslo.chunk' key holds the
+message id, the chunk's sequence number and the number of chunks. The first
+chunk also holds the message's header. A listener reassembles the chunks,
+buffering only a bounded number of bytes of incomplete messages.
+
+Drivers must deliver all the chunks of a message to the same listener, in
+order.
+"""
+
+import logging
+import threading
+import time
+
+from oslo.config import cfg
+
+from oslo.messaging._drivers import common
+from oslo.messaging.openstack.common import uuidutils
+
+_chunking_opts = [
+    cfg.IntOpt('message_chunk_size',
+               default=None,
+               help='Split message bodies larger than this many bytes into '
+                    'chunks of this size. Messages are not split if unset'),
+    cfg.IntOpt('message_reassembly_bytes',
+               default=64 * 1024 * 1024,
+               help='The maximum bytes of incomplete chunked messages a '
+                    'listener buffers. Messages which would exceed this are '
+                    'dropped'),
+    cfg.IntOpt('message_reassembly_timeout',
+               default=60,
+               help='Seconds after which an incomplete chunked message is '
+                    'dropped'),
+]
+
+_LOG = logging.getLogger(__name__)
+
+_CHUNK_KEY = 'oslo.chunk'
+_MESSAGE_KEY = 'oslo.message'
+_VERSION_KEY = 'oslo.version'
+
+
+def is_chunk(msg):
+    """Whether a message is one chunk of a larger message."""
+    return isinstance(msg, dict) and _CHUNK_KEY in msg
+
+
+def chunk_id(msg):
+    """The id of the message a chunk belongs to, or None if not a chunk."""
+    return msg[_CHUNK_KEY][0] if is_chunk(msg) else None
+
+
+def split_msg(msg, chunk_size):
+    """Split a message into chunks if its body is larger than chunk_size.
+
+    Only messages in 3.0 envelopes are split, since listeners which only
+    understand earlier formats can't reassemble chunks.
+
+    :param msg: a message in an envelope
+    :type msg: dict
+    :param chunk_size: the maximum bytes of body in each chunk
+    :type chunk_size: int
+    :returns: a list of messages
+    """
+    if not chunk_size or not common.is_envelope(msg):
+        return [msg]
+    body = msg.get(_MESSAGE_KEY)
+    if body is None or len(body) <= chunk_size:
+        return [msg]
+    if common.envelope_major(msg[_VERSION_KEY]) < 3:
+        return [msg]
+
+    msg_id = uuidutils.generate_uuid()
+    count = (len(body) + chunk_size - 1) // chunk_size
+    chunks = []
+    for seq in range(count):
+        if seq == 0:
+            chunk = dict(msg)
+        else:
+            chunk = {_VERSION_KEY: msg[_VERSION_KEY]}
+        chunk[_CHUNK_KEY] = [msg_id, seq, count]
+        chunk[_MESSAGE_KEY] = body[seq * chunk_size:(seq + 1) * chunk_size]
+        chunks.append(chunk)
+    return chunks
+
+
+class _Partial(object):
+
+    __slots__ = ('msg', 'parts', 'size', 'started')
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.parts = []
+        self.size = 0
+        self.started = time.time()
+
+
+class Reassembler(object):
+
+    """Reassemble chunked messages.
+
+    :param max_bytes: the maximum bytes of incomplete messages to buffer
+    :type max_bytes: int
+    :param timeout: seconds after which an incomplete message is dropped
+    :type timeout: float
+    """
+
+    def __init__(self, max_bytes, timeout=None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._partials = {}
+        self._size = 0
+
+    @classmethod
+    def from_conf(cls, conf):
+        conf.register_opts(_chunking_opts)
+        return cls(conf.message_reassembly_bytes,
+                   conf.message_reassembly_timeout)
+
+    def _drop(self, msg_id, reason):
+        partial = self._partials.pop(msg_id)
+        self._size -= partial.size
+        _LOG.warning('Dropping chunked message %(id)s: %(reason)s',
+                     dict(id=msg_id, reason=reason))
+
+    def _expire(self):
+        if not self.timeout:
+            return
+        expired = time.time() - self.timeout
+        for msg_id, partial in self._partials.items():
+            if partial.started < expired:
+                self._drop(msg_id, 'timed out waiting for chunks')
+
+    def add(self, chunk):
+        """Add a chunk, returning the reassembled message once complete.
+
+        :param chunk: a chunk of a message
+        :type chunk: dict
+        :returns: the message, or None if chunks are still missing
+        """
+        msg_id, seq, count = chunk[_CHUNK_KEY]
+        part = chunk[_MESSAGE_KEY]
+
+        with self._lock:
+            self._expire()
+
+            partial = self._partials.get(msg_id)
+            if partial is None:
+                if seq != 0:
+                    # The rest of a message which was dropped
+                    return None
+                partial = self._partials[msg_id] = _Partial(chunk)
+            elif seq != len(partial.parts):
+                self._drop(msg_id, 'chunk %d received out of order' % seq)
+                return None
+
+            if self._size + len(part) > self.max_bytes:
+                self._drop(msg_id, 'too many bytes of incomplete messages')
+                return None
+
+            partial.parts.append(part)
+            partial.size += len(part)
+            self._size += len(part)
+
+            if len(partial.parts) < count:
+                return None
+
+            del self._partials[msg_id]
+            self._size -= partial.size
+
+        msg = dict(partial.msg)
+        del msg[_CHUNK_KEY]
+        msg[_MESSAGE_KEY] = part[:0].join(partial.parts)
+        return msg
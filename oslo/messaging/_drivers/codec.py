@@ -0,0 +1,163 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Codecs for encoding message bodies.
+
+A message in a 3.0 envelope names the codec its body was encoded with, so a
+listener can decode messages from senders using any codec it supports.
+"""
+
+import abc
+import datetime
+import json
+
+from oslo.config import cfg
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from oslo.messaging._drivers import base
+from oslo.messaging.openstack.common import jsonutils
+from oslo.messaging.openstack.common import timeutils
+
+_codec_opts = [
+    cfg.StrOpt('message_codec',
+               default='json',
+               help='The codec used to encode message bodies: json or '
+                    'msgpack. Listeners decode messages from senders using '
+                    'any codec which is available to them'),
+]
+
+DEFAULT_CODEC = 'json'
+
+
+class UnsupportedCodec(base.TransportDriverError):
+    """Raised if a codec is unknown or its library is not installed."""
+
+    def __init__(self, name):
+        msg = 'Unsupported message codec %s' % name
+        super(UnsupportedCodec, self).__init__(msg)
+        self.name = name
+
+
+class Codec(object):
+
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+
+    @abc.abstractmethod
+    def encode(self, obj):
+        """Encode an object, converting any unsupported types to primitives."""
+
+    @abc.abstractmethod
+    def decode(self, data):
+        """Decode an object."""
+
+    @abc.abstractmethod
+    def check(self, obj):
+        """Raise TypeError unless obj can be encoded without conversion."""
+
+
+class JSONCodec(Codec):
+
+    name = 'json'
+
+    def encode(self, obj):
+        return jsonutils.dumps(obj)
+
+    def decode(self, data):
+        return jsonutils.loads(data)
+
+    def check(self, obj):
+        json.dumps(obj)
+
+
+class MsgPackCodec(Codec):
+
+    """Encode objects with msgpack.
+
+    Datetimes and sets are encoded as msgpack extension types, so they are
+    decoded as datetimes and sets rather than strings and lists. Datetimes
+    are converted to naive UTC datetimes.
+    """
+
+    name = 'msgpack'
+
+    _DATETIME = 1
+    _SET = 2
+
+    _DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def __init__(self):
+        if msgpack is None:
+            raise UnsupportedCodec(self.name)
+
+    def _ext(self, obj):
+        if isinstance(obj, datetime.datetime):
+            obj = timeutils.normalize_time(obj)
+            data = obj.strftime(self._DATETIME_FORMAT)
+            return msgpack.ExtType(self._DATETIME, data.encode('ascii'))
+        if isinstance(obj, (set, frozenset)):
+            return msgpack.ExtType(self._SET, self.encode(list(obj)))
+        return None
+
+    def _default(self, obj):
+        ext = self._ext(obj)
+        if ext is None:
+            return jsonutils.to_primitive(obj, convert_instances=True)
+        return ext
+
+    def _strict_default(self, obj):
+        ext = self._ext(obj)
+        if ext is None:
+            raise TypeError('%r can not be encoded with msgpack' % obj)
+        return ext
+
+    def _ext_hook(self, code, data):
+        if code == self._DATETIME:
+            return datetime.datetime.strptime(data.decode('ascii'),
+                                              self._DATETIME_FORMAT)
+        if code == self._SET:
+            return set(self.decode(data))
+        return msgpack.ExtType(code, data)
+
+    def encode(self, obj):
+        return msgpack.packb(obj, default=self._default, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False)
+
+    def check(self, obj):
+        msgpack.packb(obj, default=self._strict_default, use_bin_type=True)
+
+
+_CODECS = dict([(c.name, c) for c in (JSONCodec, MsgPackCodec)])
+_instances = {}
+
+
+def get_codec(name=None):
+    """Return the codec with the given name, or the JSON codec.
+
+    :raises: UnsupportedCodec
+    """
+    name = name or DEFAULT_CODEC
+    codec = _instances.get(name)
+    if codec is None:
+        if name not in _CODECS:
+            raise UnsupportedCodec(name)
+        codec = _instances.setdefault(name, _CODECS[name]())
+    return codec
@@ -0,0 +1,224 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Message envelopes.
+
+Messages may be sent in one of these formats:
+
+  1.0: the message dict itself, with no envelope.
+
+  2.0: a dict with the envelope version under 'oslo.version' and the message
+       encoded as a JSON string under 'oslo.message'.
+
+  3.0: as 2.0, except that the message's routing and dispatch fields - e.g.
+       its method, namespace and version - are moved into a small dict under
+       'oslo.header'. Those fields can be read without decoding the rest of
+       the message, which is left encoded under 'oslo.message'. The rest of
+       the message is encoded with the codec named by 'oslo.codec', or with
+       JSON if no codec is named. The encoded message may then be compressed
+       with the method named by 'oslo.compression'.
+
+In 3.0 envelopes, any binary objects in the message are replaced by
+placeholders and listed under 'oslo.attachments' - see the attachments
+module. The 2.0 format is frozen, so it has no attachments.
+
+Drivers are told which format to send with the envelope argument to send(),
+which is None for format 1.0 or one of the ENVELOPE_VERSIONS.
+"""
+
+from oslo.messaging import _utils as utils
+from oslo.messaging._drivers import attachments as msg_attachments
+from oslo.messaging._drivers import base
+from oslo.messaging._drivers import codec as msg_codec
+from oslo.messaging._drivers import compression
+from oslo.messaging.openstack.common import jsonutils
+
+ENVELOPE_VERSIONS = ('2.0', '3.0')
+ENVELOPE_VERSION = ENVELOPE_VERSIONS[-1]
+
+HEADER_KEYS = ('method', 'namespace', 'version',
+               'event_type', 'priority', 'publisher_id')
+
+_VERSION_KEY = 'oslo.version'
+_HEADER_KEY = 'oslo.header'
+_CODEC_KEY = 'oslo.codec'
+_COMPRESSION_KEY = 'oslo.compression'
+_ATTACHMENTS_KEY = 'oslo.attachments'
+_MESSAGE_KEY = 'oslo.message'
+
+
+class UnsupportedEnvelope(base.TransportDriverError):
+    """Raised if a message envelope version is not understood."""
+
+    def __init__(self, version):
+        msg = 'Unsupported message envelope version %s' % version
+        super(UnsupportedEnvelope, self).__init__(msg)
+        self.version = version
+
+
+def _check_version(version):
+    try:
+        for supported in ENVELOPE_VERSIONS:
+            if utils.version_is_compatible(supported, version):
+                return utils.Version.parse(version).major
+    except (AttributeError, IndexError, ValueError):
+        pass
+    raise UnsupportedEnvelope(version)
+
+
+class EncodedMessage(dict):
+
+    """A message which remembers its JSON encoding.
+
+    A message sent several times - e.g. a notification sent by several
+    drivers, on several topics - is encoded once, the first time its
+    encoding is needed. The message must not be modified once it is sent.
+    """
+
+    __slots__ = ('_json',)
+
+    def __init__(self, *args, **kwargs):
+        super(EncodedMessage, self).__init__(*args, **kwargs)
+        self._json = None
+
+    def __reduce__(self):
+        return (EncodedMessage, (dict(self),))
+
+    @classmethod
+    def from_json(cls, encoding):
+        """Decode a message, remembering the encoding it was decoded from."""
+        message = cls(jsonutils.loads(encoding))
+        message._json = encoding
+        return message
+
+    def to_json(self):
+        """Return the message encoded as JSON."""
+        if self._json is None:
+            self._json = jsonutils.dumps(self)
+        return self._json
+
+
+def to_json(message):
+    """Encode a message as JSON, reusing an EncodedMessage's encoding."""
+    if isinstance(message, EncodedMessage):
+        return message.to_json()
+    return jsonutils.dumps(message)
+
+
+_decompressor = compression.Compressor()
+
+
+def envelope_major(version):
+    """Return the major version of an envelope version.
+
+    :param version: the envelope version, or None for no envelope
+    :type version: str
+    :returns: 1 if version is None, or else 2 or 3
+    :raises: UnsupportedEnvelope
+    """
+    if not version:
+        return 1
+    return _check_version(version)
+
+
+def serialize_msg(message, version=ENVELOPE_VERSION, codec=None,
+                  compressor=None):
+    """Wrap a message in an envelope.
+
+    :param message: the message to wrap
+    :type message: dict
+    :param version: the envelope version, or None for no envelope
+    :type version: str
+    :param codec: the name of the codec for a 3.0 envelope's body
+    :type codec: str
+    :param compressor: compresses a 3.0 envelope's body, if large enough
+    :type compressor: compression.Compressor
+    """
+    if not version:
+        return message
+    if _check_version(version) == 2:
+        return {_VERSION_KEY: version,
+                _MESSAGE_KEY: to_json(message)}
+
+    message, attachments = msg_attachments.extract(message)
+    header = {}
+    body = {}
+    for key, value in message.iteritems():
+        if key in HEADER_KEYS:
+            header[key] = value
+        else:
+            body[key] = value
+    msg = {_VERSION_KEY: version, _HEADER_KEY: header}
+    if attachments:
+        msg[_ATTACHMENTS_KEY] = attachments
+    codec = msg_codec.get_codec(codec)
+    if codec.name != msg_codec.DEFAULT_CODEC:
+        msg[_CODEC_KEY] = codec.name
+    body = codec.encode(body)
+    if compressor is not None:
+        body, method = compressor.compress(body)
+        if method is not None:
+            msg[_COMPRESSION_KEY] = method
+    msg[_MESSAGE_KEY] = body
+    return msg
+
+
+def is_envelope(msg):
+    """Whether a message is wrapped in an envelope."""
+    return isinstance(msg, dict) and _VERSION_KEY in msg
+
+
+def msg_header(msg):
+    """Return the routing and dispatch fields of a message.
+
+    Only a message in a 2.0 envelope is decoded to do so. For a message
+    without an envelope, the message itself is returned.
+    """
+    if not is_envelope(msg):
+        return msg
+    if _check_version(msg[_VERSION_KEY]) == 2:
+        return deserialize_msg(msg)
+    return msg[_HEADER_KEY]
+
+
+def decompress_msg(msg, compressor=None):
+    """Decompress the body of a message in an envelope, if compressed.
+
+    The header of the message is left as it is, and its body is left encoded.
+
+    :param msg: the message
+    :type msg: dict
+    :param compressor: decompresses the body
+    :type compressor: compression.Compressor
+    """
+    if not is_envelope(msg) or _COMPRESSION_KEY not in msg:
+        return msg
+    compressor = compressor or _decompressor
+    msg = dict(msg)
+    method = msg.pop(_COMPRESSION_KEY)
+    msg[_MESSAGE_KEY] = compressor.decompress(msg[_MESSAGE_KEY], method)
+    return msg
+
+
+def deserialize_msg(msg):
+    """Unwrap a message from its envelope, if it has one."""
+    if not is_envelope(msg):
+        return msg
+    if _check_version(msg[_VERSION_KEY]) == 2:
+        return jsonutils.loads(msg[_MESSAGE_KEY])
+    msg = decompress_msg(msg)
+    codec = msg_codec.get_codec(msg.get(_CODEC_KEY))
+    message = codec.decode(msg[_MESSAGE_KEY])
+    message.update(msg[_HEADER_KEY])
+    return msg_attachments.restore(message, msg.get(_ATTACHMENTS_KEY))
@@ -0,0 +1,83 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compression of message bodies.
+
+Message bodies in 3.0 envelopes of at least a threshold size are compressed
+with zlib.
+"""
+
+import zlib
+
+from oslo.config import cfg
+
+from oslo.messaging._drivers import base
+
+_compression_opts = [
+    cfg.IntOpt('message_compression_threshold',
+               default=None,
+               help='Compress message bodies of at least this many bytes. '
+                    'Compression is disabled if unset'),
+    cfg.IntOpt('message_compression_level',
+               default=6,
+               help='The zlib compression level, from 1 (fastest) to 9 '
+                    '(smallest)'),
+]
+
+ZLIB = 'zlib'
+
+
+class UnsupportedCompression(base.TransportDriverError):
+    """Raised if a message body's compression is not understood."""
+
+    def __init__(self, method):
+        msg = 'Unsupported message compression %s' % method
+        super(UnsupportedCompression, self).__init__(msg)
+        self.method = method
+
+
+class Compressor(object):
+
+    """Compress and decompress message bodies.
+
+    :param threshold: the smallest body to compress, or None to never compress
+    :type threshold: int
+    :param level: the zlib compression level
+    :type level: int
+    """
+
+    def __init__(self, threshold=None, level=6):
+        self.threshold = threshold
+        self.level = level
+
+    @classmethod
+    def from_conf(cls, conf):
+        conf.register_opts(_compression_opts)
+        return cls(conf.message_compression_threshold,
+                   conf.message_compression_level)
+
+    def compress(self, data):
+        """Compress data if it is large enough.
+
+        Returns the data and the compression method, or None if the data was
+        not compressed.
+        """
+        if self.threshold is None or len(data) < self.threshold:
+            return data, None
+        return zlib.compress(data, self.level), ZLIB
+
+    def decompress(self, data, method):
+        if method != ZLIB:
+            raise UnsupportedCompression(method)
+        return zlib.decompress(data)
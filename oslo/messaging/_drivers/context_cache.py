@@ -0,0 +1,238 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Deduplication of request contexts.
+
+Consecutive messages from a sender often carry the same request context, or
+contexts which differ only in a few keys, e.g. the request id. A sender may
+send a context in full once, with an id, and then send later messages with
+just a reference to that id - or with the id and the keys which differ from
+it. Listeners remember a bounded number of contexts to resolve references.
+
+References are only used for messages sent to a specific server, since a
+message sent to a topic may be received by any of its servers. A listener
+may receive a reference to a context it doesn't know - e.g. because it has
+restarted, or forgotten the context. It must then reject the message, and
+the sender forgets the contexts it sent to the server and sends the message
+again with its context in full. So drivers only use references for messages
+which the listener can reject, e.g. those expecting a reply. To limit the
+rejections, a context is sent in full again after it has been referred to a
+number of times.
+"""
+
+import copy
+import itertools
+import threading
+
+from oslo.config import cfg
+
+from oslo.messaging._drivers import base as driver_base
+from oslo.messaging import _utils as utils
+from oslo.messaging.openstack.common import uuidutils
+
+_context_cache_opts = [
+    cfg.IntOpt('message_context_cache_size',
+               default=0,
+               help='The number of request contexts a sender remembers for '
+                    'each server it sends messages to. Later messages to the '
+                    'server carry a reference to a remembered context, or '
+                    'the changes from it, instead of the whole context. '
+                    'Disabled if 0'),
+    cfg.IntOpt('message_context_receive_cache_size',
+               default=1024,
+               help='The number of request contexts a listener remembers to '
+                    'resolve references to them'),
+]
+
+_ID_KEY = 'oslo.context_id'
+_CONTEXT_KEY = 'oslo.context'
+_BASE_KEY = 'oslo.context_base'
+_DELTA_KEY = 'oslo.context_delta'
+_REMOVED_KEY = 'oslo.context_removed'
+
+
+class UnknownContext(driver_base.TransportDriverError):
+    """Raised if a message refers to a request context which isn't known."""
+
+    def __init__(self, context_id):
+        msg = 'Unknown request context %s' % context_id
+        super(UnknownContext, self).__init__(msg)
+        self.context_id = context_id
+
+
+class DecodedContext(dict):
+
+    """A request context which was resolved from a reference.
+
+    Its context_id is the id of the context the sender sent in full, so
+    contexts with the same id have the same contents.
+    """
+
+    __slots__ = ('context_id',)
+
+    def __init__(self, context_id, ctxt):
+        super(DecodedContext, self).__init__(ctxt)
+        self.context_id = context_id
+
+
+class _Base(object):
+
+    __slots__ = ('id', 'ctxt', 'uses')
+
+    def __init__(self, id, ctxt):
+        self.id = id
+        self.ctxt = ctxt
+        self.uses = 0
+
+
+class ContextEncoder(object):
+
+    """Replace request contexts with references to contexts already sent.
+
+    :param size: the number of contexts to remember for each server
+    :type size: int
+    """
+
+    # A context is sent in full again after this many references to it
+    _MAX_USES = 100
+
+    _MAX_DESTINATIONS = 1024
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._bases = utils.LRUCache(self._MAX_DESTINATIONS)
+        self._sender_id = uuidutils.generate_uuid()
+        self._counter = itertools.count()
+
+    @classmethod
+    def from_conf(cls, conf):
+        conf.register_opts(_context_cache_opts)
+        return cls(conf.message_context_cache_size)
+
+    def _register(self, bases, ctxt):
+        base = _Base('%s.%d' % (self._sender_id, next(self._counter)),
+                     copy.deepcopy(ctxt))
+        bases.insert(0, base)
+        del bases[self.size:]
+        return {_ID_KEY: base.id, _CONTEXT_KEY: base.ctxt}
+
+    @staticmethod
+    def _delta(base, ctxt):
+        delta = dict([(k, v) for k, v in ctxt.iteritems()
+                      if k not in base.ctxt or base.ctxt[k] != v])
+        removed = [k for k in base.ctxt if k not in ctxt]
+        if len(delta) + len(removed) > len(ctxt) // 2:
+            return None
+        encoded = {_BASE_KEY: base.id, _DELTA_KEY: delta}
+        if removed:
+            encoded[_REMOVED_KEY] = removed
+        return encoded
+
+    def encode(self, target, ctxt):
+        """Encode the context of a message.
+
+        :param target: where the message is being sent
+        :type target: Target
+        :param ctxt: the message's request context
+        :type ctxt: dict
+        :returns: the context to send in place of ctxt
+        """
+        if (not self.size or not ctxt or not isinstance(ctxt, dict) or
+                target.fanout or not target.server):
+            return ctxt
+
+        with self._lock:
+            bases = self._bases.get(target.routing_key)
+            if bases is None:
+                bases = []
+                self._bases.put(target.routing_key, bases)
+            bases[:] = [b for b in bases if b.uses < self._MAX_USES]
+
+            for i, base in enumerate(bases):
+                if base.ctxt == ctxt:
+                    base.uses += 1
+                    bases.insert(0, bases.pop(i))
+                    return {_ID_KEY: base.id}
+
+            encoded = self._delta(bases[0], ctxt) if bases else None
+            if encoded is not None:
+                bases[0].uses += 1
+                return encoded
+
+            return self._register(bases, ctxt)
+
+    def forget(self, target):
+        """Forget the contexts sent to a server.
+
+        The next context sent to the server is sent in full.
+
+        :param target: the server whose contexts to forget
+        :type target: Target
+        """
+        with self._lock:
+            bases = self._bases.get(target.routing_key)
+            if bases:
+                del bases[:]
+
+
+class ContextDecoder(object):
+
+    """Resolve references to request contexts.
+
+    :param size: the number of contexts to remember
+    :type size: int
+    """
+
+    def __init__(self, size):
+        self._contexts = utils.LRUCache(size)
+
+    @classmethod
+    def from_conf(cls, conf):
+        conf.register_opts(_context_cache_opts)
+        return cls(conf.message_context_receive_cache_size)
+
+    def _lookup(self, context_id):
+        ctxt = self._contexts.get(context_id)
+        if ctxt is None:
+            raise UnknownContext(context_id)
+        return ctxt
+
+    def decode(self, ctxt):
+        """Decode the context of a message.
+
+        :param ctxt: the context the message was received with
+        :returns: the request context
+        :raises: UnknownContext
+        """
+        if not isinstance(ctxt, dict):
+            return ctxt
+
+        if _BASE_KEY in ctxt:
+            base = self._lookup(ctxt[_BASE_KEY])
+            decoded = dict(base)
+            decoded.update(ctxt[_DELTA_KEY])
+            for key in ctxt.get(_REMOVED_KEY, []):
+                decoded.pop(key, None)
+            return decoded
+
+        if _ID_KEY in ctxt:
+            if _CONTEXT_KEY in ctxt:
+                base = ctxt[_CONTEXT_KEY]
+                self._contexts.put(ctxt[_ID_KEY], base)
+            else:
+                base = self._lookup(ctxt[_ID_KEY])
+            return DecodedContext(ctxt[_ID_KEY], base)
+
+        return ctxt
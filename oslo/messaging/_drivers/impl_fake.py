@@ -15,15 +15,23 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
+import logging
 import Queue
 import threading
 import time
 
 from oslo import messaging
+from oslo.messaging._drivers import attachments
 from oslo.messaging._drivers import base
+from oslo.messaging._drivers import chunking
+from oslo.messaging._drivers import codec
+from oslo.messaging._drivers import common
+from oslo.messaging._drivers import compression
+from oslo.messaging._drivers import context_cache
 from oslo.messaging import _urls as urls
 
+_LOG = logging.getLogger(__name__)
+
 
 class InvalidTarget(base.TransportDriverError, ValueError):
 
@@ -35,6 +43,8 @@ class InvalidTarget(base.TransportDriverError, ValueError):
 
 class FakeIncomingMessage(base.IncomingMessage):
 
+    __slots__ = ('_reply_q',)
+
     def __init__(self, listener, ctxt, message, reply_q):
         super(FakeIncomingMessage, self).__init__(listener, ctxt, message)
         self._reply_q = reply_q
@@ -48,16 +58,60 @@ class FakeIncomingMessage(base.IncomingMessage):
         pass
 
 
+class FakeReplyWaiter(base.ReplyWaiter):
+
+    __slots__ = ('_target', '_reply_q', '_resend')
+
+    def __init__(self, target, reply_q, resend=None):
+        self._target = target
+        self._reply_q = reply_q
+        self._resend = resend
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+            try:
+                reply = self._reply_q.get(timeout=timeout)
+            except Queue.Empty:
+                raise messaging.MessagingTimeout(
+                    'No reply on topic %s' % self._target.topic)
+            if not isinstance(reply, context_cache.UnknownContext):
+                return reply
+            # The listener couldn't resolve the context we referred to, so
+            # send the request again with the context in full
+            if self._resend is None:
+                raise reply
+            self._resend()
+
+
 class FakeListener(base.Listener):
 
     def __init__(self, driver, target, exchange):
         super(FakeListener, self).__init__(driver, target)
         self._exchange = exchange
+        self._reassembler = chunking.Reassembler.from_conf(self.conf)
+        self._context_decoder = context_cache.ContextDecoder.from_conf(
+            self.conf)
 
     def poll(self):
         while True:
             (ctxt, message, reply_q) = self._exchange.poll(self.target)
+            if message is not None and chunking.is_chunk(message):
+                message = self._reassembler.add(message)
+                if message is None:
+                    continue
             if message is not None:
+                try:
+                    ctxt = self._context_decoder.decode(ctxt)
+                except context_cache.UnknownContext as e:
+                    # Ask the sender to resend the message in full
+                    _LOG.warning('Rejecting message: %s', e)
+                    reply_q.put(e)
+                    continue
+                message = common.decompress_msg(message,
+                                                self.driver._compressor)
                 return FakeIncomingMessage(self, ctxt, message, reply_q)
             time.sleep(.05)
 
@@ -69,32 +123,81 @@ class FakeExchange(object):
         self._queues_lock = threading.Lock()
         self._topic_queues = {}
         self._server_queues = {}
+        # The server receiving each chunked message sent to a topic
+        self._chunk_servers = {}
 
     def _get_topic_queue(self, topic):
-        return self._topic_queues.setdefault(topic, [])
+        return self._topic_queues.setdefault(topic, {})
 
     def _get_server_queue(self, topic, server):
-        return self._server_queues.setdefault((topic, server), [])
+        return self._server_queues.setdefault((topic, server), {})
 
     def deliver_message(self, topic, ctxt, message,
-                        server=None, fanout=False, reply_q=None):
+                        server=None, fanout=False, reply_q=None,
+                        priority=None):
         with self._queues_lock:
             if fanout:
                 queues = [q for t, q in self._server_queues.items()
                           if t[0] == topic]
             elif server is not None:
                 queues = [self._get_server_queue(topic, server)]
+            elif chunking.chunk_id(message) in self._chunk_servers:
+                server = self._chunk_servers[chunking.chunk_id(message)]
+                queues = [self._get_server_queue(topic, server)]
             else:
                 queues = [self._get_topic_queue(topic)]
             for queue in queues:
-                queue.append((ctxt, message, reply_q))
+                queue.setdefault(priority or 0, []).append((ctxt, message,
+                                                            reply_q))
+
+    @staticmethod
+    def _pop(queue, priority):
+        lane = queue[priority]
+        item = lane.pop(0)
+        if not lane:
+            del queue[priority]
+        return item
 
     def poll(self, target):
         with self._queues_lock:
-            queue = self._get_server_queue(target.topic, target.server)
-            if not queue:
-                queue = self._get_topic_queue(target.topic)
-            return queue.pop(0) if queue else (None, None, None)
+            server_queue = self._get_server_queue(target.topic, target.server)
+            topic_queue = self._get_topic_queue(target.topic)
+
+            # Messages sent directly to this server win ties with messages
+            # of the same priority sent to the topic
+            server_max = max(server_queue) if server_queue else None
+            topic_max = max(topic_queue) if topic_queue else None
+            if server_max is not None and (topic_max is None or
+                                           server_max >= topic_max):
+                item = self._pop(server_queue, server_max)
+            elif topic_max is not None:
+                item = self._pop(topic_queue, topic_max)
+            else:
+                return (None, None, None)
+            self._claim_chunks(target, topic_queue, server_queue, item)
+            return item
+
+    def _claim_chunks(self, target, topic_queue, server_queue, item):
+        # The remaining chunks of a message sent to a topic must go to the
+        # server which received its first chunk
+        msg_id = chunking.chunk_id(item[1])
+        if msg_id is None:
+            return
+        seq, count = item[1]['oslo.chunk'][1:]
+        if seq == count - 1:
+            self._chunk_servers.pop(msg_id, None)
+            return
+        if seq != 0:
+            return
+        self._chunk_servers[msg_id] = target.server
+        for priority, lane in topic_queue.items():
+            chunks = [i for i in lane if chunking.chunk_id(i[1]) == msg_id]
+            if not chunks:
+                continue
+            lane[:] = [i for i in lane if chunking.chunk_id(i[1]) != msg_id]
+            if not lane:
+                del topic_queue[priority]
+            server_queue.setdefault(priority, []).extend(chunks)
 
 
 class FakeDriver(base.BaseDriver):
@@ -102,29 +205,41 @@ class FakeDriver(base.BaseDriver):
     def __init__(self, conf, url=None, default_exchange=None):
         super(FakeDriver, self).__init__(conf, url, default_exchange)
 
+        self.conf.register_opts(codec._codec_opts)
+        self._codec = codec.get_codec(self.conf.message_codec)
+        self._compressor = compression.Compressor.from_conf(self.conf)
+        self.conf.register_opts(chunking._chunking_opts)
+        self._context_encoder = context_cache.ContextEncoder.from_conf(
+            self.conf)
+
         self._default_exchange = urls.exchange_from_url(url, default_exchange)
 
         self._exchanges_lock = threading.Lock()
         self._exchanges = {}
 
-    @staticmethod
-    def _check_serialize(message):
+    def _check_serialize(self, message, envelope=None):
         """Make sure a message intended for rpc can be serialized.
 
-        We specifically want to use json, not our own jsonutils because
-        jsonutils has some extra logic to automatically convert objects to
-        primitive types so that they can be serialized.  We want to catch all
-        cases where non-primitive types make it into this code and treat it as
-        an error.
+        We specifically don't want our own jsonutils because jsonutils has
+        some extra logic to automatically convert objects to primitive types
+        so that they can be serialized.  We want to catch all cases where
+        non-primitive types make it into this code and treat it as an error.
+
+        Only the body of a message in a 3.0 envelope is encoded with the
+        configured codec, and may have binary objects sent as attachments.
+        Other messages must be serializable as JSON.
         """
-        json.dumps(message)
+        if common.envelope_major(envelope) >= 3:
+            self._codec.check(attachments.extract(message)[0])
+        else:
+            codec.get_codec('json').check(message)
 
     def _get_exchange(self, name):
         while self._exchanges_lock:
             return self._exchanges.setdefault(name, FakeExchange(name))
 
-    def send(self, target, ctxt, message,
-             wait_for_reply=None, timeout=None, envelope=False):
+    def _send(self, target, ctxt, message, reply_q=None, envelope=None,
+              priority=None):
         if not target.topic:
             raise InvalidTarget('A topic is required to send', target)
 
@@ -132,29 +247,49 @@ class FakeDriver(base.BaseDriver):
         #  - timeout and not wait_for_reply
         #  - target.fanout and (wait_for_reply or timeout)
 
-        self._check_serialize(message)
+        self._check_serialize(message, envelope)
+        message = common.serialize_msg(message, envelope, self._codec.name,
+                                       self._compressor)
 
         exchange = self._get_exchange(target.exchange or
                                       self._default_exchange)
 
-        reply_q = None
-        if wait_for_reply:
-            reply_q = Queue.Queue()
-
-        exchange.deliver_message(target.topic, ctxt, message,
-                                 server=target.server,
-                                 fanout=target.fanout,
-                                 reply_q=reply_q)
+        # Only a message with a reply queue can be rejected and resent if
+        # the listener doesn't know a context it refers to
+        if reply_q is not None:
+            ctxt = self._context_encoder.encode(target, ctxt)
+        for chunk in chunking.split_msg(message,
+                                        self.conf.message_chunk_size):
+            exchange.deliver_message(target.topic, ctxt, chunk,
+                                     server=target.server,
+                                     fanout=target.fanout,
+                                     reply_q=reply_q,
+                                     priority=priority)
 
+    def send(self, target, ctxt, message,
+             wait_for_reply=None, timeout=None, envelope=None,
+             priority=None):
         if wait_for_reply:
-            try:
-                return reply_q.get(timeout=timeout)
-            except Queue.Empty:
-                raise messaging.MessagingTimeout(
-                    'No reply on topic %s' % target.topic)
+            return self.send_async(target, ctxt, message, envelope=envelope,
+                                   priority=priority).wait(timeout)
 
+        self._send(target, ctxt, message, envelope=envelope,
+                   priority=priority)
         return None
 
+    def send_async(self, target, ctxt, message, envelope=None,
+                   priority=None):
+        reply_q = Queue.Queue()
+        self._send(target, ctxt, message, reply_q=reply_q, envelope=envelope,
+                   priority=priority)
+
+        def resend():
+            self._context_encoder.forget(target)
+            self._send(target, ctxt, message, reply_q=reply_q,
+                       envelope=envelope, priority=priority)
+
+        return FakeReplyWaiter(target, reply_q, resend)
+
     def listen(self, target):
         if not (target.topic and target.server):
             raise InvalidTarget('Topic and server are required to listen',
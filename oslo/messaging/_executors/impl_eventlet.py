@@ -15,6 +15,7 @@
 
 import eventlet
 from eventlet import greenpool
+from eventlet import semaphore
 import greenlet
 
 from oslo.config import cfg
@@ -37,6 +38,11 @@ class EventletExecutor(base.ExecutorBase):
 
     The stop() method kills the message polling greenthread and the wait()
     method waits for all message dispatch greenthreads to complete.
+
+    A message is only polled for once a dispatch greenthread is free to
+    handle it, so that messages remain queued in the transport - where higher
+    priority messages can overtake them - rather than being held by the
+    executor while it waits for the pool to drain.
     """
 
     def __init__(self, conf, listener, callback):
@@ -44,6 +50,13 @@ class EventletExecutor(base.ExecutorBase):
         self.conf.register_opts(_eventlet_opts)
         self._thread = None
         self._greenpool = greenpool.GreenPool(self.conf.rpc_thread_pool_size)
+        self._slots = semaphore.Semaphore(self.conf.rpc_thread_pool_size)
+
+    def _dispatch(self, incoming):
+        try:
+            super(EventletExecutor, self)._dispatch(incoming)
+        finally:
+            self._slots.release()
 
     def start(self):
         if self._thread is not None:
@@ -52,7 +65,12 @@ class EventletExecutor(base.ExecutorBase):
         def _executor_thread():
             try:
                 while True:
-                    incoming = self.listener.poll()
+                    self._slots.acquire()
+                    try:
+                        incoming = self.listener.poll()
+                    except BaseException:
+                        self._slots.release()
+                        raise
                     self._greenpool.spawn_n(self._dispatch, incoming)
             except greenlet.GreenletExit:
                 return
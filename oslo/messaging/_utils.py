@@ -13,17 +13,145 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+
+
+class Version(object):
+
+    """A parsed major.minor version.
+
+    Versions are interned, so parsing a version string which has been parsed
+    before returns the same object without parsing it again.
+    """
+
+    __slots__ = ('major', 'minor', 'string')
+
+    _interned = {}
+    _max_interned = 1024
+
+    def __init__(self, string):
+        parts = string.split('.')
+        self.major = int(parts[0])
+        self.minor = int(parts[1])
+        self.string = string
+
+    @classmethod
+    def parse(cls, version):
+        if isinstance(version, cls):
+            return version
+        parsed = cls._interned.get(version)
+        if parsed is None:
+            parsed = cls(version)
+            if len(cls._interned) < cls._max_interned:
+                parsed = cls._interned.setdefault(version, parsed)
+        return parsed
+
+    def can_handle(self, version):
+        """Whether a request for version can be handled by this version."""
+        return self.major == version.major and self.minor >= version.minor
+
+    def __str__(self):
+        return self.string
+
+    def __repr__(self):
+        return '<Version %s>' % self.string
+
+
+_compatible = {}
+_max_compatible = 4096
+
 
 def version_is_compatible(imp_version, version):
     """Determine whether versions are compatible.
 
+    The answer for each pair of versions is remembered, since a service only
+    ever uses a handful of versions.
+
     :param imp_version: The version implemented
     :param version: The version requested by an incoming message.
     """
-    version_parts = version.split('.')
-    imp_version_parts = imp_version.split('.')
-    if int(version_parts[0]) != int(imp_version_parts[0]):  # Major
-        return False
-    if int(version_parts[1]) > int(imp_version_parts[1]):  # Minor
-        return False
-    return True
+    key = (getattr(imp_version, 'string', imp_version),
+           getattr(version, 'string', version))
+    compatible = _compatible.get(key)
+    if compatible is None:
+        compatible = Version.parse(imp_version).can_handle(
+            Version.parse(version))
+        if len(_compatible) < _max_compatible:
+            _compatible[key] = compatible
+    return compatible
+
+
+class LRUCache(object):
+
+    """A bounded, thread-safe mapping which discards least recently used keys.
+
+    Looking up or storing a key makes it the most recently used key. Once the
+    cache holds more than size entries, the least recently used entry is
+    discarded.
+    """
+
+    _PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._map = {}
+        # A circular doubly linked list, most recently used entry last
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def _unlink(self, link):
+        link[self._PREV][self._NEXT] = link[self._NEXT]
+        link[self._NEXT][self._PREV] = link[self._PREV]
+
+    def _append(self, link):
+        last = self._root[self._PREV]
+        link[self._PREV] = last
+        link[self._NEXT] = self._root
+        last[self._NEXT] = self._root[self._PREV] = link
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._map.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[self._VALUE]
+
+    def put(self, key, value):
+        with self._lock:
+            link = self._map.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[self._VALUE] = value
+            else:
+                link = self._map[key] = [None, None, key, value]
+            self._append(link)
+            while len(self._map) > self.size:
+                oldest = self._root[self._NEXT]
+                self._unlink(oldest)
+                del self._map[oldest[self._KEY]]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            link = self._map.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            return link[self._VALUE]
+
+    def keys(self):
+        with self._lock:
+            return list(self._map.keys())
+
+    def clear(self):
+        with self._lock:
+            self._map.clear()
+            self._root[:] = [self._root, self._root, None, None]
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def __len__(self):
+        return len(self._map)
@@ -17,8 +17,8 @@
 
 import logging
 
+from oslo.messaging._drivers import common
 from oslo.messaging.notify import notifier
-from oslo.messaging.openstack.common import jsonutils
 
 
 class LogDriver(notifier._Driver):
@@ -30,4 +30,4 @@ class LogDriver(notifier._Driver):
     def notify(self, ctxt, message, priority):
         logger = logging.getLogger('%s.%s' % (self.LOGGER_BASE,
                                               message['event_type']))
-        getattr(logger, priority.lower())(jsonutils.dumps(message))
+        getattr(logger, priority.lower())(common.to_json(message))
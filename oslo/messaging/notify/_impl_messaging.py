@@ -34,7 +34,7 @@ class MessagingDriver(notifier._Driver):
     deployed which do not support the 2.0 message format.
     """
 
-    def __init__(self, conf, topics, transport, envelope=False):
+    def __init__(self, conf, topics, transport, envelope=None):
         super(MessagingDriver, self).__init__(conf, topics, transport)
         self.envelope = envelope
 
@@ -56,4 +56,17 @@ class MessagingV2Driver(MessagingDriver):
     "Send notifications using the 2.0 message format."
 
     def __init__(self, conf, **kwargs):
-        super(MessagingV2Driver, self).__init__(conf, envelope=True, **kwargs)
+        super(MessagingV2Driver, self).__init__(conf, envelope='2.0', **kwargs)
+
+
+class MessagingV3Driver(MessagingDriver):
+
+    """Send notifications using the 3.0 message format.
+
+    Notification bodies in the 3.0 format are encoded with the configured
+    message codec and, if large enough, compressed. This driver should only
+    be used once all consumers of the notifications support the 3.0 format.
+    """
+
+    def __init__(self, conf, **kwargs):
+        super(MessagingV3Driver, self).__init__(conf, envelope='3.0', **kwargs)
@@ -16,11 +16,19 @@
 #    under the License.
 
 import abc
+import atexit
+import collections
 import logging
+import random
+import threading
+import time
+import weakref
 
 from oslo.config import cfg
 from stevedore import named
 
+from oslo.messaging._drivers import common as driver_common
+from oslo.messaging.openstack.common import jsonutils
 from oslo.messaging.openstack.common import timeutils
 from oslo.messaging.openstack.common import uuidutils
 from oslo.messaging import serializer as msg_serializer
@@ -34,6 +42,26 @@ _notifier_opts = [
                 deprecated_name='topics',
                 deprecated_group='rpc_notifier2',
                 help='AMQP topic used for openstack notifications'),
+    cfg.IntOpt('notification_queue_size',
+               default=1000,
+               help='The maximum number of notifications an asynchronous '
+                    'Notifier holds while they wait to be sent'),
+    cfg.StrOpt('notification_queue_overflow',
+               default='drop_oldest',
+               choices=['drop_oldest', 'block', 'sample'],
+               help='What an asynchronous Notifier does with a notification '
+                    'when its queue is full: drop_oldest drops the oldest '
+                    'waiting notification, block waits for space in the '
+                    'queue and sample replaces a randomly chosen waiting '
+                    'notification'),
+    cfg.IntOpt('notification_batch_size',
+               default=100,
+               help='The maximum number of notifications an asynchronous '
+                    'Notifier takes from its queue to send at a time'),
+    cfg.IntOpt('notification_shutdown_timeout',
+               default=10,
+               help='Seconds to wait at exit for the notifications queued by '
+                    'asynchronous Notifiers to be sent'),
 ]
 
 _LOG = logging.getLogger(__name__)
@@ -53,6 +81,127 @@ class _Driver(object):
         pass
 
 
+class _NotificationQueue(object):
+
+    """Send notifications from a bounded queue on a background thread.
+
+    The thread takes up to batch_size notifications from the queue at a time
+    and sends them in turn. It is started when the first notification is
+    queued.
+
+    :param send: called with the arguments of each queued notification
+    :type send: callable
+    :param size: the maximum number of notifications to hold
+    :type size: int
+    :param overflow: what to do when the queue is full - 'drop_oldest',
+                     'block' or 'sample'
+    :type overflow: str
+    :param batch_size: the maximum number of notifications to take at a time
+    :type batch_size: int
+    """
+
+    def __init__(self, send, size, overflow='drop_oldest', batch_size=100):
+        self._send = send
+        self.size = size
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._sending = 0
+        self._dropped = 0
+        self._closed = False
+        self._thread = None
+
+    def put(self, *args):
+        with self._cond:
+            while (not self._closed and len(self._queue) >= self.size and
+                   self.overflow == 'block'):
+                self._cond.wait()
+            if self._closed:
+                _LOG.warning('Dropped a notification because the '
+                             'notification queue is closed')
+                return
+            if len(self._queue) < self.size:
+                self._queue.append(args)
+            else:
+                self._dropped += 1
+                if self.overflow == 'sample':
+                    self._queue[random.randrange(self.size)] = args
+                else:
+                    self._queue.popleft()
+                    self._queue.append(args)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for i in range(count)]
+                self._sending = count
+                dropped, self._dropped = self._dropped, 0
+                self._cond.notify_all()
+
+            if dropped:
+                _LOG.warning('Dropped %d notifications because the '
+                             'notification queue was full', dropped)
+            for args in batch:
+                try:
+                    self._send(*args)
+                except Exception:
+                    _LOG.exception('Failed to send a queued notification')
+
+            with self._cond:
+                self._sending = 0
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait for the queued notifications to be sent.
+
+        :param timeout: the maximum number of seconds to wait
+        :type timeout: float
+        :returns: True if every notification was sent, otherwise False
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._sending:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """Send the queued notifications and stop the background thread."""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if flushed and self._thread is not None:
+            self._thread.join()
+        return flushed
+
+
+# The queues of asynchronous Notifiers, each with its shutdown timeout
+_queues = weakref.WeakKeyDictionary()
+
+
+@atexit.register
+def _flush_queues():
+    for queue, timeout in _queues.items():
+        queue.flush(timeout)
+
+
 class Notifier(object):
 
     """Send notification messages.
@@ -85,11 +234,24 @@ class Notifier(object):
                                      'compute.host',
                                      driver='messaging',
                                      topic='notifications')
+
+    An asynchronous Notifier queues notifications and sends them from a
+    background thread, so that callers don't wait for them to be sent:
+
+        notifier = notifier.Notifier(RPC_TRANSPORT, 'compute.host1',
+                                     asynchronous=True)
+
+    The notification_queue_size config option bounds the queue, and the
+    notification_queue_overflow option says what happens once it is full.
+    Queued notifications are sent at exit, within the time allowed by the
+    notification_shutdown_timeout option, or may be sent with flush(). The
+    payload and context of a notification are encoded when it is queued, so
+    callers may modify them once notify() returns.
     """
 
     def __init__(self, transport, publisher_id,
                  driver=None, topic=None,
-                 serializer=None):
+                 serializer=None, asynchronous=False):
         """Construct a Notifier object.
 
         :param transport: the transport to use for sending messages
@@ -102,6 +264,8 @@ class Notifier(object):
         :type topic: str
         :param serializer: an optional entity serializer
         :type serializer: Serializer
+        :param asynchronous: send notifications from a background thread
+        :type asynchronous: bool
         """
         self.conf = transport.conf
         self.conf.register_opts(_notifier_opts)
@@ -127,27 +291,78 @@ class Notifier(object):
             },
         )
 
+        self._queue = None
+        if asynchronous:
+            self._queue = _NotificationQueue(
+                self._send_encoded,
+                self.conf.notification_queue_size,
+                self.conf.notification_queue_overflow,
+                self.conf.notification_batch_size)
+            _queues[self._queue] = self.conf.notification_shutdown_timeout
+
     def _notify(self, ctxt, event_type, payload, priority):
         payload = self._serializer.serialize_entity(ctxt, payload)
 
-        msg = dict(message_id=uuidutils.generate_uuid(),
-                   publisher_id=self.publisher_id,
-                   event_type=event_type,
-                   priority=priority,
-                   payload=payload,
-                   timestamp=str(timeutils.utcnow()))
-
+        # Drivers share the message, and its encoding once one encodes it
+        msg = driver_common.EncodedMessage(
+            message_id=uuidutils.generate_uuid(),
+            publisher_id=self.publisher_id,
+            event_type=event_type,
+            priority=priority,
+            payload=payload,
+            timestamp=str(timeutils.utcnow()))
+
+        queue = self._queue
+        if queue is not None:
+            # The caller may modify the payload or context once notify()
+            # returns, so queue their encodings. Drivers reuse the message's.
+            queue.put(jsonutils.dumps(ctxt), msg.to_json(), priority)
+        else:
+            self._send(ctxt, msg, priority)
+
+    def _send_encoded(self, ctxt, msg, priority):
+        self._send(jsonutils.loads(ctxt),
+                   driver_common.EncodedMessage.from_json(msg), priority)
+
+    def _send(self, ctxt, msg, priority):
         def do_notify(ext):
             try:
                 ext.obj.notify(ctxt, msg, priority)
             except Exception as e:
                 _LOG.exception("Problem '%(e)s' attempting to send to "
                                "notification system. Payload=%(payload)s",
-                               dict(e=e, payload=payload))
+                               dict(e=e, payload=msg['payload']))
 
         if self._driver_mgr.extensions:
             self._driver_mgr.map(do_notify)
 
+    def flush(self, timeout=None):
+        """Wait for any queued notifications to be sent.
+
+        Only an asynchronous Notifier queues notifications.
+
+        :param timeout: the maximum number of seconds to wait
+        :type timeout: float
+        :returns: True if every notification was sent, otherwise False
+        """
+        if self._queue is None:
+            return True
+        return self._queue.flush(timeout)
+
+    def close(self, timeout=None):
+        """Send any queued notifications and stop the background thread.
+
+        Notifications sent after this are sent synchronously.
+
+        :param timeout: the maximum number of seconds to wait
+        :type timeout: float
+        :returns: True if every notification was sent, otherwise False
+        """
+        queue, self._queue = self._queue, None
+        if queue is None:
+            return True
+        return queue.close(timeout)
+
     def debug(self, ctxt, event_type, payload):
         """Send a notification at debug level.
 
@@ -34,10 +34,10 @@ This module provides a few things:
 
 
 import datetime
-import functools
 import inspect
 import itertools
 import json
+import sys
 import types
 import xmlrpclib
 
@@ -54,14 +54,80 @@ _nasty_type_tests = [inspect.ismodule, inspect.isclass, inspect.ismethod,
 
 _simple_types = (types.NoneType, int, basestring, bool, float, long)
 
+# Types whose values are returned as they are, without any further checks
+_primitive_types = frozenset([types.NoneType, int, long, float, bool,
+                              str, unicode])
+
+# The conversions to_primitive() may choose for a value
+(_SIMPLE, _DATETIME, _COUNT, _MOCK, _DICT, _LIST, _XMLRPC_DATETIME,
+ _ITERITEMS, _ITER, _NASTY, _OTHER) = range(11)
+
+# The conversion chosen for each type, seeded with the common types. Types
+# are added as they are seen, up to _MAX_CONVERSIONS of them.
+_conversions = dict([(t, _SIMPLE) for t in _primitive_types] +
+                    [(dict, _DICT), (list, _LIST), (tuple, _LIST),
+                     (datetime.datetime, _DATETIME),
+                     (itertools.count, _COUNT)])
+_MAX_CONVERSIONS = 1024
+
+
+def _is_cacheable(value, cls):
+    """Whether the conversion chosen for value applies to all values of cls.
+
+    Classes, old-style instances, objects which compute their attributes and
+    objects with their own __module__ (e.g. functions) may each need a
+    different conversion from other values of the same type.
+    """
+    if isinstance(value, (type, types.ClassType)):
+        return False
+    if isinstance(value, types.InstanceType) or hasattr(cls, '__getattr__'):
+        return False
+    return (getattr(value, '__module__', None) ==
+            getattr(cls, '__module__', None))
+
+
+def _conversion(value):
+    cls = type(value)
+    if isinstance(value, _simple_types):
+        conversion = _SIMPLE
+    elif isinstance(value, datetime.datetime):
+        conversion = _DATETIME
+    # FIXME(vish): Workaround for LP bug 852095. Without this workaround,
+    #              tests that raise an exception in a mocked method that
+    #              has a @wrap_exception with a notifier will fail. If
+    #              we up the dependency to 0.5.4 (when it is released) we
+    #              can remove this workaround.
+    elif getattr(value, '__module__', None) == 'mox':
+        conversion = _MOCK
+    elif isinstance(value, dict):
+        conversion = _DICT
+    elif isinstance(value, (list, tuple)):
+        conversion = _LIST
+    # It's not clear why xmlrpclib created their own DateTime type, but
+    # for our purposes, make it a datetime type which is explicitly
+    # handled
+    elif isinstance(value, xmlrpclib.DateTime):
+        conversion = _XMLRPC_DATETIME
+    elif hasattr(value, 'iteritems'):
+        conversion = _ITERITEMS
+    elif hasattr(value, '__iter__'):
+        conversion = _ITER
+    elif any(test(value) for test in _nasty_type_tests):
+        conversion = _NASTY
+    else:
+        conversion = _OTHER
+    if len(_conversions) < _MAX_CONVERSIONS and _is_cacheable(value, cls):
+        _conversions[cls] = conversion
+    return conversion
+
 
 def to_primitive(value, convert_instances=False, convert_datetime=True,
                  level=0, max_depth=3):
     """Convert a complex object into primitives.
 
     Handy for JSON serialization. We can optionally handle instances,
-    but since this is a recursive function, we could have cyclical
-    data structures.
+    but since this could walk into an instance's attributes, we could
+    have cyclical data structures.
 
     To handle cyclical data structures we could track the actual objects
     visited in a set, but not all objects are hashable. Instead we just
@@ -69,82 +135,92 @@ def to_primitive(value, convert_instances=False, convert_datetime=True,
 
     Therefore, convert_instances=True is lossy ... be aware.
 
-    """
-    # handle obvious types first - order of basic types determined by running
-    # full tests on nova project, resulting in the following counts:
-    # 572754 <type 'NoneType'>
-    # 460353 <type 'int'>
-    # 379632 <type 'unicode'>
-    # 274610 <type 'str'>
-    # 199918 <type 'dict'>
-    # 114200 <type 'datetime.datetime'>
-    #  51817 <type 'bool'>
-    #  26164 <type 'list'>
-    #   6491 <type 'float'>
-    #    283 <type 'tuple'>
-    #     19 <type 'long'>
-    if isinstance(value, _simple_types):
-        return value
-
-    if isinstance(value, datetime.datetime):
-        if convert_datetime:
-            return timeutils.strtime(value)
-        else:
-            return value
-
-    # value of itertools.count doesn't get caught by nasty_type_tests
-    # and results in infinite loop when list(value) is called.
-    if type(value) == itertools.count:
-        return six.text_type(value)
+    The conversion chosen for each type of value is remembered, and
+    containers are walked without recursion.
 
-    # FIXME(vish): Workaround for LP bug 852095. Without this workaround,
-    #              tests that raise an exception in a mocked method that
-    #              has a @wrap_exception with a notifier will fail. If
-    #              we up the dependency to 0.5.4 (when it is released) we
-    #              can remove this workaround.
-    if getattr(value, '__module__', None) == 'mox':
-        return 'mock'
-
-    if level > max_depth:
-        return '?'
-
-    # The try block may not be necessary after the class check above,
-    # but just in case ...
-    try:
-        recursive = functools.partial(to_primitive,
-                                      convert_instances=convert_instances,
-                                      convert_datetime=convert_datetime,
-                                      level=level,
-                                      max_depth=max_depth)
-        if isinstance(value, dict):
-            return dict((k, recursive(v)) for k, v in value.iteritems())
-        elif isinstance(value, (list, tuple)):
-            return [recursive(lv) for lv in value]
-
-        # It's not clear why xmlrpclib created their own DateTime type, but
-        # for our purposes, make it a datetime type which is explicitly
-        # handled
-        if isinstance(value, xmlrpclib.DateTime):
-            value = datetime.datetime(*tuple(value.timetuple())[:6])
-
-        if convert_datetime and isinstance(value, datetime.datetime):
-            return timeutils.strtime(value)
-        elif hasattr(value, 'iteritems'):
-            return recursive(dict(value.iteritems()), level=level + 1)
-        elif hasattr(value, '__iter__'):
-            return recursive(list(value))
-        elif convert_instances and hasattr(value, '__dict__'):
-            # Likely an instance of something. Watch for cycles.
-            # Ignore class member vars.
-            return recursive(value.__dict__, level=level + 1)
-        else:
-            if any(test(value) for test in _nasty_type_tests):
-                return six.text_type(value)
-            return value
-    except TypeError:
-        # Class objects are tricky since they may define something like
-        # __iter__ defined but it isn't callable as list().
-        return six.text_type(value)
+    """
+    result = [None]
+    # The values left to convert, each with its level, the container its
+    # primitive is stored in, the key it is stored under and its nesting
+    todo = [(value, level, result, 0, 0)]
+    max_nesting = sys.getrecursionlimit()
+    while todo:
+        value, level, parent, key, nesting = todo.pop()
+
+        conversion = _conversions.get(type(value))
+        if conversion is None:
+            conversion = _conversion(value)
+
+        if conversion == _SIMPLE:
+            parent[key] = value
+            continue
+        if conversion == _DATETIME:
+            if convert_datetime:
+                value = timeutils.strtime(value)
+            parent[key] = value
+            continue
+        # value of itertools.count doesn't get caught by nasty_type_tests
+        # and results in infinite loop when list(value) is called.
+        if conversion == _COUNT:
+            parent[key] = six.text_type(value)
+            continue
+        if conversion == _MOCK:
+            parent[key] = 'mock'
+            continue
+
+        if level > max_depth:
+            parent[key] = '?'
+            continue
+
+        # The try block may not be necessary after the class check above,
+        # but just in case ...
+        try:
+            if conversion == _DICT:
+                primitive = dict(value.iteritems())
+                children = primitive.items()
+            elif conversion == _LIST:
+                primitive = list(value)
+                children = enumerate(primitive)
+            elif conversion == _XMLRPC_DATETIME:
+                value = datetime.datetime(*tuple(value.timetuple())[:6])
+                if convert_datetime:
+                    value = timeutils.strtime(value)
+                parent[key] = value
+                continue
+            elif conversion == _ITERITEMS:
+                todo.append((dict(value.iteritems()), level + 1,
+                             parent, key, nesting))
+                continue
+            elif conversion == _ITER:
+                todo.append((list(value), level, parent, key, nesting))
+                continue
+            elif convert_instances and hasattr(value, '__dict__'):
+                # Likely an instance of something. Watch for cycles.
+                # Ignore class member vars.
+                todo.append((value.__dict__, level + 1, parent, key, nesting))
+                continue
+            elif conversion == _NASTY:
+                parent[key] = six.text_type(value)
+                continue
+            else:
+                parent[key] = value
+                continue
+        except TypeError:
+            # Class objects are tricky since they may define something like
+            # __iter__ defined but it isn't callable as list().
+            parent[key] = six.text_type(value)
+            continue
+
+        if nesting >= max_nesting:
+            raise RuntimeError('maximum recursion depth exceeded')
+        parent[key] = primitive
+        # Children are converted in order, as they were when this recursed
+        pending = [(v, level, primitive, k, nesting + 1)
+                   for k, v in children if type(v) not in _primitive_types]
+        pending.reverse()
+        todo.extend(pending)
+
+    return result[0]
 
 
 def dumps(value, default=to_primitive, **kwargs):
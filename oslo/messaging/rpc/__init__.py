@@ -14,14 +14,19 @@
 #    under the License.
 
 __all__ = [
+    'CircuitBreakerOpen',
     'ClientSendError',
+    'InvalidRateLimit',
+    'LazyArgument',
     'NoSuchMethod',
     'RPCClient',
     'RPCDispatcher',
     'RPCDispatcherError',
     'RPCVersionCapError',
+    'RateLimitExceeded',
     'UnsupportedVersion',
     'get_rpc_server',
+    'lazy_args',
 ]
 
 from client import *
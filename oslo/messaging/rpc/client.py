@@ -17,25 +17,80 @@
 #    under the License.
 
 __all__ = [
+    'CircuitBreakerOpen',
     'ClientSendError',
+    'InvalidRateLimit',
     'RPCClient',
     'RPCVersionCapError',
+    'RateLimitExceeded',
 ]
 
-import inspect
+import collections
+import copy
 import logging
+import math
+import random
+import sys
+import threading
+import time
 
 from oslo.config import cfg
+import six
 
 from oslo.messaging._drivers import base as driver_base
+from oslo.messaging._drivers import common as driver_common
 from oslo.messaging import _utils as utils
 from oslo.messaging import exceptions
+from oslo.messaging.openstack.common import jsonutils
 from oslo.messaging import serializer as msg_serializer
 
 _client_opts = [
     cfg.IntOpt('rpc_response_timeout',
                default=60,
                help='Seconds to wait for a response from a call'),
+    cfg.BoolOpt('rpc_message_envelope',
+                default=False,
+                help='Send RPC messages in the 3.0 envelope format, whose '
+                     'header can be read without decoding the message. Only '
+                     'enable this once every server supports the format'),
+    cfg.FloatOpt('rpc_adaptive_timeout_percentile',
+                 default=99.9,
+                 help='Percentile of observed response times on which '
+                      'adaptive call timeouts are based'),
+    cfg.FloatOpt('rpc_adaptive_timeout_factor',
+                 default=3.0,
+                 help='Multiple of the observed response time percentile '
+                      'used as an adaptive call timeout'),
+    cfg.FloatOpt('rpc_adaptive_timeout_min',
+                 default=1.0,
+                 help='Minimum seconds to wait for a response from a call '
+                      'with an adaptive timeout'),
+    cfg.FloatOpt('rpc_adaptive_timeout_max',
+                 default=None,
+                 help='Maximum seconds to wait for a response from a call '
+                      'with an adaptive timeout. Defaults to '
+                      'rpc_response_timeout'),
+    cfg.FloatOpt('rpc_lock_check_sample_rate',
+                 default=1.0,
+                 help='Fraction of calls for which a client check_for_lock '
+                      'callable is invoked'),
+    cfg.IntOpt('rpc_lock_warning_sites',
+               default=1024,
+               help='Number of call sites remembered so that a lock held '
+                    'while calling is only warned about once per call site. '
+                    'Zero warns about every such call'),
+    cfg.IntOpt('rpc_circuit_breaker_threshold',
+               default=5,
+               help='Consecutive send failures or call timeouts after which '
+                    'a client circuit breaker opens'),
+    cfg.FloatOpt('rpc_circuit_breaker_cooldown',
+                 default=30.0,
+                 help='Seconds for which an open circuit breaker fails '
+                      'calls and casts without sending them'),
+    cfg.IntOpt('rpc_circuit_breaker_probes',
+               default=3,
+               help='Number of successful probe requests needed to close a '
+                    'circuit breaker after its cooldown'),
 ]
 
 _LOG = logging.getLogger(__name__)
@@ -62,12 +117,603 @@ class ClientSendError(exceptions.MessagingException):
         self.ex = ex
 
 
+class RateLimitExceeded(exceptions.MessagingException):
+    """Raised if a message is not sent because of a client rate limit."""
+
+    def __init__(self, target, method):
+        msg = ('Not sending %s to target "%s": rate limit exceeded' %
+               (method, target))
+        super(RateLimitExceeded, self).__init__(msg)
+        self.target = target
+        self.method = method
+
+
+class InvalidRateLimit(exceptions.MessagingException, ValueError):
+    """Raised if a client is given a rate limit which can't be applied."""
+
+    def __init__(self, limit, reason):
+        msg = 'Invalid rate limit %s: %s' % (limit, reason)
+        super(InvalidRateLimit, self).__init__(msg)
+        self.limit = limit
+
+
+class CircuitBreakerOpen(exceptions.MessagingException):
+    """Raised if a message is not sent because a target is failing."""
+
+    def __init__(self, target):
+        msg = ('Not sending to target "%s": too many recent failures' %
+               target)
+        super(CircuitBreakerOpen, self).__init__(msg)
+        self.target = target
+
+
+def _call_key(target, message):
+    return (message.get('method'), target,
+            jsonutils.dumps(message, sort_keys=True))
+
+
+class _InFlightCall(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.waiters = 0
+
+
+class _CallCoalescer(object):
+
+    """Share a single reply among identical concurrent call()s.
+
+    The first call() for a given key is sent as normal. Any identical call()
+    made while it is still awaiting a reply is not sent, but instead waits for
+    the reply to the first call(). By default, call()s are identical if they
+    are for the same target and have the same message - i.e. the same method,
+    namespace, version and serialized arguments.
+
+    A key function may be supplied which is invoked with the target, request
+    context and message of each call() and which returns a hashable key, or
+    None if the call() should not be coalesced.
+
+    Each caller gets its own copy of a shared reply, so a caller which
+    modifies its reply doesn't change the replies of the others.
+    """
+
+    def __init__(self, key_func=None):
+        self.key_func = key_func or self._default_key
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @staticmethod
+    def _default_key(target, ctxt, message):
+        return _call_key(target, message)
+
+    def call(self, target, ctxt, message, timeout, send):
+        key = self.key_func(target, ctxt, message)
+        if key is None:
+            return send()
+
+        with self._lock:
+            in_flight = self._calls.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._calls[key] = _InFlightCall()
+            else:
+                in_flight.waiters += 1
+
+        if leader:
+            try:
+                in_flight.result = send()
+            except BaseException:
+                # e.g. GreenletExit - the waiters must not see a None reply
+                in_flight.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                    waiters = in_flight.waiters
+                in_flight.done.set()
+        else:
+            in_flight.done.wait(timeout)
+            if not in_flight.done.is_set():
+                raise exceptions.MessagingTimeout(
+                    'No reply on topic %s' % target.topic)
+
+        if in_flight.exc_info is not None:
+            six.reraise(*in_flight.exc_info)
+        if leader and not waiters:
+            return in_flight.result
+        # The reply is kept unmodified for the waiters to copy
+        return copy.deepcopy(in_flight.result)
+
+
+class _CallResultCache(object):
+
+    """A cache of the replies to call()s of idempotent methods.
+
+    Replies are cached for the methods named in the methods dict, which maps
+    each method name to the number of seconds its replies remain valid. Replies
+    are keyed by target, method, namespace, version and serialized arguments;
+    the request context is not part of the key. At most size replies are
+    cached, with the least recently used replies being discarded first.
+
+    Each caller gets its own copy of a cached reply, so a caller which
+    modifies its reply doesn't change the replies of later callers.
+    """
+
+    def __init__(self, methods, size):
+        self.methods = methods
+        self._replies = utils.LRUCache(size)
+
+    def is_cacheable(self, method):
+        return method in self.methods
+
+    def lookup(self, key):
+        entry = self._replies.get(key)
+        if entry is not None:
+            expires, result = entry
+            if time.time() < expires:
+                return True, copy.deepcopy(result)
+            self._replies.pop(key)
+        return False, None
+
+    def store(self, key, result):
+        ttl = self.methods[key[0]]
+        self._replies.put(key, (time.time() + ttl, copy.deepcopy(result)))
+
+    def invalidate(self, key):
+        self._replies.pop(key)
+
+    def clear(self, method=None):
+        if method is None:
+            self._replies.clear()
+            return
+        for key in self._replies.keys():
+            if key[0] == method:
+                self._replies.pop(key)
+
+
+class _LatencyTracker(object):
+
+    """Track the most recently observed call() latencies of each method.
+
+    Call()s which time out have no latency. Instead, the number of consecutive
+    call()s of each method which timed out is counted.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._timeouts = {}
+
+    def record(self, method, latency):
+        samples = self._samples.get(method)
+        if samples is None:
+            samples = self._samples.setdefault(
+                method, collections.deque(maxlen=self.window))
+        samples.append(latency)
+        self._timeouts.pop(method, None)
+
+    def timed_out(self, method):
+        self._timeouts[method] = self._timeouts.get(method, 0) + 1
+
+    def timeouts(self, method):
+        """Return the number of call()s which timed out since a reply."""
+        return self._timeouts.get(method, 0)
+
+    def percentile(self, method, percentile, min_samples=1):
+        """Return a latency percentile, or None if too few were observed."""
+        samples = sorted(self._samples.get(method, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        rank = int(math.ceil(len(samples) * percentile / 100.0))
+        return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+def _send_hedged(send, delay):
+    """Send a request, and a second copy if no reply arrives within delay.
+
+    Both requests are sent from their own thread. The first reply wins and
+    any later reply is discarded. If a request fails, its exception is only
+    raised if the other request fails too.
+    """
+    lock = threading.Lock()
+    done = threading.Event()
+    outcomes = []
+    attempts = []
+
+    def attempt():
+        try:
+            outcome = (send(), None)
+        except BaseException:
+            # e.g. GreenletExit - the caller must not wait for it forever
+            outcome = (None, sys.exc_info())
+        with lock:
+            outcomes.append(outcome)
+            if outcome[1] is None or len(outcomes) == len(attempts):
+                done.set()
+
+    def spawn():
+        with lock:
+            attempts.append(threading.Thread(target=attempt))
+            attempts[-1].daemon = True
+        attempts[-1].start()
+
+    spawn()
+    done.wait(delay)
+    if not done.is_set():
+        spawn()
+    done.wait()
+
+    with lock:
+        for result, exc_info in outcomes:
+            if exc_info is None:
+                return result
+        six.reraise(*outcomes[0][1])
+
+
+class _Circuit(object):
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+        self.successes = 0
+
+
+class _CircuitBreaker(object):
+
+    """Fail fast when sending to a target which keeps failing.
+
+    Each target's circuit starts closed. After threshold consecutive failures
+    the circuit opens and requests fail immediately. Once cooldown seconds
+    have passed, up to probes requests are let through. The circuit closes
+    again if all of them succeed, or re-opens as soon as one fails.
+    """
+
+    def __init__(self, threshold, cooldown, probes):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def check(self, key):
+        """Return False if a request to the target should not be sent.
+
+        Otherwise, return a ticket for the request. Once the request has been
+        sent, its outcome must be reported with the ticket to succeeded() or
+        failed(). If it is not sent after all, or its outcome is unknown, the
+        ticket must be passed to release() so that the request's probe slot is
+        freed.
+        """
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.opened_at is None:
+                return True
+            if time.time() < circuit.opened_at + self.cooldown:
+                return False
+            if circuit.probes >= self.probes:
+                return False
+            circuit.probes += 1
+            return (circuit, circuit.opened_at)
+
+    def _probe(self, key, ticket):
+        """Return the circuit a ticket is a probe of, if it is still open.
+
+        The circuit may have closed or re-opened since the check.
+        """
+        if ticket is True:
+            return None
+        circuit, opened_at = ticket
+        if (self._circuits.get(key) is circuit and
+                circuit.opened_at == opened_at):
+            return circuit
+        return None
+
+    def release(self, key, ticket):
+        with self._lock:
+            circuit = self._probe(key, ticket)
+            if circuit is not None and circuit.probes > 0:
+                circuit.probes -= 1
+
+    def succeeded(self, key, ticket):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                return
+            if circuit.opened_at is None:
+                circuit.failures = 0
+                return
+            # Only probes count - not replies to requests sent before the
+            # circuit opened
+            if self._probe(key, ticket) is None:
+                return
+            circuit.successes += 1
+            if circuit.successes >= self.probes:
+                del self._circuits[key]
+
+    def failed(self, key, ticket):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            if circuit.opened_at is None:
+                circuit.failures += 1
+                if circuit.failures < self.threshold:
+                    return
+            elif self._probe(key, ticket) is None:
+                # The circuit is already open
+                return
+            circuit.opened_at = time.time()
+            circuit.probes = circuit.successes = 0
+
+
+class _TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def refill(self, now):
+        elapsed = max(now - self.updated, 0)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """The number of seconds until a token is available."""
+        return max(1 - self.tokens, 0) / self.rate
+
+
+class _RateLimiter(object):
+
+    """Limit the rate at which messages are sent using token buckets.
+
+    Each limit is a dict with a rate (in messages per second), an optional
+    burst size and any of the exchange, topic, server, namespace and method
+    to which the limit applies. A limit applies to all messages which match
+    each of the values it specifies, and those messages share a single bucket
+    of tokens. A message is only sent once every limit which applies to it
+    has a token available.
+
+    If wait is True, messages are delayed until they can be sent. Otherwise,
+    RateLimitExceeded is raised.
+
+    :raises: InvalidRateLimit if a limit has no positive rate, a burst size of
+             less than one message, or a key other than those above
+    """
+
+    _criteria = ('exchange', 'topic', 'server', 'namespace', 'method')
+
+    def __init__(self, limits, wait=True):
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._limits = []
+        for limit in limits:
+            self._check_limit(limit)
+            criteria = [(k, limit[k]) for k in self._criteria if k in limit]
+            bucket = _TokenBucket(limit['rate'],
+                                  limit.get('burst', max(limit['rate'], 1)))
+            self._limits.append((criteria, bucket))
+
+    @classmethod
+    def _check_limit(cls, limit):
+        unknown = set(limit) - set(cls._criteria) - set(['rate', 'burst'])
+        if unknown:
+            raise InvalidRateLimit(limit, 'unknown keys %s' %
+                                   ', '.join(sorted(unknown)))
+        if not limit.get('rate') > 0:
+            raise InvalidRateLimit(limit, 'rate must be positive')
+        # A message takes a whole token, so a smaller bucket never has one
+        if limit.get('burst', 1) < 1:
+            raise InvalidRateLimit(limit, 'burst must be at least 1')
+
+    def _buckets(self, target, method):
+        values = dict(exchange=target.exchange, topic=target.topic,
+                      server=target.server, namespace=target.namespace,
+                      method=method)
+        return [bucket for criteria, bucket in self._limits
+                if all(values[k] == v for k, v in criteria)]
+
+    def _acquire(self, buckets):
+        with self._lock:
+            now = time.time()
+            for bucket in buckets:
+                bucket.refill(now)
+            delay = max([bucket.delay() for bucket in buckets])
+            if delay == 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+            return delay
+
+    def acquire(self, target, method):
+        buckets = self._buckets(target, method)
+        if not buckets:
+            return
+        delay = self._acquire(buckets)
+        while delay > 0:
+            if not self.wait:
+                raise RateLimitExceeded(target, method)
+            time.sleep(delay)
+            delay = self._acquire(buckets)
+
+
+class _CastBatch(object):
+
+    def __init__(self, send, deadline):
+        self.send = send
+        self.deadline = deadline
+        self.entries = []
+        self.size = 0
+
+
+class _CastBatcher(object):
+
+    """Gather cast()s to the same target into a single message.
+
+    Each batch is sent as a single message whose 'batch' key lists the request
+    context and message of each cast(), in the order they were made. A batch is
+    sent once it holds max_count casts or - if max_bytes is set - once the
+    JSON encoding of its casts totals max_bytes, or otherwise interval seconds
+    after its first cast was made. Batches are sent after their interval by a
+    single thread, which runs while any batches are waiting.
+
+    If version is set, casts are only batched when a client may send that
+    version of the target's API, i.e. when its servers accept batches.
+    """
+
+    def __init__(self, max_count, max_bytes=None, interval=None,
+                 version=None):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.version = version
+        self._cond = threading.Condition()
+        self._batches = {}
+        self._flusher = None
+
+    def add(self, key, send, ctxt, message):
+        entry = dict(ctxt=ctxt, message=message)
+        with self._cond:
+            batch = self._batches.get(key)
+            if batch is None:
+                deadline = None
+                if self.interval:
+                    deadline = time.time() + self.interval
+                batch = self._batches[key] = _CastBatch(send, deadline)
+                if deadline is not None:
+                    self._start_flusher()
+            batch.entries.append(entry)
+            if self.max_bytes:
+                batch.size += len(jsonutils.dumps(entry))
+            full = (len(batch.entries) >= self.max_count or
+                    (self.max_bytes and batch.size >= self.max_bytes))
+            if full:
+                del self._batches[key]
+        if full:
+            self._send(batch)
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_expired)
+            self._flusher.daemon = True
+            self._flusher.start()
+        else:
+            self._cond.notify()
+
+    def _expired(self):
+        """Wait for, and remove, the batches whose interval has passed.
+
+        Returns an empty list once there are no batches waiting.
+        """
+        while self._batches:
+            now = time.time()
+            expired = [k for k, b in self._batches.items()
+                       if b.deadline is not None and b.deadline <= now]
+            if expired:
+                return [self._batches.pop(k) for k in expired]
+            deadlines = [b.deadline for b in self._batches.values()
+                         if b.deadline is not None]
+            if not deadlines:
+                break
+            self._cond.wait(min(deadlines) - now)
+        return []
+
+    def _flush_expired(self):
+        while True:
+            with self._cond:
+                batches = self._expired()
+                if not batches:
+                    self._flusher = None
+                    return
+            for batch in batches:
+                try:
+                    self._send(batch)
+                except Exception:
+                    _LOG.exception("Failed to send a batch of %d casts",
+                                   len(batch.entries))
+
+    def flush(self, key=None):
+        with self._cond:
+            if key is None:
+                batches = list(self._batches.values())
+                self._batches.clear()
+            else:
+                batches = [b for b in [self._batches.pop(key, None)] if b]
+        for batch in batches:
+            self._send(batch)
+
+    @staticmethod
+    def _send(batch):
+        batch.send({}, dict(batch=batch.entries))
+
+
+class _FrameStack(object):
+
+    """The names of the functions on a stack, formatted only when needed."""
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __str__(self):
+        names = []
+        frame = self.frame
+        while frame is not None:
+            names.append(frame.f_code.co_name)
+            frame = frame.f_back
+        return ' :: '.join(names)
+
+
+class _LockWarnings(object):
+
+    """Remember the call sites which have been warned about holding locks.
+
+    A call site is identified by the file and line of the innermost frame
+    outside this module, along with the locks held.
+    """
+
+    def __init__(self, size):
+        self._sites = utils.LRUCache(size) if size else None
+
+    @staticmethod
+    def _call_site(frame):
+        while (frame is not None and
+               frame.f_globals.get('__name__') == __name__):
+            frame = frame.f_back
+        if frame is None:
+            return None
+        return (frame.f_code.co_filename, frame.f_lineno)
+
+    def first(self, frame, locks_held):
+        """Return whether this is the first warning for a call site."""
+        if self._sites is None:
+            return True
+        try:
+            key = (self._call_site(frame), tuple(locks_held))
+            hash(key)
+        except TypeError:
+            return True
+        if key in self._sites:
+            return False
+        self._sites.put(key, True)
+        return True
+
+
 class _CallContext(object):
 
     _marker = object()
 
+    _hedge_min_samples = 20
+    _adaptive_timeout_min_samples = 100
+    # The most times consecutive timeouts multiply an adaptive timeout
+    _adaptive_timeout_max_steps = 10
+
     def __init__(self, transport, target, serializer,
-                 timeout=None, check_for_lock=None, version_cap=None):
+                 timeout=None, check_for_lock=None, version_cap=None,
+                 priority=None, coalesce_calls=False, coalescer=None,
+                 cache=None, hedge_calls=False, hedge_percentile=95,
+                 latencies=None, adaptive_timeout=False,
+                 circuit_breaker=False, breaker=None, limiter=None,
+                 batch_casts=False, batcher=None, lock_warnings=None):
         self.conf = transport.conf
 
         self.transport = transport
@@ -76,15 +722,29 @@ class _CallContext(object):
         self.timeout = timeout
         self.check_for_lock = check_for_lock
         self.version_cap = version_cap
+        self.priority = priority
+        self.coalesce_calls = coalesce_calls
+        self.hedge_calls = hedge_calls
+        self.hedge_percentile = hedge_percentile
+        self.adaptive_timeout = adaptive_timeout
+        self.circuit_breaker = circuit_breaker
+        self.batch_casts = batch_casts
+
+        self._coalescer = coalescer
+        self._cache = cache
+        self._latencies = latencies
+        self._breaker = breaker
+        self._limiter = limiter
+        self._batcher = batcher
+        self._lock_warnings = lock_warnings
 
         super(_CallContext, self).__init__()
 
     def _make_message(self, ctxt, method, args):
         msg = dict(method=method)
 
-        msg['args'] = dict()
-        for argname, arg in args.iteritems():
-            msg['args'][argname] = self.serializer.serialize_entity(ctxt, arg)
+        msg['args'] = msg_serializer._serialize_args(self.serializer,
+                                                     ctxt, args)
 
         if self.target.namespace is not None:
             msg['namespace'] = self.target.namespace
@@ -102,35 +762,163 @@ class _CallContext(object):
         """Check to see if a version is compatible with the version cap."""
         version = self.target.version if version is self._marker else version
         return (not self.version_cap or
-                utils.version_is_compatible(self.version_cap,
-                                            self.target.version))
+                utils.version_is_compatible(self.version_cap, version))
+
+    def _send_kwargs(self, **kwargs):
+        if self.priority is not None:
+            kwargs['priority'] = self.priority
+        if self.conf.rpc_message_envelope:
+            kwargs['envelope'] = driver_common.ENVELOPE_VERSION
+        return kwargs
+
+    def _breaker_key(self):
+        return (self.target.routing_key, self.target.fanout)
+
+    def _limit(self, msg):
+        if self._limiter is not None:
+            self._limiter.acquire(self.target, msg.get('method'))
+
+    def _check_breaker(self):
+        if not self.circuit_breaker or self._breaker is None:
+            return None
+        ticket = self._breaker.check(self._breaker_key())
+        if not ticket:
+            raise CircuitBreakerOpen(self.target)
+        return ticket
+
+    def _before_send(self, msg):
+        """Check whether a message may be sent, returning a breaker ticket.
+
+        The ticket must be passed to _record() once the outcome of sending
+        the message is known, or if it is not sent after all.
+        """
+        # Rate limit first, so a probe slot isn't held while waiting
+        self._limit(msg)
+        return self._check_breaker()
+
+    def _record(self, ticket, failed):
+        """Record the outcome of a message with the breaker.
+
+        If failed is None, the message was not sent or its outcome is unknown.
+        """
+        if ticket is None:
+            return
+        if failed is None:
+            self._breaker.release(self._breaker_key(), ticket)
+        elif failed:
+            self._breaker.failed(self._breaker_key(), ticket)
+        else:
+            self._breaker.succeeded(self._breaker_key(), ticket)
+
+    def _sent(self, ticket, send, *args, **kwargs):
+        """Return the outcome of send(), recording it with the breaker."""
+        failed = None
+        try:
+            result = send(*args, **kwargs)
+            failed = False
+            return result
+        except driver_base.TransportDriverError as ex:
+            failed = True
+            raise ClientSendError(self.target, ex)
+        except exceptions.MessagingTimeout:
+            failed = True
+            raise
+        except Exception:
+            # The server replied, even if only with an exception
+            failed = False
+            raise
+        finally:
+            self._record(ticket, failed)
+
+    def _send(self, ctxt, msg, **kwargs):
+        ticket = self._before_send(msg)
+        return self._sent(ticket, self.transport._send, self.target, ctxt,
+                          msg, **self._send_kwargs(**kwargs))
+
+    def _send_batch(self, ctxt, msg):
+        # The casts in a batch were each rate limited as they were batched
+        ticket = self._check_breaker()
+        return self._sent(ticket, self.transport._send, self.target, ctxt,
+                          msg, **self._send_kwargs())
+
+    def _batch_key(self):
+        return (self.target.routing_key, self.target.fanout, self.priority)
+
+    def _batching(self):
+        if not self.batch_casts or self._batcher is None:
+            return False
+        return (self._batcher.version is None or
+                self.can_send_version(self._batcher.version))
 
     def cast(self, ctxt, method, **kwargs):
         """Invoke a method and return immediately. See RPCClient.cast()."""
         msg = self._make_message(ctxt, method, kwargs)
         if self.version_cap:
             self._check_version_cap(msg.get('version'))
-        try:
-            self.transport._send(self.target, ctxt, msg)
-        except driver_base.TransportDriverError as ex:
-            raise ClientSendError(self.target, ex)
+        if self._batching():
+            self._limit(msg)
+            self._batcher.add(self._batch_key(), self._send_batch, ctxt, msg)
+        else:
+            self._send(ctxt, msg)
+
+    def flush(self):
+        """Send any batched cast()s. See RPCClient.flush()."""
+        if self._batcher is not None:
+            self._batcher.flush()
 
     def _check_for_lock(self):
+        sample_rate = self.conf.rpc_lock_check_sample_rate
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return
         locks_held = self.check_for_lock(self.conf)
-        if locks_held:
-            stack = ' :: '.join([frame[3] for frame in inspect.stack()])
-            _LOG.warning('An RPC is being made while holding a lock. The '
-                         'locks currently held are %(locks)s. This is '
-                         'probably a bug. Please report it. Include the '
-                         'following: [%(stack)s].',
-                         {'locks': locks_held, 'stack': stack})
+        if not locks_held:
+            return
+        frame = sys._getframe(1)
+        if self._lock_warnings is not None:
+            if not self._lock_warnings.first(frame, locks_held):
+                return
+        _LOG.warning('An RPC is being made while holding a lock. The '
+                     'locks currently held are %(locks)s. This is '
+                     'probably a bug. Please report it. Include the '
+                     'following: [%(stack)s].',
+                     {'locks': locks_held, 'stack': _FrameStack(frame)})
+
+    def _hedge_delay(self, method):
+        # Only hedge if another server on the topic could take the request
+        if (not self.hedge_calls or self._latencies is None or
+                self.target.server or self.target.fanout):
+            return None
+        return self._latencies.percentile(method, self.hedge_percentile,
+                                          self._hedge_min_samples)
+
+    def _adaptive_timeout(self, method):
+        if self._latencies is None:
+            return None
+        latency = self._latencies.percentile(
+            method, self.conf.rpc_adaptive_timeout_percentile,
+            self._adaptive_timeout_min_samples)
+        if latency is None:
+            return None
+        factor = self.conf.rpc_adaptive_timeout_factor
+        timeout = max(latency * factor, self.conf.rpc_adaptive_timeout_min)
+        steps = min(self._latencies.timeouts(method),
+                    self._adaptive_timeout_max_steps)
+        timeout *= factor ** steps
+        max_timeout = self.conf.rpc_adaptive_timeout_max
+        if max_timeout is None:
+            max_timeout = self.conf.rpc_response_timeout
+        if max_timeout is not None:
+            timeout = min(timeout, max_timeout)
+        return timeout
 
     def call(self, ctxt, method, **kwargs):
         """Invoke a method and wait for a reply. See RPCClient.call()."""
         msg = self._make_message(ctxt, method, kwargs)
 
         timeout = self.timeout
-        if self.timeout is None:
+        if timeout is None and self.adaptive_timeout:
+            timeout = self._adaptive_timeout(method)
+        if timeout is None:
             timeout = self.conf.rpc_response_timeout
 
         if self.check_for_lock:
@@ -138,18 +926,136 @@ class _CallContext(object):
         if self.version_cap:
             self._check_version_cap(msg.get('version'))
 
-        try:
-            result = self.transport._send(self.target, ctxt, msg,
-                                          wait_for_reply=True, timeout=timeout)
-        except driver_base.TransportDriverError as ex:
-            raise ClientSendError(self.target, ex)
+        # Don't let a call() overtake cast()s batched for the same target
+        if self._batcher is not None:
+            self._batcher.flush(self._batch_key())
+
+        cache_key = None
+        if self._cache is not None and self._cache.is_cacheable(method):
+            cache_key = _call_key(self.target, msg)
+            cached, result = self._cache.lookup(cache_key)
+            if cached:
+                return self.serializer.deserialize_entity(ctxt, result)
+
+        def send():
+            start = time.time()
+            try:
+                result = self._send(ctxt, msg,
+                                    wait_for_reply=True, timeout=timeout)
+            except exceptions.MessagingTimeout:
+                # Step up an adaptive timeout which is too short for a slower
+                # server, without keeping it long once the server recovers
+                if self._latencies is not None:
+                    self._latencies.timed_out(method)
+                raise
+            if self._latencies is not None:
+                self._latencies.record(method, time.time() - start)
+            return result
+
+        hedge_delay = self._hedge_delay(method)
+        if hedge_delay is not None:
+            send_once = send
+            send = lambda: _send_hedged(send_once, hedge_delay)
+
+        if self.coalesce_calls and self._coalescer is not None:
+            result = self._coalescer.call(self.target, ctxt, msg,
+                                          timeout, send)
+        else:
+            result = send()
+        if cache_key is not None:
+            self._cache.store(cache_key, result)
         return self.serializer.deserialize_entity(ctxt, result)
 
+    def pipeline(self, ctxt, calls):
+        """Invoke several methods, then wait for the replies.
+
+        See RPCClient.pipeline().
+        """
+        msgs = [self._make_message(ctxt, method, kwargs)
+                for method, kwargs in calls]
+
+        timeout = self.timeout
+        if timeout is None and self.adaptive_timeout:
+            timeouts = [self._adaptive_timeout(msg['method']) for msg in msgs]
+            if timeouts and None not in timeouts:
+                timeout = max(timeouts)
+        if timeout is None:
+            timeout = self.conf.rpc_response_timeout
+
+        if self.check_for_lock:
+            self._check_for_lock()
+        if self.version_cap:
+            for msg in msgs:
+                self._check_version_cap(msg.get('version'))
+
+        if self._batcher is not None:
+            self._batcher.flush(self._batch_key())
+
+        # The outcomes of the calls which have been sent, but not recorded
+        results = collections.deque()
+        try:
+            for msg in msgs:
+                cache_key = None
+                if (self._cache is not None and
+                        self._cache.is_cacheable(msg['method'])):
+                    cache_key = _call_key(self.target, msg)
+                    cached, result = self._cache.lookup(cache_key)
+                    if cached:
+                        results.append((None, None, cache_key, result))
+                        continue
+
+                ticket = self._before_send(msg)
+                try:
+                    waiter = self.transport._send_async(
+                        self.target, ctxt, msg, **self._send_kwargs())
+                except driver_base.TransportDriverError as ex:
+                    self._record(ticket, failed=True)
+                    raise ClientSendError(self.target, ex)
+                except BaseException:
+                    self._record(ticket, failed=None)
+                    raise
+                results.append((waiter, ticket, cache_key, None))
+
+            # The timeout applies to the pipeline as a whole
+            deadline = time.time() + timeout if timeout is not None else None
+
+            replies = []
+            while results:
+                waiter, ticket, cache_key, result = results.popleft()
+                if waiter is not None:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = max(deadline - time.time(), 0)
+                    result = self._sent(ticket, waiter.wait, remaining)
+                    if cache_key is not None:
+                        self._cache.store(cache_key, result)
+                replies.append(self.serializer.deserialize_entity(ctxt,
+                                                                  result))
+            return replies
+        finally:
+            # The replies to any calls after one which raised are discarded
+            for waiter, ticket, cache_key, result in results:
+                self._record(ticket, failed=None)
+
+    def invalidate_call(self, ctxt, method, **kwargs):
+        """Discard a cached reply. See RPCClient.invalidate_call()."""
+        if self._cache is not None:
+            msg = self._make_message(ctxt, method, kwargs)
+            self._cache.invalidate(_call_key(self.target, msg))
+
+    def clear_cache(self, method=None):
+        """Discard cached replies. See RPCClient.clear_cache()."""
+        if self._cache is not None:
+            self._cache.clear(method)
+
     @classmethod
     def _prepare(cls, base,
                  exchange=_marker, topic=_marker, namespace=_marker,
                  version=_marker, server=_marker, fanout=_marker,
-                 timeout=_marker, check_for_lock=_marker, version_cap=_marker):
+                 timeout=_marker, check_for_lock=_marker, version_cap=_marker,
+                 priority=_marker, coalesce_calls=_marker,
+                 hedge_calls=_marker, adaptive_timeout=_marker,
+                 circuit_breaker=_marker, batch_casts=_marker):
         """Prepare a method invocation context. See RPCClient.prepare()."""
         kwargs = dict(
             exchange=exchange,
@@ -168,20 +1074,44 @@ class _CallContext(object):
             check_for_lock = base.check_for_lock
         if version_cap is cls._marker:
             version_cap = base.version_cap
+        if priority is cls._marker:
+            priority = base.priority
+        if coalesce_calls is cls._marker:
+            coalesce_calls = base.coalesce_calls
+        if hedge_calls is cls._marker:
+            hedge_calls = base.hedge_calls
+        if adaptive_timeout is cls._marker:
+            adaptive_timeout = base.adaptive_timeout
+        if circuit_breaker is cls._marker:
+            circuit_breaker = base.circuit_breaker
+        if batch_casts is cls._marker:
+            batch_casts = base.batch_casts
 
         return _CallContext(base.transport, target,
                             base.serializer,
                             timeout, check_for_lock,
-                            version_cap)
+                            version_cap, priority,
+                            coalesce_calls, base._coalescer,
+                            base._cache, hedge_calls,
+                            base.hedge_percentile, base._latencies,
+                            adaptive_timeout,
+                            circuit_breaker, base._breaker,
+                            base._limiter, batch_casts, base._batcher,
+                            base._lock_warnings)
 
     def prepare(self, exchange=_marker, topic=_marker, namespace=_marker,
                 version=_marker, server=_marker, fanout=_marker,
-                timeout=_marker, check_for_lock=_marker, version_cap=_marker):
+                timeout=_marker, check_for_lock=_marker, version_cap=_marker,
+                priority=_marker, coalesce_calls=_marker,
+                hedge_calls=_marker, adaptive_timeout=_marker,
+                circuit_breaker=_marker, batch_casts=_marker):
         """Prepare a method invocation context. See RPCClient.prepare()."""
         return self._prepare(self,
                              exchange, topic, namespace,
                              version, server, fanout,
-                             timeout, check_for_lock, version_cap)
+                             timeout, check_for_lock, version_cap,
+                             priority, coalesce_calls, hedge_calls,
+                             adaptive_timeout, circuit_breaker, batch_casts)
 
 
 class RPCClient(object):
@@ -220,14 +1150,114 @@ class RPCClient(object):
             cctxt = self._client.prepare(version='2.5')
             return cctxt.call(ctxt, 'test', arg=arg)
 
-    RPCClient have a number of other properties - timeout, check_for_lock and
-    version_cap - which may make sense to override for some method invocations,
-    so they too can be passed to prepare()::
+    RPCClient have a number of other properties - timeout, check_for_lock,
+    version_cap and priority - which may make sense to override for some method
+    invocations, so they too can be passed to prepare()::
 
         def test(self, ctxt, arg):
             cctxt = self._client.prepare(check_for_lock=None, timeout=10)
             return cctxt.call(ctxt, 'test', arg=arg)
 
+    Messages with a higher priority are delivered to servers ahead of any
+    lower priority messages queued on the same topic, so control-plane
+    invocations need not wait behind a large backlog of bulk casts::
+
+        def ping(self, ctxt):
+            cctxt = self._client.prepare(priority=10, timeout=5)
+            return cctxt.call(ctxt, 'ping')
+
+    Read-only call()s which are often made concurrently with identical
+    arguments - e.g. by periodic tasks running in many greenthreads - may be
+    coalesced so that only one request is sent and its reply is shared with
+    every caller waiting on an identical call()::
+
+        def get_service_version(self, ctxt, binary):
+            cctxt = self._client.prepare(coalesce_calls=True)
+            return cctxt.call(ctxt, 'get_service_version', binary=binary)
+
+    Coalesced call()s are identical if they have the same target, method and
+    serialized arguments, unless a coalesce_key function is supplied to the
+    RPCClient constructor.
+
+    The replies to idempotent methods whose results rarely change may be
+    cached by the client for a number of seconds, so that repeated call()s
+    with the same target and arguments do not need to be sent at all::
+
+        client = messaging.RPCClient(transport, target,
+                                     cache_methods={'get_flavor': 60})
+
+    Cached replies may be explicitly discarded with invalidate_call() or
+    clear_cache() when the client knows them to be stale.
+
+    Latency-critical call()s of idempotent methods on a topic served by several
+    servers may be hedged. If no reply has arrived once the call() has taken
+    longer than the hedge_percentile of recently observed latencies for the
+    method, a second copy of the request is sent and whichever reply arrives
+    first is returned::
+
+        def get_instance_state(self, ctxt, uuid):
+            cctxt = self._client.prepare(hedge_calls=True)
+            return cctxt.call(ctxt, 'get_instance_state', uuid=uuid)
+
+    Calls are not hedged until enough latencies have been observed for the
+    method, nor if they are directed at a specific server.
+
+    RPCClient may also be given a circuit breaker for each target. After a
+    number of consecutive send failures or call() timeouts, call()s and
+    cast()s to the target fail immediately with CircuitBreakerOpen for a
+    cooldown period, rather than every caller waiting for its own timeout.
+    Once the cooldown period is over, a few probe requests are sent and the
+    circuit breaker closes again if they succeed::
+
+        client = messaging.RPCClient(transport, target, circuit_breaker=True)
+
+    The rate at which a client sends messages may be limited, so that traffic
+    from many clients at once is smoothed out before it reaches the servers.
+    Each limit allows a rate of messages per second, with an optional burst,
+    for the messages matching its exchange, topic, server, namespace or
+    method::
+
+        client = messaging.RPCClient(transport, target, rate_limits=[
+            dict(rate=50, burst=100),
+            dict(method='object_class_action', rate=5),
+        ])
+
+    Messages which would exceed a limit are delayed until they can be sent,
+    unless rate_limit_wait is False, in which case RateLimitExceeded is raised.
+
+    Many small cast()s to the same target may be gathered into one message, so
+    that the per-message transport overhead is only paid once per batch.
+    A batch is sent once it holds batch_size casts or batch_bytes of encoded
+    casts, or batch_interval seconds after its first cast::
+
+        client = messaging.RPCClient(transport, target, batch_casts=True,
+                                     batch_size=50, batch_interval=0.05)
+
+    The server unpacks the batch and dispatches each cast in turn. A call() to
+    the same target first sends any casts batched for it, and flush() sends
+    all batched casts - e.g. before the client is discarded. Rate limits apply
+    to each cast as it is batched. Servers which predate batching can't
+    unpack a batch, so if batch_version is set, casts are only batched when
+    the version cap allows that version of the target's API::
+
+        client = messaging.RPCClient(transport, target, version_cap='2.3',
+                                     batch_casts=True, batch_version='2.4')
+
+    Rather than waiting for the static rpc_response_timeout, call()s may use an
+    adaptive timeout derived from the latencies recently observed for each
+    method - by default, 3 times the 99.9th percentile, clamped between 1
+    second and rpc_response_timeout - so that call()s of fast methods fail
+    quickly when no server is able to reply::
+
+        client = messaging.RPCClient(transport, target, adaptive_timeout=True)
+
+    An explicit timeout always takes precedence over an adaptive timeout, and
+    rpc_response_timeout is used until enough latencies have been observed.
+    Each consecutive call() of a method which times out multiplies its next
+    adaptive timeout by the same factor, so it grows if the method's servers
+    become slower. Timed out call()s are not recorded as latencies, so the
+    adaptive timeout drops back as soon as a reply arrives.
+
     However, this class can be used directly without wrapping it another class.
     For example:
 
@@ -242,7 +1272,14 @@ class RPCClient(object):
 
     def __init__(self, transport, target,
                  timeout=None, check_for_lock=None,
-                 version_cap=None, serializer=None):
+                 version_cap=None, serializer=None, priority=None,
+                 coalesce_calls=False, coalesce_key=None,
+                 cache_methods=None, cache_size=1024,
+                 hedge_calls=False, hedge_percentile=95,
+                 adaptive_timeout=False, circuit_breaker=False,
+                 rate_limits=None, rate_limit_wait=True,
+                 batch_casts=False, batch_size=100, batch_bytes=None,
+                 batch_interval=0.01, batch_version=None):
         """Construct an RPC client.
 
         :param transport: a messaging transport handle
@@ -257,6 +1294,39 @@ class RPCClient(object):
         :type version_cap: str
         :param serializer: an optional entity serializer
         :type serializer: Serializer
+        :param priority: an optional default priority for messages
+        :type priority: int
+        :param coalesce_calls: share replies among identical concurrent calls
+        :type coalesce_calls: bool
+        :param coalesce_key: given target, ctxt and message, returns a key
+        :type coalesce_key: callable
+        :param cache_methods: maps cacheable methods to a TTL (in seconds)
+        :type cache_methods: dict
+        :param cache_size: the maximum number of replies to cache
+        :type cache_size: int
+        :param hedge_calls: resend idempotent calls if a reply is slow
+        :type hedge_calls: bool
+        :param hedge_percentile: latency percentile after which to resend
+        :type hedge_percentile: float
+        :param adaptive_timeout: derive call() timeouts from observed latency
+        :type adaptive_timeout: bool
+        :param circuit_breaker: fail fast when sending to a failing target
+        :type circuit_breaker: bool
+        :param rate_limits: token bucket limits on the rate of sending messages
+        :type rate_limits: list of dicts
+        :param rate_limit_wait: wait for, rather than reject, excess messages
+        :type rate_limit_wait: bool
+        :param batch_casts: gather casts to the same target into one message
+        :type batch_casts: bool
+        :param batch_size: the maximum number of casts in a batch
+        :type batch_size: int
+        :param batch_bytes: the maximum encoded size of the casts in a batch
+        :type batch_bytes: int
+        :param batch_interval: the maximum seconds a cast waits in a batch
+        :type batch_interval: float
+        :param batch_version: the target API version whose servers accept
+                              batches, if not all of them do
+        :type batch_version: str
         """
         self.conf = transport.conf
         self.conf.register_opts(_client_opts)
@@ -267,6 +1337,29 @@ class RPCClient(object):
         self.check_for_lock = check_for_lock
         self.version_cap = version_cap
         self.serializer = serializer or msg_serializer.NoOpSerializer()
+        self.priority = priority
+        self.coalesce_calls = coalesce_calls
+        self.hedge_calls = hedge_calls
+        self.hedge_percentile = hedge_percentile
+        self.adaptive_timeout = adaptive_timeout
+        self.circuit_breaker = circuit_breaker
+        self.batch_casts = batch_casts
+
+        self._coalescer = _CallCoalescer(coalesce_key)
+        self._latencies = _LatencyTracker()
+        self._breaker = _CircuitBreaker(
+            self.conf.rpc_circuit_breaker_threshold,
+            self.conf.rpc_circuit_breaker_cooldown,
+            self.conf.rpc_circuit_breaker_probes)
+        self._limiter = None
+        if rate_limits:
+            self._limiter = _RateLimiter(rate_limits, rate_limit_wait)
+        self._batcher = _CastBatcher(batch_size, batch_bytes, batch_interval,
+                                     batch_version)
+        self._lock_warnings = _LockWarnings(self.conf.rpc_lock_warning_sites)
+        self._cache = None
+        if cache_methods:
+            self._cache = _CallResultCache(cache_methods, cache_size)
 
         super(RPCClient, self).__init__()
 
@@ -274,7 +1367,10 @@ class RPCClient(object):
 
     def prepare(self, exchange=_marker, topic=_marker, namespace=_marker,
                 version=_marker, server=_marker, fanout=_marker,
-                timeout=_marker, check_for_lock=_marker, version_cap=_marker):
+                timeout=_marker, check_for_lock=_marker, version_cap=_marker,
+                priority=_marker, coalesce_calls=_marker,
+                hedge_calls=_marker, adaptive_timeout=_marker,
+                circuit_breaker=_marker, batch_casts=_marker):
         """Prepare a method invocation context.
 
         Use this method to override client properties for an individual method
@@ -302,11 +1398,26 @@ class RPCClient(object):
         :type check_for_lock: bool
         :param version_cap: raise a RPCVersionCapError version exceeds this cap
         :type version_cap: str
+        :param priority: messages with a higher priority are delivered first
+        :type priority: int
+        :param coalesce_calls: share replies among identical concurrent calls
+        :type coalesce_calls: bool
+        :param hedge_calls: resend idempotent calls if a reply is slow
+        :type hedge_calls: bool
+        :param adaptive_timeout: derive call() timeouts from observed latency
+        :type adaptive_timeout: bool
+        :param circuit_breaker: fail fast when sending to a failing target
+        :type circuit_breaker: bool
+        :param batch_casts: gather casts to the same target into one message
+        :type batch_casts: bool
         """
         return _CallContext._prepare(self,
                                      exchange, topic, namespace,
                                      version, server, fanout,
-                                     timeout, check_for_lock, version_cap)
+                                     timeout, check_for_lock, version_cap,
+                                     priority, coalesce_calls, hedge_calls,
+                                     adaptive_timeout, circuit_breaker,
+                                     batch_casts)
 
     def cast(self, ctxt, method, **kwargs):
         """Invoke a method and return immediately.
@@ -335,10 +1446,67 @@ class RPCClient(object):
         :type method: str
         :param kwargs: a dict of method arguments
         :param kwargs: dict
-        :raises: MessagingTimeout
+        :raises: MessagingTimeout, ClientSendError, CircuitBreakerOpen,
+                 RateLimitExceeded
         """
         return self.prepare().call(ctxt, method, **kwargs)
 
+    def pipeline(self, ctxt, calls):
+        """Invoke several methods, then wait for their replies.
+
+        Every request is sent before any reply is waited for, so a sequence of
+        calls completes in roughly the time taken by the slowest of them rather
+        than the sum of their times::
+
+            calls = [('get_instance', dict(id=i)) for i in instance_ids]
+            instances = client.pipeline(ctxt, calls)
+
+        The replies are returned in the order of the calls. The timeout
+        applies to the pipeline as a whole. If any call raises an exception,
+        it is raised from pipeline() and the remaining replies are discarded.
+
+        Cacheable replies are served from, and stored in, the reply cache.
+        Pipelined calls are neither coalesced nor hedged, and their latencies
+        are not recorded since they include the time spent waiting behind the
+        other calls.
+
+        :param ctxt: a request context dict
+        :type ctxt: dict
+        :param calls: a sequence of (method name, dict of arguments) pairs
+        :type calls: list
+        :returns: a list of replies
+        :raises: MessagingTimeout, ClientSendError, CircuitBreakerOpen,
+                 RateLimitExceeded
+        """
+        return self.prepare().pipeline(ctxt, calls)
+
+    def flush(self):
+        """Send any cast()s which are waiting to be sent in a batch."""
+        self.prepare().flush()
+
+    def invalidate_call(self, ctxt, method, **kwargs):
+        """Discard any cached reply to a call().
+
+        The call() is identified by the same arguments which would be passed
+        to call(). This has no effect unless the method is cacheable.
+
+        :param ctxt: a request context dict
+        :type ctxt: dict
+        :param method: the method name
+        :type method: str
+        :param kwargs: a dict of method arguments
+        :param kwargs: dict
+        """
+        self.prepare().invalidate_call(ctxt, method, **kwargs)
+
+    def clear_cache(self, method=None):
+        """Discard all cached replies, or all cached replies to a method.
+
+        :param method: the method name, or None for all methods
+        :type method: str
+        """
+        self.prepare().clear_cache(method)
+
     def can_send_version(self, version=_marker):
         """Check to see if a version is compatible with the version cap."""
         return self.prepare(version=version).can_send_version()
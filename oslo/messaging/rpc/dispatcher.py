@@ -17,14 +17,17 @@
 #    under the License.
 
 __all__ = [
+    'LazyArgument',
     'NoSuchMethod',
     'RPCDispatcher',
     'RPCDispatcherError',
     'UnsupportedVersion',
+    'lazy_args',
 ]
 
 import logging
 
+from oslo.messaging._drivers import common
 from oslo.messaging import _utils as utils
 from oslo.messaging import serializer as msg_serializer
 from oslo.messaging import server as msg_server
@@ -55,6 +58,65 @@ class UnsupportedVersion(RPCDispatcherError):
         self.version = version
 
 
+class LazyArgument(object):
+    """An RPC method argument which is deserialized when first used.
+
+    Endpoint methods decorated with lazy_args() - or all the methods of an
+    endpoint whose lazy_args attribute is True - are passed each argument as
+    a LazyArgument, so that methods which return early or only pass an
+    argument on pay nothing to deserialize it::
+
+        @messaging.lazy_args
+        def update_network(self, ctxt, network_info):
+            if not self.enabled:
+                return
+            self._update(network_info.value)
+
+    The serialized form of the argument is available as the raw attribute.
+    """
+
+    __slots__ = ('raw', '_ctxt', '_serializer', '_value')
+
+    _unset = object()
+
+    def __init__(self, serializer, ctxt, raw):
+        self.raw = raw
+        self._ctxt = ctxt
+        self._serializer = serializer
+        self._value = self._unset
+
+    @property
+    def value(self):
+        """The deserialized argument."""
+        if self._value is self._unset:
+            self._value = self._serializer.deserialize_entity(self._ctxt,
+                                                              self.raw)
+        return self._value
+
+
+def lazy_args(func):
+    """Decorate an endpoint method to be passed LazyArgument objects."""
+    func.lazy_args = True
+    return func
+
+
+def _freeze(value):
+    # An equivalent of a context's contents which may be hashed
+    if isinstance(value, dict):
+        return frozenset([(k, _freeze(v)) for k, v in value.iteritems()])
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(v) for v in value])
+    return value
+
+
+def _is_lazy(endpoint, method):
+    # The method is looked up on the class, so the decorated function is
+    # found even if the method is wrapped or stubbed on the endpoint
+    func = getattr(type(endpoint), method, None)
+    return (getattr(func, 'lazy_args', False) is True or
+            getattr(endpoint, 'lazy_args', False) is True)
+
+
 class RPCDispatcher(object):
     """A message dispatcher which understands RPC messages.
 
@@ -69,11 +131,30 @@ class RPCDispatcher(object):
     Endpoints may have a target attribute describing the namespace and version
     of the methods exposed by that object. All public methods on an endpoint
     object are remotely invokable by clients.
+
+    Only the namespace, version and method values are examined before an
+    endpoint method is chosen. Methods which opt in with lazy_args() are
+    passed their arguments as LazyArgument objects which are only
+    deserialized when their value is used.
+
+    If a context_factory is supplied, it is called with the request context
+    dict of each dispatched message and the object it returns - e.g. a
+    RequestContext - is passed to the endpoint method and the serializer in
+    place of the dict. If context_cache_size is also set, that many context
+    objects are cached, keyed by the contents of their dicts, so messages
+    with identical contexts share one object. This only pays off if building
+    a context object costs more than hashing its dict, and is only safe if
+    endpoints and serializers treat context objects as read-only.
     """
 
-    def __init__(self, endpoints, serializer):
+    def __init__(self, endpoints, serializer, context_factory=None,
+                 context_cache_size=0):
         self.endpoints = endpoints
         self.serializer = serializer or msg_serializer.NoOpSerializer()
+        self.context_factory = context_factory
+        self._context_cache = None
+        if context_factory is not None and context_cache_size:
+            self._context_cache = utils.LRUCache(context_cache_size)
         self._default_target = target.Target()
 
     @staticmethod
@@ -85,26 +166,79 @@ class RPCDispatcher(object):
         endpoint_version = target.version or '1.0'
         return utils.version_is_compatible(endpoint_version, version)
 
+    @staticmethod
+    def _context_key(ctxt):
+        # A context resolved from a reference carries the referenced id,
+        # which identifies its contents without looking at them
+        key = getattr(ctxt, 'context_id', None)
+        if key is not None:
+            return key
+        try:
+            key = _freeze(ctxt)
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _make_context(self, ctxt):
+        if self.context_factory is None:
+            return ctxt
+        if self._context_cache is None:
+            return self.context_factory(ctxt)
+        key = self._context_key(ctxt)
+        if key is None:
+            return self.context_factory(ctxt)
+        context = self._context_cache.get(key)
+        if context is None:
+            context = self.context_factory(ctxt)
+            self._context_cache.put(key, context)
+        return context
+
     def _dispatch(self, endpoint, method, ctxt, args):
-        new_args = dict()
-        for argname, arg in args.iteritems():
-            new_args[argname] = self.serializer.deserialize_entity(ctxt, arg)
+        ctxt = self._make_context(ctxt)
+        if _is_lazy(endpoint, method):
+            new_args = dict()
+            for argname, arg in args.iteritems():
+                new_args[argname] = LazyArgument(self.serializer, ctxt, arg)
+        else:
+            new_args = msg_serializer._deserialize_args(self.serializer,
+                                                        ctxt, args)
         result = getattr(endpoint, method)(ctxt, **new_args)
         return self.serializer.serialize_entity(ctxt, result)
 
+    def _dispatch_batch(self, batch):
+        for entry in batch:
+            try:
+                self(entry['ctxt'], entry['message'])
+            except Exception:
+                _LOG.exception("Failed to dispatch batched message %s",
+                               entry['message'].get('method'))
+
     def __call__(self, ctxt, message):
         """Dispatch an RPC message to the appropriate endpoint method.
 
+        A message may also contain a batch of cast()s, each with its own
+        request context, which are dispatched in turn. A failure to dispatch
+        one of them is logged and does not prevent the others from being
+        dispatched.
+
         :param ctxt: the request context
         :type ctxt: dict
-        :param message: the message payload
+        :param message: the message payload, which may be in an envelope
         :type message: dict
         :raises: NoSuchMethod, UnsupportedVersion
         """
-        method = message.get('method')
-        args = message.get('args', {})
-        namespace = message.get('namespace')
-        version = message.get('version', '1.0')
+        # Choose an endpoint using only the message header, so the rest of a
+        # message in a 3.0 envelope is only decoded if it is dispatched
+        header = common.msg_header(message)
+        method = header.get('method')
+        namespace = header.get('namespace')
+        version = header.get('version', '1.0')
+
+        if method is None:
+            message = common.deserialize_msg(message)
+            if 'batch' in message:
+                return self._dispatch_batch(message['batch'])
 
         found_compatible = False
         for endpoint in self.endpoints:
@@ -117,6 +251,7 @@ class RPCDispatcher(object):
                 continue
 
             if hasattr(endpoint, method):
+                args = common.deserialize_msg(message).get('args', {})
                 return self._dispatch(endpoint, method, ctxt, args)
 
             found_compatible = True
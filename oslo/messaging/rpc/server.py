@@ -87,7 +87,8 @@ via the server and fanout attributes on Target but the mode used is transparent
 to the server.
 
 The first parameter to method invocations is always the request context
-supplied by the client.
+supplied by the client. By supplying a context_factory, a server can turn the
+request context dict into an object of its own - e.g. a RequestContext.
 
 Parameters to the method invocation are primitive types and so must be the
 return values from the methods. By supplying a serializer object, a server can
@@ -96,7 +97,8 @@ deserialize arguments from - serialize return values to - primitive types.
 
 
 def get_rpc_server(transport, target, endpoints,
-                   executor='blocking', serializer=None):
+                   executor='blocking', serializer=None,
+                   context_factory=None, context_cache_size=0):
     """Construct an RPC server.
 
     The executor parameter controls how incoming messages will be received and
@@ -113,7 +115,13 @@ def get_rpc_server(transport, target, endpoints,
     :type executor: str
     :param serializer: an optional entity serializer
     :type serializer: Serializer
+    :param context_factory: builds a request context object from a context dict
+    :type context_factory: callable
+    :param context_cache_size: the number of context objects to cache
+    :type context_cache_size: int
     """
-    dispatcher = rpc_dispatcher.RPCDispatcher(endpoints, serializer)
+    dispatcher = rpc_dispatcher.RPCDispatcher(endpoints, serializer,
+                                              context_factory,
+                                              context_cache_size)
     return msg_server.MessageHandlingServer(transport, target,
                                             dispatcher, executor)
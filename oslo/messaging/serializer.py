@@ -12,11 +12,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-__all__ = ['Serializer', 'NoOpSerializer']
+__all__ = ['Serializer', 'NoOpSerializer', 'RegistrySerializer']
 
 """Provides the definition of a message serialization handler"""
 
 import abc
+import inspect
+import types
 
 
 class Serializer(object):
@@ -41,6 +43,28 @@ class Serializer(object):
         :returns: Deserialized form of entity
         """
 
+    def serialize_args(self, ctxt, args):
+        """Serialize each of the values in a dict of method arguments.
+
+        :param context: Request context
+        :param args: Arguments to be serialized
+        :type args: dict
+        :returns: A new dict of the serialized arguments
+        """
+        return dict([(argname, self.serialize_entity(ctxt, arg))
+                     for argname, arg in args.iteritems()])
+
+    def deserialize_args(self, ctxt, args):
+        """Deserialize each of the values in a dict of method arguments.
+
+        :param context: Request context
+        :param args: Arguments to be deserialized
+        :type args: dict
+        :returns: A new dict of the deserialized arguments
+        """
+        return dict([(argname, self.deserialize_entity(ctxt, arg))
+                     for argname, arg in args.iteritems()])
+
 
 class NoOpSerializer(Serializer):
     """A serializer that does nothing."""
@@ -50,3 +74,113 @@ class NoOpSerializer(Serializer):
 
     def deserialize_entity(self, ctxt, entity):
         return entity
+
+
+_MISSING = object()
+
+
+class RegistrySerializer(Serializer):
+    """A serializer which dispatches on the type of each entity.
+
+    Functions which serialize or deserialize entities of a type are registered
+    with register_serializer() and register_deserializer(). An entity is
+    handled by the function registered for the first class in its type's
+    method resolution order which has one, and is returned unchanged if there
+    is none. The function found for each type is cached, so it is only looked
+    up once.
+
+    Deserializers are chosen by the type of the primitive - e.g. a function
+    registered for dict is passed every dict, and must return those it does
+    not recognise unchanged.
+    """
+
+    _MAX_CACHED_TYPES = 1024
+
+    def __init__(self):
+        self._serializers = {}
+        self._deserializers = {}
+        self._serializer_cache = {}
+        self._deserializer_cache = {}
+
+    def register_serializer(self, cls, func):
+        """Register a function which serializes entities of a type.
+
+        :param cls: the type of entity, including its subclasses
+        :type cls: type
+        :param func: called with the request context and the entity
+        :type func: callable
+        """
+        self._serializers[cls] = func
+        self._serializer_cache.clear()
+
+    def register_deserializer(self, cls, func):
+        """Register a function which deserializes primitives of a type.
+
+        :param cls: the type of primitive, including its subclasses
+        :type cls: type
+        :param func: called with the request context and the primitive
+        :type func: callable
+        """
+        self._deserializers[cls] = func
+        self._deserializer_cache.clear()
+
+    def _lookup(self, funcs, cache, entity):
+        cls = type(entity)
+        if isinstance(entity, types.InstanceType):
+            # Old-style instances all share a type, so aren't cached
+            cls = entity.__class__
+            cache = {}
+        func = cache.get(cls, _MISSING)
+        if func is _MISSING:
+            func = None
+            for base in inspect.getmro(cls):
+                func = funcs.get(base)
+                if func is not None:
+                    break
+            if len(cache) < self._MAX_CACHED_TYPES:
+                cache[cls] = func
+        return func
+
+    def _convert(self, funcs, cache, ctxt, entity):
+        func = cache.get(type(entity), _MISSING)
+        if func is _MISSING:
+            func = self._lookup(funcs, cache, entity)
+        return entity if func is None else func(ctxt, entity)
+
+    def _convert_args(self, funcs, cache, ctxt, args):
+        new_args = {}
+        for argname, arg in args.iteritems():
+            func = cache.get(type(arg), _MISSING)
+            if func is _MISSING:
+                func = self._lookup(funcs, cache, arg)
+            new_args[argname] = arg if func is None else func(ctxt, arg)
+        return new_args
+
+    def serialize_entity(self, ctxt, entity):
+        return self._convert(self._serializers, self._serializer_cache,
+                             ctxt, entity)
+
+    def deserialize_entity(self, ctxt, entity):
+        return self._convert(self._deserializers, self._deserializer_cache,
+                             ctxt, entity)
+
+    def serialize_args(self, ctxt, args):
+        return self._convert_args(self._serializers, self._serializer_cache,
+                                  ctxt, args)
+
+    def deserialize_args(self, ctxt, args):
+        return self._convert_args(self._deserializers,
+                                  self._deserializer_cache, ctxt, args)
+
+
+def _serialize_args(serializer, ctxt, args):
+    # Serializers needn't inherit from Serializer, so may lack serialize_args
+    if isinstance(serializer, Serializer):
+        return serializer.serialize_args(ctxt, args)
+    return Serializer.serialize_args.im_func(serializer, ctxt, args)
+
+
+def _deserialize_args(serializer, ctxt, args):
+    if isinstance(serializer, Serializer):
+        return serializer.deserialize_args(ctxt, args)
+    return Serializer.deserialize_args.im_func(serializer, ctxt, args)
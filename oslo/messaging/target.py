@@ -57,31 +57,85 @@ class Target(object):
       servers listening on a topic by setting fanout to ``True``, rather than
       just one of them.
     :type fanout: bool
+
+    Targets are immutable and hashable, so they may be used as dict keys. To
+    vary one or more attributes of a target, call it with the new values::
+
+        target = messaging.Target(topic='compute')
+        direct = target(server='host1')
     """
 
+    __slots__ = ('exchange', 'topic', 'namespace', 'version', 'server',
+                 'fanout', 'routing_key', '_key', '_hash')
+
+    # Recently derived targets, so that deriving the same target again - e.g.
+    # by RPCClient.prepare() for every method invocation - allocates nothing
+    _interned = {}
+    _max_interned = 1024
+
     def __init__(self, exchange=None, topic=None, namespace=None,
                  version=None, server=None, fanout=None):
-        self.exchange = exchange
-        self.topic = topic
-        self.namespace = namespace
-        self.version = version
-        self.server = server
-        self.fanout = fanout
+        key = (exchange, topic, namespace, version, server, fanout)
+        init = super(Target, self).__setattr__
+        init('exchange', exchange)
+        init('topic', topic)
+        init('namespace', namespace)
+        init('version', version)
+        init('server', server)
+        init('fanout', fanout)
+        init('routing_key', (exchange, topic, server))
+        init('_key', key)
+        try:
+            init('_hash', hash(key))
+        except TypeError:
+            init('_hash', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Target objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Target objects are immutable')
+
+    def __reduce__(self):
+        return (Target, self._key)
 
     def __call__(self, **kwargs):
-        kwargs.setdefault('exchange', self.exchange)
-        kwargs.setdefault('topic', self.topic)
-        kwargs.setdefault('namespace', self.namespace)
-        kwargs.setdefault('version', self.version)
-        kwargs.setdefault('server', self.server)
-        kwargs.setdefault('fanout', self.fanout)
-        return Target(**kwargs)
+        if not kwargs:
+            return self
+        exchange, topic, namespace, version, server, fanout = self._key
+        key = (kwargs.pop('exchange', exchange),
+               kwargs.pop('topic', topic),
+               kwargs.pop('namespace', namespace),
+               kwargs.pop('version', version),
+               kwargs.pop('server', server),
+               kwargs.pop('fanout', fanout))
+        if kwargs:
+            raise TypeError('Unexpected Target attributes: %s' %
+                            ', '.join(sorted(kwargs)))
+        try:
+            target = self._interned.get(key)
+        except TypeError:
+            # An unhashable attribute value can't be interned
+            return Target(*key)
+        if target is None:
+            target = Target(*key)
+            if len(self._interned) < self._max_interned:
+                target = self._interned.setdefault(key, target)
+        return target
 
     def __eq__(self, other):
-        return vars(self) == vars(other)
+        if not isinstance(other, Target):
+            return NotImplemented
+        return self._key == other._key
 
     def __ne__(self, other):
-        return not self == other
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        if self._hash is None:
+            raise TypeError('Target with unhashable attributes: %r' % self)
+        return self._hash
 
     def __repr__(self):
         attrs = []
@@ -76,11 +76,19 @@ class Transport(object):
         self._driver = driver
 
     def _send(self, target, ctxt, message,
-              wait_for_reply=None, timeout=None, envelope=False):
+              wait_for_reply=None, timeout=None, envelope=None,
+              priority=None):
         return self._driver.send(target, ctxt, message,
                                  wait_for_reply=wait_for_reply,
                                  timeout=timeout,
-                                 envelope=envelope)
+                                 envelope=envelope,
+                                 priority=priority)
+
+    def _send_async(self, target, ctxt, message, envelope=None,
+                    priority=None):
+        return self._driver.send_async(target, ctxt, message,
+                                       envelope=envelope,
+                                       priority=priority)
 
     def _listen(self, target):
         return self._driver.listen(target)
@@ -0,0 +1,63 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo.messaging._drivers import attachments
+from oslo.messaging._drivers import common
+from tests import utils as test_utils
+
+
+class ExtractTestCase(test_utils.BaseTestCase):
+
+    def test_no_attachments(self):
+        message = dict(method='foo', args=dict(a=[1, dict(b='c')]))
+        extracted, found = attachments.extract(message)
+        self.assertTrue(extracted is message)
+        self.assertEqual(found, [])
+        self.assertTrue(attachments.restore(extracted, found) is message)
+
+    def test_extract_and_restore(self):
+        blob = bytearray(b'\x00\x01')
+        view = memoryview(b'abc')
+        message = dict(method='foo',
+                       args=dict(a=blob, b=[1, view], c=dict(d='e')))
+
+        extracted, found = attachments.extract(message)
+        self.assertEqual(len(found), 2)
+        self.assertTrue(blob in found)
+        self.assertTrue(extracted['args']['c'] is message['args']['c'])
+        self.assertEqual(message['args']['a'], blob)
+
+        restored = attachments.restore(extracted, found)
+        self.assertTrue(restored['args']['a'] is blob)
+        self.assertTrue(restored['args']['b'][1] is view)
+        self.assertEqual(restored['args']['c'], dict(d='e'))
+
+
+class EnvelopeTestCase(test_utils.BaseTestCase):
+
+    def test_round_trip(self):
+        blob = bytearray(b'\xff' * 1024)
+        message = dict(method='foo', args=dict(image=blob))
+
+        msg = common.serialize_msg(message, '3.0')
+        self.assertTrue(msg['oslo.attachments'][0] is blob)
+        self.assertFalse('\\xff' in msg['oslo.message'])
+
+        self.assertTrue(
+            common.deserialize_msg(msg)['args']['image'] is blob)
+
+    def test_not_in_v2(self):
+        message = dict(method='foo', args=dict(a=1))
+        msg = common.serialize_msg(message, '2.0')
+        self.assertEqual(sorted(msg.keys()), ['oslo.message', 'oslo.version'])
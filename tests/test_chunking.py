@@ -0,0 +1,103 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from oslo.messaging._drivers import chunking
+from oslo.messaging._drivers import common
+from tests import utils as test_utils
+
+_message = dict(method='foo', args=dict(a='x' * 100))
+
+
+class SplitTestCase(test_utils.BaseTestCase):
+
+    def test_not_split(self):
+        msg = common.serialize_msg(_message, '3.0')
+        self.assertEqual(chunking.split_msg(msg, None), [msg])
+        self.assertEqual(chunking.split_msg(msg, 1000), [msg])
+        self.assertEqual(chunking.split_msg(_message, 10), [_message])
+
+    def test_v2_not_split(self):
+        msg = common.serialize_msg(_message, '2.0')
+        self.assertTrue(len(msg['oslo.message']) > 30)
+        self.assertEqual(chunking.split_msg(msg, 30), [msg])
+
+    def test_split(self):
+        msg = common.serialize_msg(_message, '3.0')
+        chunks = chunking.split_msg(msg, 30)
+
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[0]['oslo.header'], dict(method='foo'))
+        for seq, chunk in enumerate(chunks):
+            self.assertTrue(chunking.is_chunk(chunk))
+            self.assertEqual(chunk['oslo.chunk'][1:], [seq, 4])
+            self.assertEqual(chunking.chunk_id(chunk),
+                             chunking.chunk_id(chunks[0]))
+            self.assertTrue(len(chunk['oslo.message']) <= 30)
+        self.assertFalse('oslo.header' in chunks[1])
+
+
+class ReassemblerTestCase(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(ReassemblerTestCase, self).setUp()
+        self.msg = common.serialize_msg(_message, '3.0')
+        self.chunks = chunking.split_msg(self.msg, 30)
+
+    def test_reassemble(self):
+        reassembler = chunking.Reassembler(1000)
+        other = chunking.split_msg(common.serialize_msg(_message, '3.0'), 50)
+
+        self.assertTrue(reassembler.add(self.chunks[0]) is None)
+        self.assertTrue(reassembler.add(other[0]) is None)
+        self.assertTrue(reassembler.add(self.chunks[1]) is None)
+        self.assertTrue(reassembler.add(self.chunks[2]) is None)
+        self.assertTrue(reassembler.add(other[1]) is None)
+        self.assertEqual(reassembler.add(self.chunks[3]), self.msg)
+        self.assertEqual(common.deserialize_msg(reassembler.add(other[2])),
+                         _message)
+
+    def test_bounded(self):
+        reassembler = chunking.Reassembler(50)
+
+        self.assertTrue(reassembler.add(self.chunks[0]) is None)
+        self.assertTrue(reassembler.add(self.chunks[1]) is None)
+        # The message is dropped, and so are its later chunks
+        self.assertTrue(reassembler.add(self.chunks[2]) is None)
+        self.assertTrue(reassembler.add(self.chunks[3]) is None)
+
+        # Nothing remains buffered
+        small = chunking.split_msg(self.msg, 45)
+        for chunk in small[:-1]:
+            self.assertTrue(reassembler.add(chunk) is None)
+
+    def test_out_of_order(self):
+        reassembler = chunking.Reassembler(1000)
+
+        self.assertTrue(reassembler.add(self.chunks[0]) is None)
+        self.assertTrue(reassembler.add(self.chunks[2]) is None)
+        self.assertTrue(reassembler.add(self.chunks[1]) is None)
+        self.assertTrue(reassembler.add(self.chunks[3]) is None)
+
+    def test_timeout(self):
+        reassembler = chunking.Reassembler(1000, timeout=10)
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+
+        self.assertTrue(reassembler.add(self.chunks[0]) is None)
+        now[0] += 11
+        self.assertTrue(reassembler.add(self.chunks[1]) is None)
+        self.assertTrue(reassembler.add(self.chunks[2]) is None)
+        self.assertTrue(reassembler.add(self.chunks[3]) is None)
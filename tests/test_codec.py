@@ -0,0 +1,90 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import testscenarios
+import testtools
+
+from oslo.messaging._drivers import codec
+from oslo.messaging._drivers import common
+from tests import utils as test_utils
+
+load_tests = testscenarios.load_tests_apply_scenarios
+
+_message = dict(method='foo', args=dict(a=1, b=[2.5, None, True],
+                                        c=dict(d=u'\u2603')))
+
+
+class CodecTestCase(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('json', dict(codec='json')),
+        ('msgpack', dict(codec='msgpack')),
+    ]
+
+    def setUp(self):
+        super(CodecTestCase, self).setUp()
+        if self.codec == 'msgpack' and codec.msgpack is None:
+            self.skipTest('msgpack is not installed')
+
+    def test_round_trip(self):
+        c = codec.get_codec(self.codec)
+        self.assertEqual(c.name, self.codec)
+        self.assertEqual(c.decode(c.encode(_message)), _message)
+
+    def test_check(self):
+        c = codec.get_codec(self.codec)
+        c.check(_message)
+        self.assertRaises(TypeError, c.check, dict(a=object()))
+
+    def test_envelope(self):
+        msg = common.serialize_msg(_message, '3.0', self.codec)
+        self.assertEqual(msg.get('oslo.codec', 'json'), self.codec)
+        self.assertEqual(common.msg_header(msg), dict(method='foo'))
+        self.assertEqual(common.deserialize_msg(msg), _message)
+
+
+class MsgPackTestCase(test_utils.BaseTestCase):
+
+    @testtools.skipIf(codec.msgpack is None, 'msgpack is not installed')
+    def test_extension_types(self):
+        c = codec.get_codec('msgpack')
+        now = datetime.datetime(2013, 7, 1, 12, 30, 15, 1234)
+        obj = dict(at=now, tags=set(['a', 'b']))
+        self.assertEqual(c.decode(c.encode(obj)), obj)
+        c.check(obj)
+
+    @testtools.skipIf(codec.msgpack is None, 'msgpack is not installed')
+    def test_datetime_as_bytes(self):
+        c = codec.get_codec('msgpack')
+        now = datetime.datetime(2013, 7, 1, 12, 30, 15, 1234)
+        ext = c._ext(now)
+        self.assertTrue(isinstance(ext.data, bytes))
+        self.assertEqual(c._ext_hook(ext.code, ext.data), now)
+
+
+class GetCodecTestCase(test_utils.BaseTestCase):
+
+    def test_default(self):
+        self.assertEqual(codec.get_codec().name, 'json')
+        self.assertTrue(codec.get_codec() is codec.get_codec('json'))
+
+    def test_unknown(self):
+        self.assertRaises(codec.UnsupportedCodec, codec.get_codec, 'foo')
+
+    def test_missing_library(self):
+        self.stubs.Set(codec, 'msgpack', None)
+        self.stubs.Set(codec, '_instances', {})
+        self.assertRaises(codec.UnsupportedCodec, codec.get_codec, 'msgpack')
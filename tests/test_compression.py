@@ -0,0 +1,73 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo.config import cfg
+
+from oslo.messaging._drivers import common
+from oslo.messaging._drivers import compression
+from tests import utils as test_utils
+
+_message = dict(method='foo', args=dict(network_info=[dict(vif='tap0')] * 50))
+
+
+class CompressionTestCase(test_utils.BaseTestCase):
+
+    def test_below_threshold(self):
+        compressor = compression.Compressor(threshold=100000)
+        msg = common.serialize_msg(_message, '3.0', compressor=compressor)
+        self.assertFalse('oslo.compression' in msg)
+        self.assertTrue(common.decompress_msg(msg) is msg)
+        self.assertEqual(common.deserialize_msg(msg), _message)
+
+    def test_disabled(self):
+        compressor = compression.Compressor()
+        msg = common.serialize_msg(_message, '3.0', compressor=compressor)
+        self.assertFalse('oslo.compression' in msg)
+
+    def test_compressed(self):
+        plain = common.serialize_msg(_message, '3.0')
+        compressor = compression.Compressor(threshold=100, level=9)
+        msg = common.serialize_msg(_message, '3.0', compressor=compressor)
+
+        self.assertEqual(msg['oslo.compression'], 'zlib')
+        self.assertTrue(len(msg['oslo.message']) <
+                        len(plain['oslo.message']) / 10)
+        self.assertEqual(common.msg_header(msg), dict(method='foo'))
+
+        decompressed = common.decompress_msg(msg)
+        self.assertEqual(decompressed, plain)
+        self.assertEqual(msg['oslo.compression'], 'zlib')
+
+        self.assertEqual(common.deserialize_msg(msg), _message)
+
+    def test_unsupported_method(self):
+        msg = common.serialize_msg(_message, '3.0')
+        msg['oslo.compression'] = 'foo'
+        self.assertRaises(compression.UnsupportedCompression,
+                          common.deserialize_msg, msg)
+
+
+class FromConfTestCase(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(FromConfTestCase, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(compression._compression_opts)
+
+    def test_from_conf(self):
+        self.config(message_compression_threshold=10,
+                    message_compression_level=1)
+
+        compressor = compression.Compressor.from_conf(self.conf)
+        self.assertEqual(compressor.threshold, 10)
+        self.assertEqual(compressor.level, 1)
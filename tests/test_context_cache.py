@@ -0,0 +1,152 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import testscenarios
+
+from oslo import messaging
+from oslo.messaging._drivers import context_cache
+from tests import utils as test_utils
+
+load_tests = testscenarios.load_tests_apply_scenarios
+
+_ctxt = dict(user='bob', project='x', roles=['a'], request_id='1')
+
+
+class EncodeTestCase(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('same', dict(ctxt=dict(_ctxt),
+                      expected={'oslo.context_id': None})),
+        ('delta', dict(ctxt=dict(_ctxt, request_id='2'),
+                       expected={'oslo.context_base': None,
+                                 'oslo.context_delta': dict(request_id='2')})),
+        ('removed', dict(ctxt=dict(user='bob', project='x', request_id='1'),
+                         expected={'oslo.context_base': None,
+                                   'oslo.context_delta': {},
+                                   'oslo.context_removed': ['roles']})),
+        ('large_delta', dict(ctxt=dict(user='alice', project='y'),
+                             expected={'oslo.context_id': None,
+                                       'oslo.context': dict(user='alice',
+                                                            project='y')})),
+    ]
+
+    def test_encode(self):
+        encoder = context_cache.ContextEncoder(2)
+        decoder = context_cache.ContextDecoder(10)
+        target = messaging.Target(topic='testtopic', server='testserver')
+
+        encoded = encoder.encode(target, _ctxt)
+        self.assertEqual(encoded['oslo.context'], _ctxt)
+        self.assertEqual(decoder.decode(encoded), _ctxt)
+
+        encoded = encoder.encode(target, self.ctxt)
+        self.assertEqual(sorted(encoded.keys()), sorted(self.expected.keys()))
+        for key, value in self.expected.items():
+            if value is not None:
+                self.assertEqual(encoded[key], value)
+        self.assertEqual(decoder.decode(encoded), self.ctxt)
+
+
+class ContextCacheTestCase(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(ContextCacheTestCase, self).setUp()
+        self.encoder = context_cache.ContextEncoder(2)
+        self.decoder = context_cache.ContextDecoder(10)
+        self.target = messaging.Target(topic='testtopic', server='testserver')
+        self.ctxt = dict(_ctxt, roles=['a'])
+
+    def _roundtrip(self, ctxt, target=None):
+        encoded = self.encoder.encode(target or self.target, ctxt)
+        self.assertEqual(self.decoder.decode(encoded), ctxt)
+        return encoded
+
+    def test_mutated_context(self):
+        self._roundtrip(self.ctxt)
+        self.ctxt['roles'].append('b')
+        encoded = self._roundtrip(self.ctxt)
+        self.assertEqual(encoded['oslo.context_delta'],
+                         dict(roles=['a', 'b']))
+
+    def test_context_id(self):
+        full = self._roundtrip(self.ctxt)
+        ref = self.encoder.encode(self.target, self.ctxt)
+        delta = self.encoder.encode(self.target,
+                                    dict(self.ctxt, request_id='2'))
+        self.assertEqual(self.decoder.decode(ref).context_id,
+                         full['oslo.context_id'])
+        self.assertFalse(hasattr(self.decoder.decode(delta), 'context_id'))
+
+    def test_decoded_context_copied(self):
+        encoded = self.encoder.encode(self.target, self.ctxt)
+        self.decoder.decode(encoded)['user'] = 'alice'
+        encoded = self.encoder.encode(self.target, self.ctxt)
+        self.assertEqual(self.decoder.decode(encoded)['user'], 'bob')
+
+    def test_remembers_size_contexts(self):
+        ctxts = [dict(user=u) for u in ('a', 'b', 'c')]
+        for ctxt in ctxts:
+            self._roundtrip(ctxt)
+
+        self.assertFalse('oslo.context' in self._roundtrip(ctxts[1]))
+        self.assertFalse('oslo.context' in self._roundtrip(ctxts[2]))
+        self.assertTrue('oslo.context' in self._roundtrip(ctxts[0]))
+
+    def test_resent_after_max_uses(self):
+        self.encoder._MAX_USES = 2
+        sent_in_full = ['oslo.context' in self._roundtrip(self.ctxt)
+                        for i in range(4)]
+        self.assertEqual(sent_in_full, [True, False, False, True])
+
+    def test_per_server(self):
+        self._roundtrip(self.ctxt)
+        encoded = self._roundtrip(self.ctxt, self.target(server='other'))
+        self.assertTrue('oslo.context' in encoded)
+
+    def test_not_to_topic_or_fanout(self):
+        for target in (self.target(server=None),
+                       self.target(server=None, fanout=True)):
+            for i in range(2):
+                self.assertTrue(self.encoder.encode(target, self.ctxt)
+                                is self.ctxt)
+
+    def test_plain_contexts(self):
+        for ctxt in (None, {}, self.ctxt):
+            self.assertTrue(self.decoder.decode(ctxt) is ctxt)
+
+    def test_disabled(self):
+        encoder = context_cache.ContextEncoder(0)
+        self.assertTrue(encoder.encode(self.target, self.ctxt) is self.ctxt)
+
+    def test_unknown_context(self):
+        self.encoder.encode(self.target, self.ctxt)
+        ref = self.encoder.encode(self.target, self.ctxt)
+        delta = self.encoder.encode(self.target,
+                                    dict(self.ctxt, request_id='2'))
+        for encoded in (ref, delta):
+            self.assertRaises(context_cache.UnknownContext,
+                              self.decoder.decode, encoded)
+
+    def test_forget(self):
+        self._roundtrip(self.ctxt)
+        self.encoder.forget(self.target(server='other'))
+        self.assertFalse('oslo.context' in self._roundtrip(self.ctxt))
+        self.encoder.forget(self.target)
+        self.assertTrue('oslo.context' in self._roundtrip(self.ctxt))
+
+    def test_from_conf(self):
+        encoder = context_cache.ContextEncoder.from_conf(self.conf)
+        self.assertEqual(encoder.size, 0)
+        context_cache.ContextDecoder.from_conf(self.conf)
+        self.assertEqual(self.conf.message_context_receive_cache_size, 1024)
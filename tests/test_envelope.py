@@ -0,0 +1,111 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import pickle
+
+import testscenarios
+
+from oslo.messaging._drivers import common
+from tests import utils as test_utils
+
+load_tests = testscenarios.load_tests_apply_scenarios
+
+
+class EnvelopeTestCase(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('none', dict(version=None)),
+        ('v2', dict(version='2.0')),
+        ('v3', dict(version='3.0')),
+    ]
+
+    message = dict(method='foo', namespace='testnamespace', version='1.1',
+                   args=dict(a=1, b=[2, 3]))
+
+    def test_round_trip(self):
+        msg = common.serialize_msg(self.message, self.version)
+        self.assertEqual(common.is_envelope(msg), bool(self.version))
+        self.assertEqual(common.deserialize_msg(msg), self.message)
+
+    def test_header(self):
+        msg = common.serialize_msg(self.message, self.version)
+        header = common.msg_header(msg)
+        for key in ('method', 'namespace', 'version'):
+            self.assertEqual(header[key], self.message[key])
+
+
+class HeaderTestCase(test_utils.BaseTestCase):
+
+    def test_header_not_decoded(self):
+        msg = common.serialize_msg(dict(method='foo', args=dict(a=1)), '3.0')
+        self.assertEqual(msg['oslo.header'], dict(method='foo'))
+
+        self.mox.StubOutWithMock(common.jsonutils, 'loads')
+        self.mox.ReplayAll()
+
+        self.assertEqual(common.msg_header(msg), dict(method='foo'))
+
+    def test_unsupported_version(self):
+        for version in ('4.0', '3.1', 'foo', None):
+            msg = {'oslo.version': version, 'oslo.message': '{}'}
+            self.assertRaises(common.UnsupportedEnvelope,
+                              common.deserialize_msg, msg)
+
+        self.assertRaises(common.UnsupportedEnvelope,
+                          common.serialize_msg, {}, '4.0')
+
+    def test_envelope_major(self):
+        self.assertEqual(common.envelope_major(None), 1)
+        self.assertEqual(common.envelope_major('2.0'), 2)
+        self.assertEqual(common.envelope_major('3.0'), 3)
+        self.assertRaises(common.UnsupportedEnvelope,
+                          common.envelope_major, '4.0')
+
+
+class EncodedMessageTestCase(test_utils.BaseTestCase):
+
+    def test_encoded_once(self):
+        message = common.EncodedMessage(event_type='foo', payload=dict(a=1))
+
+        self.mox.StubOutWithMock(common.jsonutils, 'dumps')
+        common.jsonutils.dumps(message).AndReturn('encoded')
+        self.mox.ReplayAll()
+
+        for i in range(2):
+            msg = common.serialize_msg(message, '2.0')
+            self.assertEqual(msg['oslo.message'], 'encoded')
+        self.assertEqual(common.to_json(message), 'encoded')
+
+    def test_round_trip(self):
+        message = common.EncodedMessage(event_type='foo', payload=dict(a=1))
+        msg = common.serialize_msg(message, '2.0')
+        self.assertEqual(common.deserialize_msg(msg), message)
+
+    def test_from_json(self):
+        encoding = '{"event_type": "foo"}'
+        self.mox.StubOutWithMock(common.jsonutils, 'dumps')
+        self.mox.ReplayAll()
+
+        message = common.EncodedMessage.from_json(encoding)
+        self.assertEqual(message, dict(event_type='foo'))
+        self.assertTrue(common.to_json(message) is encoding)
+
+    def test_pickle(self):
+        message = common.EncodedMessage(event_type='foo')
+        message.to_json()
+
+        unpickled = pickle.loads(pickle.dumps(message))
+        self.assertTrue(isinstance(unpickled, common.EncodedMessage))
+        self.assertEqual(unpickled, message)
+        self.assertEqual(unpickled.to_json(), message.to_json())
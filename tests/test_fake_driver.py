@@ -0,0 +1,251 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import Queue
+import sys
+import threading
+
+from oslo.config import cfg
+import testscenarios
+
+from oslo import messaging
+from oslo.messaging._drivers import chunking
+from oslo.messaging._drivers import codec
+from oslo.messaging._drivers import common
+from oslo.messaging._drivers import context_cache
+from oslo.messaging._drivers import impl_fake
+from tests import utils as test_utils
+
+load_tests = testscenarios.load_tests_apply_scenarios
+
+
+class TestFakeIncomingMessage(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestFakeIncomingMessage, self).setUp(conf=cfg.ConfigOpts())
+        self.driver = impl_fake.FakeDriver(self.conf)
+        self.target = messaging.Target(topic='testtopic', server='testserver')
+
+    def _incoming(self):
+        listener = self.driver.listen(self.target)
+        self.driver.send(self.target, {'a': 'b'}, {'method': 'foo'})
+        return listener.poll()
+
+    def test_attributes(self):
+        incoming = self._incoming()
+        self.assertTrue(incoming.conf is self.conf)
+        self.assertEqual(incoming.ctxt, {'a': 'b'})
+        self.assertEqual(incoming.message, {'method': 'foo'})
+
+    def test_no_dict(self):
+        incoming = self._incoming()
+        self.assertFalse(hasattr(incoming, '__dict__'))
+        self.assertRaises(AttributeError, setattr, incoming, 'foo', 'bar')
+
+    def test_smaller_than_dict(self):
+        class DictMessage(object):
+            def __init__(self, listener, ctxt, message, reply_q):
+                self.conf = listener.conf
+                self.listener = listener
+                self.ctxt = ctxt
+                self.message = message
+                self._reply_q = reply_q
+
+        incoming = self._incoming()
+        plain = DictMessage(incoming.listener, incoming.ctxt,
+                            incoming.message, None)
+        self.assertTrue(sys.getsizeof(incoming) <
+                        sys.getsizeof(plain) + sys.getsizeof(plain.__dict__))
+
+    def test_reply_waiter_no_dict(self):
+        waiter = self.driver.send_async(self.target, {}, {'method': 'foo'})
+        self.assertFalse(hasattr(waiter, '__dict__'))
+
+
+class _PermissiveCodec(codec.JSONCodec):
+
+    name = 'permissive'
+
+    def check(self, obj):
+        pass
+
+
+class TestCheckSerialize(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('no_envelope', dict(envelope=None, strict=True)),
+        ('v2', dict(envelope='2.0', strict=True)),
+        ('v3', dict(envelope='3.0', strict=False)),
+    ]
+
+    def test_codec_check(self):
+        driver = impl_fake.FakeDriver(cfg.ConfigOpts())
+        driver._codec = _PermissiveCodec()
+
+        message = dict(method='foo', args=dict(tags=set(['a'])))
+        if self.strict:
+            self.assertRaises(TypeError, driver._check_serialize,
+                              message, self.envelope)
+        else:
+            driver._check_serialize(message, self.envelope)
+
+
+class TestAttachments(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('no_envelope', dict(envelope=None, attached=False)),
+        ('v2', dict(envelope='2.0', attached=False)),
+        ('v3', dict(envelope='3.0', attached=True)),
+    ]
+
+    def test_by_reference(self):
+        driver = impl_fake.FakeDriver(cfg.ConfigOpts())
+        target = messaging.Target(topic='testtopic', server='testserver')
+        listener = driver.listen(target)
+
+        blob = bytearray(b'\x00' * 1024)
+        message = dict(method='foo', args=dict(blob=blob))
+
+        if not self.attached:
+            self.assertRaises(TypeError, driver.send, target, {}, message,
+                              envelope=self.envelope)
+            return
+
+        driver.send(target, {}, message, envelope=self.envelope)
+
+        message = common.deserialize_msg(listener.poll().message)
+        self.assertTrue(message['args']['blob'] is blob)
+
+
+class TestChunking(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestChunking, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(chunking._chunking_opts)
+        self.config(message_chunk_size=20)
+        self.driver = impl_fake.FakeDriver(self.conf)
+
+    def test_chunked_to_topic(self):
+        target = messaging.Target(topic='testtopic')
+        listener_a = self.driver.listen(target(server='a'))
+        listener_b = self.driver.listen(target(server='b'))
+
+        big = dict(method='foo', args=dict(a='x' * 100))
+        self.driver.send(target, {}, big, envelope='3.0')
+        self.driver.send(target, {}, dict(method='bar'), envelope='3.0')
+
+        incoming = listener_b.poll()
+        self.assertFalse(chunking.is_chunk(incoming.message))
+        self.assertEqual(common.deserialize_msg(incoming.message), big)
+
+        incoming = listener_a.poll()
+        self.assertEqual(common.deserialize_msg(incoming.message),
+                         dict(method='bar'))
+
+    def test_not_chunked_without_envelope(self):
+        target = messaging.Target(topic='testtopic', server='a')
+        listener = self.driver.listen(target)
+
+        big = dict(method='foo', args=dict(a='x' * 100))
+        self.driver.send(target, {}, big)
+
+        self.assertEqual(listener.poll().message, big)
+
+    def test_v2_not_chunked(self):
+        target = messaging.Target(topic='testtopic', server='a')
+        exchange = self.driver._get_exchange(self.driver._default_exchange)
+
+        big = dict(method='foo', args=dict(a='x' * 100))
+        self.driver.send(target, {}, big, envelope='2.0')
+
+        message = exchange.poll(target)[1]
+        self.assertFalse(chunking.is_chunk(message))
+        self.assertEqual(message, common.serialize_msg(big, '2.0'))
+        self.assertEqual(exchange.poll(target), (None, None, None))
+
+
+class TestContextCache(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestContextCache, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(context_cache._context_cache_opts)
+        self.config(message_context_cache_size=2)
+        self.driver = impl_fake.FakeDriver(self.conf)
+        self.target = messaging.Target(topic='testtopic', server='testserver')
+
+    def _deliver(self, listener, ctxt):
+        self.driver.send_async(self.target, ctxt, {'method': 'foo'})
+        queue = self.driver._get_exchange(None)._get_server_queue(
+            'testtopic', 'testserver')
+        sent = queue[0][0][0]
+        return sent, listener.poll().ctxt
+
+    def test_references(self):
+        listener = self.driver.listen(self.target)
+        ctxt = dict(user='bob', project='x', roles=['a'], request_id='1')
+
+        sent, received = self._deliver(listener, ctxt)
+        self.assertTrue('oslo.context' in sent)
+        self.assertEqual(received, ctxt)
+
+        sent, received = self._deliver(listener, dict(ctxt))
+        self.assertEqual(sent.keys(), ['oslo.context_id'])
+        self.assertEqual(received, ctxt)
+
+        ctxt['request_id'] = '2'
+        sent, received = self._deliver(listener, ctxt)
+        self.assertEqual(sent['oslo.context_delta'], dict(request_id='2'))
+        self.assertEqual(received, ctxt)
+
+    def test_listener_restart(self):
+        ctxt = dict(user='bob')
+        self._deliver(self.driver.listen(self.target), ctxt)
+
+        listener = self.driver.listen(self.target)
+        replies = []
+
+        def server():
+            incoming = listener.poll()
+            replies.append(incoming.ctxt)
+            incoming.reply('ok')
+
+        thread = threading.Thread(target=server)
+        thread.daemon = True
+        thread.start()
+
+        reply = self.driver.send(self.target, ctxt, {'method': 'bar'},
+                                 wait_for_reply=True, timeout=5)
+        thread.join(5)
+
+        self.assertEqual(reply, 'ok')
+        self.assertEqual(replies, [ctxt])
+
+    def test_unknown_context_without_resend(self):
+        reply_q = Queue.Queue()
+        reply_q.put(context_cache.UnknownContext('x'))
+        waiter = impl_fake.FakeReplyWaiter(self.target, reply_q)
+        self.assertRaises(context_cache.UnknownContext, waiter.wait, 1)
+
+    def test_casts_in_full(self):
+        listener = self.driver.listen(self.target)
+        for i in range(2):
+            self.driver.send(self.target, dict(user='bob'), {'method': 'foo'})
+            self.assertEqual(listener.poll().ctxt, dict(user='bob'))
+
+    def test_not_to_topic(self):
+        target = messaging.Target(topic='testtopic')
+        listener = self.driver.listen(self.target)
+        for i in range(2):
+            self.driver.send(target, dict(user='bob'), {'method': 'foo'})
+            self.assertEqual(listener.poll().ctxt, dict(user='bob'))
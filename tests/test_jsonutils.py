@@ -0,0 +1,142 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import itertools
+import xmlrpclib
+
+import testscenarios
+
+from oslo.messaging.openstack.common import jsonutils
+from tests import utils as test_utils
+
+load_tests = testscenarios.load_tests_apply_scenarios
+
+
+class _Obj(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _IterItems(object):
+
+    def iteritems(self):
+        return iter([('a', 1), ('b', (2,))])
+
+
+class _Iter(object):
+
+    def __iter__(self):
+        return iter([1, (2,)])
+
+
+class _ClassIter(object):
+
+    __iter__ = None
+
+
+class _Dict(dict):
+    pass
+
+
+def _gen():
+    yield 1
+    yield 2
+
+
+class ToPrimitiveTestCase(test_utils.BaseTestCase):
+
+    _now = datetime.datetime(2013, 7, 8, 9, 10, 11, 12)
+    _strnow = '2013-07-08T09:10:11.000012'
+
+    scenarios = [
+        ('int', dict(value=1, kwargs={}, expected=1)),
+        ('unicode', dict(value=u'a', kwargs={}, expected=u'a')),
+        ('none', dict(value=None, kwargs={}, expected=None)),
+        ('dict', dict(value={'a': [1, (2, 3)]}, kwargs={},
+                      expected={'a': [1, [2, 3]]})),
+        ('dict_subclass', dict(value=_Dict(a=1), kwargs={},
+                               expected={'a': 1})),
+        ('datetime', dict(value=_now, kwargs={}, expected=_strnow)),
+        ('datetime_unconverted',
+         dict(value=_now, kwargs=dict(convert_datetime=False),
+              expected=_now)),
+        ('xmlrpc_datetime',
+         dict(value=xmlrpclib.DateTime(_now), kwargs={},
+              expected='2013-07-08T09:10:11.000000')),
+        ('count', dict(value=itertools.count(1), kwargs={},
+                       expected=u'count(1)')),
+        ('iteritems', dict(value=_IterItems(), kwargs={},
+                           expected={'a': 1, 'b': [2]})),
+        ('iter', dict(value=_Iter(), kwargs={},
+                      expected=[1, [2]])),
+        ('generator', dict(value=_gen(), kwargs={}, expected=[1, 2])),
+        ('set', dict(value=set([1]), kwargs={}, expected=[1])),
+        ('instance', dict(value=_Obj(a=1), kwargs={}, expected=None)),
+        ('instance_converted',
+         dict(value=_Obj(a=_Obj(b=1)), kwargs=dict(convert_instances=True),
+              expected={'a': {'b': 1}})),
+        ('class_with_iter', dict(value=_ClassIter, kwargs={},
+                                 expected=unicode(_ClassIter))),
+        ('function', dict(value=_gen, kwargs={}, expected=unicode(_gen))),
+        ('depth', dict(value=_Obj(a=_Obj(b=_Obj(c=1))),
+                       kwargs=dict(convert_instances=True, max_depth=1),
+                       expected={'a': '?'})),
+        ('depth_containers',
+         dict(value=[[[[[[1]]]]], {'a': {'b': {'c': {'d': 1}}}}],
+              kwargs=dict(max_depth=0),
+              expected=[[[[[[1]]]]], {'a': {'b': {'c': {'d': 1}}}}])),
+        ('depth_level', dict(value={'a': 1}, kwargs=dict(level=4),
+                             expected='?')),
+        ('depth_level_simple', dict(value=1, kwargs=dict(level=4),
+                                    expected=1)),
+    ]
+
+    def test_to_primitive(self):
+        expected = self.expected
+        if expected is None:
+            expected = self.value
+        self.assertEqual(jsonutils.to_primitive(self.value, **self.kwargs),
+                         expected)
+
+
+class ToPrimitiveCacheTestCase(test_utils.BaseTestCase):
+
+    def test_conversion_cached_per_type(self):
+        class Iter(_Iter):
+            pass
+
+        self.assertFalse(Iter in jsonutils._conversions)
+        jsonutils.to_primitive(Iter())
+        self.assertEqual(jsonutils._conversions[Iter], jsonutils._ITER)
+        del jsonutils._conversions[Iter]
+
+    def test_classes_not_cached(self):
+        jsonutils.to_primitive(_ClassIter)
+        jsonutils.to_primitive(_IterItems)
+        self.assertFalse(type in jsonutils._conversions)
+
+    def test_functions_not_cached(self):
+        jsonutils.to_primitive(_gen)
+        self.assertFalse(type(_gen) in jsonutils._conversions)
+
+    def test_order_of_side_effects(self):
+        gen = _gen()
+        self.assertEqual(jsonutils.to_primitive([gen, gen]), [[1, 2], []])
+
+    def test_cycle(self):
+        value = []
+        value.append(value)
+        self.assertRaises(RuntimeError, jsonutils.to_primitive, value)
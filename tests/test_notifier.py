@@ -15,12 +15,16 @@
 
 import logging
 import sys
+import threading
+import time
 import uuid
 
 import fixtures
 import testscenarios
 
 from oslo import messaging
+from oslo.messaging._drivers import common as driver_common
+from oslo.messaging._drivers import compression
 from oslo.messaging.notify import _impl_messaging
 from oslo.messaging.notify import _impl_test
 from oslo.messaging.notify import notifier as msg_notifier
@@ -38,7 +42,8 @@ class _FakeTransport(object):
         self.conf = conf
 
     def _send(self, target, ctxt, message,
-              wait_for_reply=None, timeout=None, envelope=False):
+              wait_for_reply=None, timeout=None, envelope=None,
+              priority=None):
         pass
 
 
@@ -83,6 +88,11 @@ class TestMessagingNotifier(test_utils.BaseTestCase):
         ('not_v2', dict(v2=False)),
     ]
 
+    _v3 = [
+        ('v3', dict(v3=True)),
+        ('not_v3', dict(v3=False)),
+    ]
+
     _topics = [
         ('no_topics', dict(topics=[])),
         ('single_topic', dict(topics=['notifications'])),
@@ -109,6 +119,7 @@ class TestMessagingNotifier(test_utils.BaseTestCase):
     def generate_scenarios(cls):
         cls.scenarios = testscenarios.multiply_scenarios(cls._v1,
                                                          cls._v2,
+                                                         cls._v3,
                                                          cls._topics,
                                                          cls._priority,
                                                          cls._payload,
@@ -131,6 +142,8 @@ class TestMessagingNotifier(test_utils.BaseTestCase):
             drivers.append('messaging')
         if self.v2:
             drivers.append('messagingv2')
+        if self.v3:
+            drivers.append('messagingv3')
 
         self.config(notification_driver=drivers)
         self.config(notification_topics=self.topics)
@@ -158,15 +171,18 @@ class TestMessagingNotifier(test_utils.BaseTestCase):
 
         sends = []
         if self.v1:
-            sends.append(dict(envelope=False))
+            sends.append(dict(envelope=None))
         if self.v2:
-            sends.append(dict(envelope=True))
+            sends.append(dict(envelope='2.0'))
+        if self.v3:
+            sends.append(dict(envelope='3.0'))
 
         for send_kwargs in sends:
             for topic in self.topics:
                 target = messaging.Target(topic='%s.%s' % (topic,
                                                            self.priority))
-                transport._send(target, self.ctxt, message, **send_kwargs)
+                transport._send(target, self.ctxt, message,
+                                **send_kwargs).InAnyOrder()
 
         self.mox.ReplayAll()
 
@@ -177,6 +193,27 @@ class TestMessagingNotifier(test_utils.BaseTestCase):
 TestMessagingNotifier.generate_scenarios()
 
 
+class TestMessagingV3Notifier(test_utils.BaseTestCase):
+
+    def test_compressed(self):
+        self.conf.register_opts(compression._compression_opts)
+        self.config(message_compression_threshold=10)
+        transport = messaging.get_transport(self.conf, url='fake:')
+        driver = _impl_messaging.MessagingV3Driver(self.conf,
+                                                   topics=['notifications'],
+                                                   transport=transport)
+
+        driver.notify({}, dict(event_type='test.notify', payload='x' * 100),
+                      'INFO')
+
+        exchange = transport._driver._get_exchange('openstack')
+        target = messaging.Target(topic='notifications.info')
+        message = exchange.poll(target)[1]
+        self.assertEqual(message['oslo.compression'], 'zlib')
+        self.assertEqual(driver_common.deserialize_msg(message)['payload'],
+                         'x' * 100)
+
+
 class TestSerializer(test_utils.BaseTestCase):
 
     def setUp(self):
@@ -260,3 +297,192 @@ class TestLogNotifier(test_utils.BaseTestCase):
         self.mox.ReplayAll()
 
         notifier.info({}, 'test.notify', 'bar')
+
+    def test_encoding_shared(self):
+        self.config(notification_driver=['log', 'test'])
+        self.addCleanup(_impl_test.reset)
+
+        notifier = messaging.Notifier(_FakeTransport(self.conf),
+                                      'test.localhost')
+        self.useFixture(fixtures.FakeLogger('oslo.messaging.notification'))
+
+        notifier.info({}, 'test.notify', 'bar')
+
+        message = _impl_test.NOTIFICATIONS[0][1]
+        self.assertTrue(isinstance(message, driver_common.EncodedMessage))
+
+        self.mox.StubOutWithMock(driver_common.jsonutils, 'dumps')
+        self.mox.ReplayAll()
+
+        msg = driver_common.serialize_msg(message, '2.0')
+        self.assertEqual(driver_common.deserialize_msg(msg), message)
+
+
+class TestAsyncNotifier(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestAsyncNotifier, self).setUp()
+        self.addCleanup(_impl_test.reset)
+
+    def _notifier(self, asynchronous=True):
+        notifier = messaging.Notifier(_FakeTransport(self.conf),
+                                      'test.localhost',
+                                      driver='test',
+                                      topic='test',
+                                      asynchronous=asynchronous)
+        self.addCleanup(notifier.close)
+        return notifier
+
+    def _sent(self):
+        return [(m['event_type'], p) for c, m, p in _impl_test.NOTIFICATIONS]
+
+    def test_flush(self):
+        notifier = self._notifier()
+        notifier.info({}, 'test.a', 'foo')
+        notifier.error({}, 'test.b', 'bar')
+
+        self.assertTrue(notifier.flush())
+        self.assertEqual(self._sent(), [('test.a', 'INFO'),
+                                        ('test.b', 'ERROR')])
+
+    def test_close(self):
+        notifier = self._notifier()
+        notifier.info({}, 'test.a', 'foo')
+
+        self.assertTrue(notifier.close())
+        self.assertEqual(self._sent(), [('test.a', 'INFO')])
+
+        notifier.info({}, 'test.b', 'foo')
+        self.assertEqual(self._sent(), [('test.a', 'INFO'),
+                                        ('test.b', 'INFO')])
+
+    def test_payload_copied(self):
+        notifier = self._notifier()
+        ctxt = dict(user='bob')
+        payload = dict(a=[1])
+        notifier.info(ctxt, 'test.a', payload)
+        ctxt['user'] = 'alice'
+        payload['a'].append(2)
+
+        self.assertTrue(notifier.flush())
+        [(sent_ctxt, msg, priority)] = _impl_test.NOTIFICATIONS
+        self.assertEqual(sent_ctxt, dict(user='bob'))
+        self.assertEqual(msg['payload'], dict(a=[1]))
+        # Drivers reuse the encoding made when it was queued
+        self.assertTrue(isinstance(msg, driver_common.EncodedMessage))
+        self.assertFalse(msg._json is None)
+
+    def test_synchronous(self):
+        notifier = self._notifier(asynchronous=False)
+        notifier.info({}, 'test.a', 'foo')
+
+        self.assertEqual(self._sent(), [('test.a', 'INFO')])
+        self.assertTrue(notifier.flush())
+
+
+class TestNotificationQueue(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestNotificationQueue, self).setUp()
+        self.sent = []
+        self.threads = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.logger = self.useFixture(
+            fixtures.FakeLogger('oslo.messaging.notify.notifier'))
+
+    def _send(self, n):
+        self.threads.append(threading.current_thread())
+        self.release.wait()
+        self.sent.append(n)
+
+    def _blocked_queue(self, overflow):
+        # The first notification is taken from the queue and blocks the
+        # thread sending it, then two more fill the queue
+        queue = msg_notifier._NotificationQueue(self._send, 2, overflow,
+                                                batch_size=1)
+        queue.put(0)
+        while not self.threads:
+            time.sleep(0.01)
+        queue.put(1)
+        queue.put(2)
+        return queue
+
+    def test_drop_oldest(self):
+        queue = self._blocked_queue('drop_oldest')
+        queue.put(3)
+        self.release.set()
+
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.sent, [0, 2, 3])
+        self.assertTrue('Dropped 1 notifications' in self.logger.output)
+        self.assertFalse(threading.current_thread() in self.threads)
+
+    def test_sample(self):
+        queue = self._blocked_queue('sample')
+        self.mox.StubOutWithMock(msg_notifier.random, 'randrange')
+        msg_notifier.random.randrange(2).AndReturn(0)
+        self.mox.ReplayAll()
+
+        queue.put(3)
+        self.release.set()
+
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.sent, [0, 3, 2])
+
+    def test_block(self):
+        queue = self._blocked_queue('block')
+        putter = threading.Thread(target=queue.put, args=(3,))
+        putter.start()
+        putter.join(0.1)
+        self.assertTrue(putter.is_alive())
+
+        self.release.set()
+        putter.join()
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.sent, [0, 1, 2, 3])
+
+    def test_flush_timeout(self):
+        queue = self._blocked_queue('drop_oldest')
+        self.assertFalse(queue.flush(0.05))
+
+        self.release.set()
+        self.assertTrue(queue.flush(1))
+
+    def test_close(self):
+        queue = self._blocked_queue('drop_oldest')
+        self.release.set()
+
+        self.assertTrue(queue.close())
+        self.assertFalse(self.threads[0].is_alive())
+        self.assertEqual(self.sent, [0, 1, 2])
+
+        queue.put(3)
+        self.assertEqual(self.sent, [0, 1, 2])
+        self.assertTrue('queue is closed' in self.logger.output)
+
+    def test_close_while_blocked(self):
+        queue = self._blocked_queue('block')
+        putter = threading.Thread(target=queue.put, args=(3,))
+        putter.daemon = True
+        putter.start()
+        putter.join(0.1)
+
+        self.assertFalse(queue.close(0.05))
+        putter.join(1)
+        self.assertFalse(putter.is_alive())
+        self.assertTrue('queue is closed' in self.logger.output)
+
+    def test_send_failure(self):
+        def send(n):
+            if n == 0:
+                raise ValueError('test')
+            self.sent.append(n)
+
+        queue = msg_notifier._NotificationQueue(send, 10)
+        queue.put(0)
+        queue.put(1)
+
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.sent, [1])
+        self.assertTrue('Failed to send' in self.logger.output)
@@ -13,10 +13,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
+import threading
+import time
+
 from oslo.config import cfg
 import testscenarios
 
 from oslo import messaging
+from oslo.messaging._drivers import base as driver_base
 from oslo.messaging.rpc import client as rpc_client
 from oslo.messaging import serializer as msg_serializer
 from tests import utils as test_utils
@@ -32,6 +37,9 @@ class _FakeTransport(object):
     def _send(self, *args, **kwargs):
         pass
 
+    def _send_async(self, *args, **kwargs):
+        pass
+
 
 class TestCastCall(test_utils.BaseTestCase):
 
@@ -262,6 +270,59 @@ class TestCallTimeout(test_utils.BaseTestCase):
         client.call({}, 'foo')
 
 
+class TestPriority(test_utils.BaseTestCase):
+
+    _call_vs_cast = [
+        ('call', dict(call=True)),
+        ('cast', dict(call=False)),
+    ]
+
+    _priority = [
+        ('none', dict(ctor=None, prepare=_notset, expect=None)),
+        ('ctor', dict(ctor=5, prepare=_notset, expect=5)),
+        ('prepare', dict(ctor=None, prepare=5, expect=5)),
+        ('prepare_override', dict(ctor=1, prepare=5, expect=5)),
+        ('prepare_none', dict(ctor=5, prepare=None, expect=None)),
+    ]
+
+    @classmethod
+    def generate_scenarios(cls):
+        cls.scenarios = testscenarios.multiply_scenarios(cls._call_vs_cast,
+                                                         cls._priority)
+
+    def setUp(self):
+        super(TestPriority, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+    def test_priority(self):
+        self.config(rpc_response_timeout=None)
+
+        transport = _FakeTransport(self.conf)
+        client = messaging.RPCClient(transport, messaging.Target(),
+                                     priority=self.ctor)
+
+        self.mox.StubOutWithMock(transport, '_send')
+
+        msg = dict(method='foo', args={})
+        kwargs = {}
+        if self.call:
+            kwargs['wait_for_reply'] = True
+            kwargs['timeout'] = None
+        if self.expect is not None:
+            kwargs['priority'] = self.expect
+        transport._send(messaging.Target(), {}, msg, **kwargs)
+
+        self.mox.ReplayAll()
+
+        if self.prepare is not _notset:
+            client = client.prepare(priority=self.prepare)
+        method = client.call if self.call else client.cast
+        method({}, 'foo')
+
+
+TestPriority.generate_scenarios()
+
+
 class TestSerializer(test_utils.BaseTestCase):
 
     scenarios = [
@@ -532,3 +593,1261 @@ class TestCheckForLock(test_utils.BaseTestCase):
             self.assertTrue(self.warning in warnings[0])
         else:
             self.assertEqual(len(warnings), 0)
+
+
+class TestLockWarnings(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestLockWarnings, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+        self.config(rpc_response_timeout=None)
+
+        self.transport = _FakeTransport(self.conf)
+        self.checks = 0
+        self.warnings = []
+        self.stubs.Set(rpc_client._LOG, 'warning', self._warning)
+
+    def _warning(self, msg, *args):
+        self.warnings.append(msg % args[0])
+
+    def _check_for_lock(self, conf):
+        self.checks += 1
+        return ['foo']
+
+    def _client(self):
+        return messaging.RPCClient(self.transport, messaging.Target(),
+                                   check_for_lock=self._check_for_lock)
+
+    def test_stack(self):
+        self._client().call({}, 'foo')
+
+        self.assertEqual(len(self.warnings), 1)
+        self.assertTrue(':: test_stack ::' in self.warnings[0])
+
+    def test_once_per_call_site(self):
+        client = self._client()
+
+        for i in range(3):
+            client.call({}, 'foo')
+        client.call({}, 'bar')
+
+        self.assertEqual(self.checks, 4)
+        self.assertEqual(len(self.warnings), 2)
+
+    def test_every_call(self):
+        self.config(rpc_lock_warning_sites=0)
+        client = self._client()
+
+        for i in range(3):
+            client.call({}, 'foo')
+
+        self.assertEqual(len(self.warnings), 3)
+
+    def test_sample_rate(self):
+        self.config(rpc_lock_check_sample_rate=0.0)
+
+        self._client().call({}, 'foo')
+
+        self.assertEqual(self.checks, 0)
+        self.assertEqual(len(self.warnings), 0)
+
+
+class _BlockingTransport(_FakeTransport):
+
+    """A transport whose call()s block until released."""
+
+    def __init__(self, conf):
+        super(_BlockingTransport, self).__init__(conf)
+        self.sends = []
+        self.waiters = []
+        self.release = threading.Event()
+
+    def _send(self, target, ctxt, message, **kwargs):
+        self.sends.append(message)
+        self.release.wait()
+        return message['args'].get('a')
+
+    def wait_for_callers(self, count):
+        while len(self.sends) + len(self.waiters) < count:
+            time.sleep(0.01)
+
+
+class _CoalesceCallsTestMixin(object):
+
+    def setUp(self):
+        super(_CoalesceCallsTestMixin, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+        self.config(rpc_response_timeout=None)
+
+        self.transport = _BlockingTransport(self.conf)
+
+        # Record callers which wait for the reply to an in-flight call()
+        transport = self.transport
+
+        class InFlightCall(rpc_client._InFlightCall):
+            def __init__(self):
+                super(InFlightCall, self).__init__()
+                done = self.done
+
+                class WaitingEvent(object):
+                    def wait(self, timeout=None):
+                        transport.waiters.append(timeout)
+                        return done.wait(timeout)
+
+                    def __getattr__(self, name):
+                        return getattr(done, name)
+
+                self.done = WaitingEvent()
+
+        self.stubs.Set(rpc_client, '_InFlightCall', InFlightCall)
+
+    def _call_concurrently(self, method, calls):
+        threads = []
+        for i, args in enumerate(calls):
+            thread = threading.Thread(target=method, args=(args,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+            self.transport.wait_for_callers(i + 1)
+
+        self.transport.release.set()
+        for thread in threads:
+            thread.join(timeout=30)
+
+
+class TestCoalesceCalls(_CoalesceCallsTestMixin, test_utils.BaseTestCase):
+
+    scenarios = [
+        ('identical',
+         dict(coalesce=True, prepare=False, key=None,
+              args=[dict(a='x'), dict(a='x'), dict(a='x')],
+              expect_sends=1)),
+        ('different_args',
+         dict(coalesce=True, prepare=False, key=None,
+              args=[dict(a='x'), dict(a='y'), dict(a='x')],
+              expect_sends=2)),
+        ('prepare',
+         dict(coalesce=False, prepare=True, key=None,
+              args=[dict(a='x'), dict(a='x')],
+              expect_sends=1)),
+        ('disabled',
+         dict(coalesce=False, prepare=False, key=None,
+              args=[dict(a='x'), dict(a='x')],
+              expect_sends=2)),
+        ('key_func',
+         dict(coalesce=True, prepare=False,
+              key=lambda target, ctxt, msg: msg['method'],
+              args=[dict(a='x'), dict(a='x', b='y')],
+              expect_sends=1)),
+        ('key_func_none',
+         dict(coalesce=True, prepare=False,
+              key=lambda target, ctxt, msg: None,
+              args=[dict(a='x'), dict(a='x')],
+              expect_sends=2)),
+    ]
+
+    def test_coalesce_calls(self):
+        client = messaging.RPCClient(self.transport, messaging.Target(),
+                                     coalesce_calls=self.coalesce,
+                                     coalesce_key=self.key)
+        if self.prepare:
+            client = client.prepare(coalesce_calls=True)
+
+        results = []
+
+        def do_call(args):
+            results.append(client.call({}, 'foo', **args))
+
+        self._call_concurrently(do_call, self.args)
+
+        self.assertEqual(len(self.transport.sends), self.expect_sends)
+        if self.key is None:
+            self.assertEqual(sorted(results),
+                             sorted([a['a'] for a in self.args]))
+        else:
+            self.assertEqual(len(results), len(self.args))
+
+
+class TestCoalescedException(_CoalesceCallsTestMixin,
+                             test_utils.BaseTestCase):
+
+    def test_exception_shared(self):
+        client = messaging.RPCClient(self.transport, messaging.Target(),
+                                     coalesce_calls=True)
+
+        def raise_timeout(target, ctxt, message, **kwargs):
+            self.transport.sends.append(message)
+            self.transport.release.wait()
+            raise messaging.MessagingTimeout('testing')
+
+        self.stubs.Set(self.transport, '_send', raise_timeout)
+
+        errors = []
+
+        def do_call(args):
+            try:
+                client.call({}, 'foo', **args)
+            except messaging.MessagingTimeout as ex:
+                errors.append(ex)
+
+        self._call_concurrently(do_call, [{}, {}, {}])
+
+        self.assertEqual(len(self.transport.sends), 1)
+        self.assertEqual(len(errors), 3)
+
+    def test_base_exception_shared(self):
+        client = messaging.RPCClient(self.transport, messaging.Target(),
+                                     coalesce_calls=True)
+
+        class Interrupt(BaseException):
+            pass
+
+        def interrupt(target, ctxt, message, **kwargs):
+            self.transport.sends.append(message)
+            self.transport.release.wait()
+            raise Interrupt()
+
+        self.stubs.Set(self.transport, '_send', interrupt)
+
+        errors = []
+        results = []
+
+        def do_call(args):
+            try:
+                results.append(client.call({}, 'foo', **args))
+            except Interrupt as ex:
+                errors.append(ex)
+
+        self._call_concurrently(do_call, [{}, {}, {}])
+
+        self.assertEqual(len(self.transport.sends), 1)
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(results, [])
+
+
+class TestCoalescedReplyCopies(_CoalesceCallsTestMixin,
+                               test_utils.BaseTestCase):
+
+    def test_reply_copied(self):
+        client = messaging.RPCClient(self.transport, messaging.Target(),
+                                     coalesce_calls=True)
+
+        def send(target, ctxt, message, **kwargs):
+            self.transport.sends.append(message)
+            self.transport.release.wait()
+            return dict(items=[1])
+
+        self.stubs.Set(self.transport, '_send', send)
+
+        results = []
+        counter = itertools.count()
+
+        def do_call(args):
+            result = client.call({}, 'foo', **args)
+            result['items'].append(next(counter))
+            results.append(result)
+
+        self._call_concurrently(do_call, [{}, {}, {}])
+
+        self.assertEqual(len(self.transport.sends), 1)
+        self.assertEqual(sorted(r['items'] for r in results),
+                         [[1, 0], [1, 1], [1, 2]])
+
+
+class _CountingTransport(_FakeTransport):
+
+    def __init__(self, conf):
+        super(_CountingTransport, self).__init__(conf)
+        self.sends = []
+
+    def _send(self, target, ctxt, message, **kwargs):
+        self.sends.append((target, message))
+        return len(self.sends)
+
+
+class TestCallCache(test_utils.BaseTestCase):
+
+    _call = dict(method='get', kwargs=dict(a=1))
+
+    scenarios = [
+        ('repeat',
+         dict(calls=[_call, _call], invalidate=None, elapsed=0,
+              expect=[1, 1])),
+        ('expired',
+         dict(calls=[_call, _call], invalidate=None, elapsed=11,
+              expect=[1, 2])),
+        ('different_args',
+         dict(calls=[_call, dict(method='get', kwargs=dict(a=2)), _call],
+              invalidate=None, elapsed=0,
+              expect=[1, 2, 1])),
+        ('not_cacheable',
+         dict(calls=[dict(method='put', kwargs={}),
+                     dict(method='put', kwargs={})],
+              invalidate=None, elapsed=0,
+              expect=[1, 2])),
+        ('evicted',
+         dict(calls=[_call,
+                     dict(method='get', kwargs=dict(a=2)),
+                     dict(method='get', kwargs=dict(a=3)),
+                     _call],
+              invalidate=None, elapsed=0,
+              expect=[1, 2, 3, 4])),
+        ('invalidate_call',
+         dict(calls=[_call, _call],
+              invalidate=lambda c: c.invalidate_call({}, 'get', a=1),
+              elapsed=0,
+              expect=[1, 2])),
+        ('invalidate_other_call',
+         dict(calls=[_call, _call],
+              invalidate=lambda c: c.invalidate_call({}, 'get', a=2),
+              elapsed=0,
+              expect=[1, 1])),
+        ('clear_method',
+         dict(calls=[_call, _call],
+              invalidate=lambda c: c.clear_cache('get'),
+              elapsed=0,
+              expect=[1, 2])),
+        ('clear_other_method',
+         dict(calls=[_call, _call],
+              invalidate=lambda c: c.clear_cache('put'),
+              elapsed=0,
+              expect=[1, 1])),
+        ('clear_all',
+         dict(calls=[_call, _call],
+              invalidate=lambda c: c.clear_cache(),
+              elapsed=0,
+              expect=[1, 2])),
+    ]
+
+    def setUp(self):
+        super(TestCallCache, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+    def test_call_cache(self):
+        self.config(rpc_response_timeout=None)
+
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+
+        transport = _CountingTransport(self.conf)
+        client = messaging.RPCClient(transport,
+                                     messaging.Target(topic='testtopic'),
+                                     cache_methods=dict(get=10),
+                                     cache_size=2)
+
+        results = []
+        for i, c in enumerate(self.calls):
+            if i == len(self.calls) - 1:
+                now[0] += self.elapsed
+                if self.invalidate is not None:
+                    self.invalidate(client)
+            results.append(client.call({}, c['method'], **c['kwargs']))
+
+        self.assertEqual(results, self.expect)
+
+    def test_prepared_target(self):
+        self.config(rpc_response_timeout=None)
+
+        transport = _CountingTransport(self.conf)
+        client = messaging.RPCClient(transport,
+                                     messaging.Target(topic='testtopic'),
+                                     cache_methods=dict(get=10))
+
+        self.assertEqual(client.call({}, 'get'), 1)
+        self.assertEqual(client.prepare(server='s1').call({}, 'get'), 2)
+        self.assertEqual(client.prepare(server='s1').call({}, 'get'), 2)
+        self.assertEqual(client.call({}, 'get'), 1)
+
+
+class TestCallCacheCopies(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCallCacheCopies, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+    def test_reply_copied(self):
+        self.config(rpc_response_timeout=None)
+
+        class Transport(_CountingTransport):
+            def _send(self, target, ctxt, message, **kwargs):
+                super(Transport, self)._send(target, ctxt, message, **kwargs)
+                return dict(a=[1])
+
+        transport = Transport(self.conf)
+        client = messaging.RPCClient(transport,
+                                     messaging.Target(topic='testtopic'),
+                                     cache_methods=dict(get=10))
+
+        client.call({}, 'get')['a'].append(2)
+        reply = client.call({}, 'get')
+        self.assertEqual(reply, dict(a=[1]))
+        reply['a'].append(3)
+        self.assertEqual(client.call({}, 'get'), dict(a=[1]))
+        self.assertEqual(len(transport.sends), 1)
+
+    def test_clear_method(self):
+        cache = rpc_client._CallResultCache(dict(get=10, put=10), 10)
+        for i in range(5):
+            cache.store(('get', None, str(i)), i)
+            cache.store(('put', None, str(i)), i)
+        cache.clear('get')
+        self.assertEqual(sorted(cache._replies.keys()),
+                         [('put', None, str(i)) for i in range(5)])
+
+
+class TestHedgedCall(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('hedged',
+         dict(hedge=True, samples=20, server=None,
+              first='slow', expect_sends=2, expect='second')),
+        ('first_fast',
+         dict(hedge=True, samples=20, server=None,
+              first='fast', expect_sends=1, expect='first')),
+        ('first_fails',
+         dict(hedge=True, samples=20, server=None,
+              first='fail', expect_sends=1,
+              expect=messaging.MessagingTimeout)),
+        ('not_hedged',
+         dict(hedge=False, samples=20, server=None,
+              first='slow', expect_sends=1, expect='first')),
+        ('too_few_samples',
+         dict(hedge=True, samples=19, server=None,
+              first='slow', expect_sends=1, expect='first')),
+        ('direct_to_server',
+         dict(hedge=True, samples=20, server='testserver',
+              first='slow', expect_sends=1, expect='first')),
+    ]
+
+    def setUp(self):
+        super(TestHedgedCall, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+    def test_hedged_call(self):
+        self.config(rpc_response_timeout=None)
+
+        transport = _FakeTransport(self.conf)
+        target = messaging.Target(topic='testtopic', server=self.server)
+        client = messaging.RPCClient(transport, target,
+                                     hedge_percentile=50)
+        for i in range(self.samples):
+            client._latencies.record('foo', 0.01)
+
+        sends = []
+        release = threading.Event()
+
+        def send(target, ctxt, message, **kwargs):
+            sends.append(message)
+            if len(sends) > 1:
+                return 'second'
+            elif self.first == 'fail':
+                raise messaging.MessagingTimeout('testing')
+            elif self.first == 'slow':
+                release.wait(0.1)
+            return 'first'
+
+        self.stubs.Set(transport, '_send', send)
+
+        client = client.prepare(hedge_calls=self.hedge)
+        try:
+            result = client.call({}, 'foo')
+        except Exception as ex:
+            self.assertTrue(isinstance(ex, self.expect), ex)
+        else:
+            self.assertEqual(result, self.expect)
+        finally:
+            release.set()
+
+        self.assertEqual(len(sends), self.expect_sends)
+
+
+class TestHedgedSend(test_utils.BaseTestCase):
+
+    def test_both_fail(self):
+        sends = []
+
+        def send():
+            sends.append(None)
+            if len(sends) == 1:
+                time.sleep(0.05)
+            raise messaging.MessagingTimeout('timeout %d' % len(sends))
+
+        ex = self.assertRaises(messaging.MessagingTimeout,
+                               rpc_client._send_hedged, send, 0.01)
+        self.assertEqual(len(sends), 2)
+        self.assertEqual(str(ex), 'timeout 2')
+
+    def test_base_exception(self):
+        class Interrupt(BaseException):
+            pass
+
+        def send():
+            raise Interrupt()
+
+        outcome = []
+
+        def hedged():
+            try:
+                rpc_client._send_hedged(send, 0.01)
+            except Interrupt:
+                outcome.append('raised')
+
+        thread = threading.Thread(target=hedged)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertEqual(outcome, ['raised'])
+
+    def test_late_reply_discarded(self):
+        replies = ['slow', 'fast']
+        sent = threading.Event()
+
+        def send():
+            reply = replies.pop(0)
+            if reply == 'slow':
+                sent.wait(5)
+            else:
+                sent.set()
+            return reply
+
+        self.assertEqual(rpc_client._send_hedged(send, 0.01), 'fast')
+
+
+class TestLatencyTracker(test_utils.BaseTestCase):
+
+    def test_percentile(self):
+        latencies = rpc_client._LatencyTracker(window=100)
+        self.assertTrue(latencies.percentile('foo', 50) is None)
+
+        for i in range(1, 201):
+            latencies.record('foo', float(i))
+
+        self.assertEqual(latencies.percentile('foo', 0), 101.0)
+        self.assertEqual(latencies.percentile('foo', 50), 150.0)
+        self.assertEqual(latencies.percentile('foo', 99), 199.0)
+        self.assertEqual(latencies.percentile('foo', 100), 200.0)
+        self.assertTrue(latencies.percentile('foo', 50, 101) is None)
+        self.assertTrue(latencies.percentile('bar', 50) is None)
+
+
+class TestAdaptiveTimeout(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('disabled',
+         dict(adaptive=False, samples=100, latency=0.5, timeout=None,
+              confmax=None, expect=60)),
+        ('adaptive',
+         dict(adaptive=True, samples=100, latency=0.5, timeout=None,
+              confmax=None, expect=1.5)),
+        ('too_few_samples',
+         dict(adaptive=True, samples=99, latency=0.5, timeout=None,
+              confmax=None, expect=60)),
+        ('explicit_timeout',
+         dict(adaptive=True, samples=100, latency=0.5, timeout=10,
+              confmax=None, expect=10)),
+        ('clamp_min',
+         dict(adaptive=True, samples=100, latency=0.01, timeout=None,
+              confmax=None, expect=1.0)),
+        ('clamp_response_timeout',
+         dict(adaptive=True, samples=100, latency=30, timeout=None,
+              confmax=None, expect=60)),
+        ('clamp_max',
+         dict(adaptive=True, samples=100, latency=30, timeout=None,
+              confmax=20.0, expect=20.0)),
+    ]
+
+    def setUp(self):
+        super(TestAdaptiveTimeout, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+    def test_adaptive_timeout(self):
+        self.config(rpc_adaptive_timeout_max=self.confmax)
+
+        transport = _FakeTransport(self.conf)
+        client = messaging.RPCClient(transport, messaging.Target(),
+                                     timeout=self.timeout)
+        for i in range(self.samples):
+            client._latencies.record('foo', self.latency)
+
+        self.mox.StubOutWithMock(transport, '_send')
+
+        msg = dict(method='foo', args={})
+        kwargs = dict(wait_for_reply=True, timeout=self.expect)
+        transport._send(messaging.Target(), {}, msg, **kwargs)
+
+        self.mox.ReplayAll()
+
+        client = client.prepare(adaptive_timeout=self.adaptive)
+        client.call({}, 'foo')
+
+
+class TestAdaptiveTimeoutGrows(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestAdaptiveTimeoutGrows, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+    def test_timeouts_recorded(self):
+        transport = _FakeTransport(self.conf)
+        client = messaging.RPCClient(transport, messaging.Target(),
+                                     adaptive_timeout=True)
+        for i in range(100):
+            client._latencies.record('foo', 0.5)
+
+        self.mox.StubOutWithMock(transport, '_send')
+
+        msg = dict(method='foo', args={})
+        for timeout in (1.5, 4.5, 13.5):
+            transport._send(messaging.Target(), {}, msg,
+                            wait_for_reply=True, timeout=timeout).AndRaise(
+                                messaging.MessagingTimeout('testing'))
+        transport._send(messaging.Target(), {}, msg,
+                        wait_for_reply=True, timeout=40.5)
+
+        self.mox.ReplayAll()
+
+        for i in range(3):
+            self.assertRaises(messaging.MessagingTimeout,
+                              client.call, {}, 'foo')
+        client.call({}, 'foo')
+
+    def test_recovers(self):
+        self.config(rpc_response_timeout=60)
+        transport = _FakeTransport(self.conf)
+        client = messaging.RPCClient(transport, messaging.Target(),
+                                     adaptive_timeout=True)
+        for i in range(1000):
+            client._latencies.record('foo', 0.01)
+
+        self.mox.StubOutWithMock(transport, '_send')
+
+        msg = dict(method='foo', args={})
+        for timeout in (1, 3, 9, 27, 60, 60):
+            transport._send(messaging.Target(), {}, msg,
+                            wait_for_reply=True, timeout=timeout).AndRaise(
+                                messaging.MessagingTimeout('testing'))
+        for timeout in (60, 1):
+            transport._send(messaging.Target(), {}, msg,
+                            wait_for_reply=True, timeout=timeout)
+
+        self.mox.ReplayAll()
+
+        for i in range(6):
+            self.assertRaises(messaging.MessagingTimeout,
+                              client.call, {}, 'foo')
+        client.call({}, 'foo')
+        client.call({}, 'foo')
+        self.assertEqual(len(client._latencies._samples['foo']), 1000)
+
+
+class TestCircuitBreaker(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+        self.config(rpc_response_timeout=None,
+                    rpc_circuit_breaker_threshold=2,
+                    rpc_circuit_breaker_cooldown=10,
+                    rpc_circuit_breaker_probes=2)
+
+        self.now = 1000.0
+        self.stubs.Set(time, 'time', lambda: self.now)
+
+        self.transport = _FakeTransport(self.conf)
+        self.sends = []
+        self.failures = []
+        self.stubs.Set(self.transport, '_send', self._send)
+
+    def _send(self, target, ctxt, message, **kwargs):
+        self.sends.append(target)
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def _client(self, circuit_breaker=True):
+        return messaging.RPCClient(self.transport,
+                                   messaging.Target(topic='testtopic'),
+                                   circuit_breaker=circuit_breaker)
+
+    def _fail(self, client, count):
+        self.failures = [messaging.MessagingTimeout('test')] * count
+        for i in range(count):
+            self.assertRaises(messaging.MessagingTimeout,
+                              client.call, {}, 'foo')
+
+    def test_opens_after_threshold(self):
+        client = self._client()
+
+        self._fail(client, 2)
+        self.assertEqual(len(self.sends), 2)
+
+        ex = self.assertRaises(messaging.CircuitBreakerOpen,
+                               client.call, {}, 'foo')
+        self.assertEqual(ex.target, messaging.Target(topic='testtopic'))
+        self.assertRaises(messaging.CircuitBreakerOpen,
+                          client.cast, {}, 'foo')
+        self.assertEqual(len(self.sends), 2)
+
+    def test_success_resets_failures(self):
+        client = self._client()
+
+        self._fail(client, 1)
+        client.call({}, 'foo')
+        self._fail(client, 1)
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 4)
+
+    def test_remote_error_is_success(self):
+        client = self._client()
+
+        self._fail(client, 1)
+        self.failures = [ValueError('test')]
+        self.assertRaises(ValueError, client.call, {}, 'foo')
+        self._fail(client, 1)
+        client.call({}, 'foo')
+
+    def test_send_error_is_failure(self):
+        client = self._client()
+
+        self.failures = [driver_base.TransportDriverError('test')] * 2
+        for i in range(2):
+            self.assertRaises(messaging.ClientSendError,
+                              client.cast, {}, 'foo')
+        self.assertRaises(messaging.CircuitBreakerOpen,
+                          client.cast, {}, 'foo')
+
+    def test_probes_close_circuit(self):
+        client = self._client()
+
+        self._fail(client, 2)
+        self.now += 11
+
+        client.call({}, 'foo')
+        client.call({}, 'foo')
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 5)
+
+    def test_probes_limited(self):
+        client = self._client()
+
+        self._fail(client, 2)
+        self.now += 11
+
+        # While the probes have not completed, no more are let through
+        breaker = client._breaker
+        key = ((None, 'testtopic', None), None)
+        self.assertTrue(breaker.check(key))
+        self.assertTrue(breaker.check(key))
+        self.assertFalse(breaker.check(key))
+
+    def test_interrupted_probes_released(self):
+        client = self._client()
+
+        class Interrupt(BaseException):
+            pass
+
+        self._fail(client, 2)
+        self.now += 11
+
+        # The outcome of an interrupted probe is unknown, so it neither
+        # closes nor re-opens the circuit but frees its slot for another
+        self.failures = [Interrupt()] * 3
+        for i in range(3):
+            self.assertRaises(Interrupt, client.call, {}, 'foo')
+        client.call({}, 'foo')
+        client.call({}, 'foo')
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 8)
+
+    def test_release_after_reopen(self):
+        client = self._client()
+
+        self._fail(client, 2)
+        self.now += 11
+
+        breaker = client._breaker
+        key = ((None, 'testtopic', None), None)
+        ticket = breaker.check(key)
+        self.assertTrue(ticket)
+        breaker.failed(key, ticket)
+        self.now += 11
+        self.assertTrue(breaker.check(key))
+        breaker.release(key, ticket)
+        self.assertTrue(breaker.check(key))
+        self.assertFalse(breaker.check(key))
+
+    def test_stale_outcomes_ignored(self):
+        breaker = rpc_client._CircuitBreaker(threshold=1, cooldown=10,
+                                             probes=2)
+        stale = [breaker.check('k') for i in range(4)]
+        breaker.failed('k', stale[0])
+
+        # Replies to requests sent before the circuit opened aren't probes
+        breaker.succeeded('k', stale[1])
+        breaker.succeeded('k', stale[2])
+        self.assertFalse(breaker.check('k'))
+
+        self.now += 11
+        probe = breaker.check('k')
+        self.assertTrue(probe)
+        breaker.failed('k', stale[3])
+        breaker.succeeded('k', probe)
+        probe = breaker.check('k')
+        self.assertTrue(probe)
+        breaker.succeeded('k', probe)
+        self.assertTrue(breaker.check('k') is True)
+
+    def test_rate_limited_probe(self):
+        client = messaging.RPCClient(self.transport,
+                                     messaging.Target(topic='testtopic'),
+                                     circuit_breaker=True,
+                                     rate_limits=[dict(method='bar', rate=1)],
+                                     rate_limit_wait=False)
+
+        self._fail(client, 2)
+        self.now += 11
+
+        # A probe which is rate limited is not sent, and doesn't use a slot
+        client.call({}, 'bar')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          client.call, {}, 'bar')
+        client.call({}, 'foo')
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 5)
+
+    def test_failed_probe_reopens(self):
+        client = self._client()
+
+        self._fail(client, 2)
+        self.now += 11
+
+        self._fail(client, 1)
+        self.assertRaises(messaging.CircuitBreakerOpen,
+                          client.call, {}, 'foo')
+        self.assertEqual(len(self.sends), 3)
+
+        self.now += 11
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 4)
+
+    def test_per_target(self):
+        client = self._client()
+
+        self._fail(client, 2)
+        self.assertRaises(messaging.CircuitBreakerOpen,
+                          client.call, {}, 'foo')
+        client.prepare(topic='othertopic').call({}, 'foo')
+        client.prepare(server='testserver').call({}, 'foo')
+        self.assertEqual(len(self.sends), 4)
+
+    def test_disabled(self):
+        client = self._client(circuit_breaker=False)
+
+        self._fail(client, 3)
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 4)
+
+    def test_prepare(self):
+        client = self._client(circuit_breaker=False)
+        breaker_client = client.prepare(circuit_breaker=True)
+
+        self._fail(breaker_client, 2)
+        self.assertRaises(messaging.CircuitBreakerOpen,
+                          breaker_client.call, {}, 'foo')
+        client.call({}, 'foo')
+        self.assertEqual(len(self.sends), 3)
+
+
+class TestInvalidRateLimit(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('no_rate', dict(limit=dict(topic='testtopic'))),
+        ('zero_rate', dict(limit=dict(rate=0))),
+        ('negative_rate', dict(limit=dict(rate=-1))),
+        ('small_burst', dict(limit=dict(rate=1, burst=0.5))),
+        ('unknown_key', dict(limit=dict(rate=1, topics=['testtopic']))),
+    ]
+
+    def test_invalid(self):
+        self.conf.register_opts(rpc_client._client_opts)
+        ex = self.assertRaises(messaging.InvalidRateLimit,
+                               messaging.RPCClient, _FakeTransport(self.conf),
+                               messaging.Target(topic='testtopic'),
+                               rate_limits=[self.limit])
+        self.assertEqual(ex.limit, self.limit)
+
+
+class TestRateLimit(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestRateLimit, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+        self.config(rpc_response_timeout=None)
+
+        self.now = 1000.0
+        self.sleeps = []
+
+        def sleep(secs):
+            self.sleeps.append(secs)
+            self.now += secs
+
+        self.stubs.Set(time, 'time', lambda: self.now)
+        self.stubs.Set(time, 'sleep', sleep)
+
+        self.transport = _FakeTransport(self.conf)
+        self.sends = []
+        self.stubs.Set(self.transport, '_send',
+                       lambda target, ctxt, msg, **kw: self.sends.append(msg))
+
+    def _client(self, limits, wait=True):
+        return messaging.RPCClient(self.transport,
+                                   messaging.Target(topic='testtopic'),
+                                   rate_limits=limits,
+                                   rate_limit_wait=wait)
+
+    def test_burst_then_wait(self):
+        client = self._client([dict(rate=2, burst=3)])
+
+        for i in range(3):
+            client.cast({}, 'foo')
+        self.assertEqual(self.sleeps, [])
+
+        client.cast({}, 'foo')
+        client.call({}, 'foo')
+        self.assertEqual(self.sleeps, [0.5, 0.5])
+        self.assertEqual(len(self.sends), 5)
+
+    def test_refill(self):
+        client = self._client([dict(rate=2, burst=2)])
+
+        client.cast({}, 'foo')
+        client.cast({}, 'foo')
+        self.now += 10
+        client.cast({}, 'foo')
+        client.cast({}, 'foo')
+        self.assertEqual(self.sleeps, [])
+
+    def test_reject(self):
+        client = self._client([dict(rate=1)], wait=False)
+
+        client.cast({}, 'foo')
+        ex = self.assertRaises(messaging.RateLimitExceeded,
+                               client.call, {}, 'foo')
+        self.assertEqual(ex.method, 'foo')
+        self.assertEqual(ex.target, messaging.Target(topic='testtopic'))
+        self.assertEqual(len(self.sends), 1)
+
+        self.now += 1
+        client.cast({}, 'foo')
+        self.assertEqual(len(self.sends), 2)
+
+    def test_method_limit(self):
+        client = self._client([dict(method='foo', rate=1)], wait=False)
+
+        client.cast({}, 'foo')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          client.cast, {}, 'foo')
+        client.cast({}, 'bar')
+        client.cast({}, 'bar')
+
+    def test_target_and_namespace_limits(self):
+        client = self._client([dict(topic='othertopic', rate=1),
+                               dict(namespace='testns', rate=1)],
+                              wait=False)
+
+        client.cast({}, 'foo')
+        client.cast({}, 'foo')
+
+        other = client.prepare(topic='othertopic')
+        other.cast({}, 'foo')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          other.cast, {}, 'foo')
+
+        ns = client.prepare(namespace='testns')
+        ns.cast({}, 'foo')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          ns.cast, {}, 'foo')
+
+    def test_all_limits_must_allow(self):
+        client = self._client([dict(rate=1, burst=2),
+                               dict(method='foo', rate=1)],
+                              wait=False)
+
+        client.cast({}, 'foo')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          client.cast, {}, 'foo')
+        # The rejected message must not have consumed the shared token
+        client.cast({}, 'bar')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          client.cast, {}, 'bar')
+
+
+class TestCastBatching(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCastBatching, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+        self.config(rpc_response_timeout=None)
+
+        self.transport = _FakeTransport(self.conf)
+        self.sends = []
+        self.stubs.Set(self.transport, '_send', self._send)
+
+    def _send(self, target, ctxt, message, **kwargs):
+        self.sends.append((target, ctxt, message, kwargs))
+
+    def _client(self, **kwargs):
+        kwargs.setdefault('batch_interval', None)
+        return messaging.RPCClient(self.transport,
+                                   messaging.Target(topic='testtopic'),
+                                   batch_casts=True, **kwargs)
+
+    @staticmethod
+    def _entry(ctxt, method, **kwargs):
+        return dict(ctxt=ctxt, message=dict(method=method, args=kwargs))
+
+    def test_flush_on_size(self):
+        client = self._client(batch_size=3)
+
+        client.cast({'user': 'a'}, 'foo', x=1)
+        client.cast({'user': 'b'}, 'bar')
+        self.assertEqual(self.sends, [])
+
+        client.cast({'user': 'a'}, 'foo', x=2)
+        self.assertEqual(len(self.sends), 1)
+
+        target, ctxt, message, kwargs = self.sends[0]
+        self.assertEqual(target, messaging.Target(topic='testtopic'))
+        self.assertEqual(message,
+                         dict(batch=[self._entry({'user': 'a'}, 'foo', x=1),
+                                     self._entry({'user': 'b'}, 'bar'),
+                                     self._entry({'user': 'a'}, 'foo', x=2)]))
+
+    def test_flush_on_bytes(self):
+        client = self._client(batch_bytes=150)
+
+        client.cast({}, 'foo', x='a' * 40)
+        self.assertEqual(self.sends, [])
+        client.cast({}, 'foo', x='b' * 40)
+        self.assertEqual(len(self.sends), 1)
+        self.assertEqual(len(self.sends[0][2]['batch']), 2)
+
+    def test_flush_on_interval(self):
+        client = self._client(batch_interval=0.01)
+
+        client.cast({}, 'foo')
+        client.cast({}, 'bar')
+        for i in range(500):
+            if self.sends:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(len(self.sends), 1)
+        self.assertEqual(len(self.sends[0][2]['batch']), 2)
+
+    def test_flush(self):
+        client = self._client()
+
+        client.cast({}, 'foo')
+        client.prepare(topic='othertopic').cast({}, 'foo')
+        client.prepare(priority=5).cast({}, 'foo')
+        self.assertEqual(self.sends, [])
+
+        client.flush()
+        self.assertEqual(len(self.sends), 3)
+        topics = sorted([s[0].topic for s in self.sends])
+        self.assertEqual(topics, ['othertopic', 'testtopic', 'testtopic'])
+        priorities = sorted([s[3].get('priority') for s in self.sends])
+        self.assertEqual(priorities, [None, None, 5])
+
+        client.flush()
+        self.assertEqual(len(self.sends), 3)
+
+    def test_call_flushes_target(self):
+        client = self._client()
+
+        client.cast({}, 'foo')
+        client.prepare(topic='othertopic').cast({}, 'foo')
+        client.call({}, 'bar')
+
+        self.assertEqual(len(self.sends), 2)
+        self.assertEqual(self.sends[0][2],
+                         dict(batch=[self._entry({}, 'foo')]))
+        self.assertEqual(self.sends[1][2], dict(method='bar', args={}))
+
+    def test_not_batched(self):
+        client = self._client().prepare(batch_casts=False)
+
+        client.cast({}, 'foo')
+        self.assertEqual(self.sends[0][2], dict(method='foo', args={}))
+
+    def test_method_rate_limit(self):
+        client = self._client(rate_limits=[dict(method='foo', rate=1)],
+                              rate_limit_wait=False)
+
+        client.cast({}, 'foo')
+        client.cast({}, 'bar')
+        self.assertRaises(messaging.RateLimitExceeded,
+                          client.cast, {}, 'foo')
+        client.flush()
+
+        self.assertEqual(self.sends[0][2],
+                         dict(batch=[self._entry({}, 'foo'),
+                                     self._entry({}, 'bar')]))
+
+    def test_batch_version(self):
+        client = self._client(batch_version='2.4').prepare(version='2.0')
+        msg = dict(method='foo', args={}, version='2.0')
+
+        client.prepare(version_cap='2.3').cast({}, 'foo')
+        self.assertEqual(self.sends[0][2], msg)
+
+        client.prepare(version_cap='2.5').cast({}, 'foo')
+        client.cast({}, 'foo')
+        self.assertEqual(len(self.sends), 1)
+        client.flush()
+        self.assertEqual(self.sends[1][2],
+                         dict(batch=[dict(ctxt={}, message=msg)] * 2))
+
+    def test_one_flusher(self):
+        threads = []
+
+        class Thread(threading.Thread):
+            def __init__(self, *args, **kwargs):
+                super(Thread, self).__init__(*args, **kwargs)
+                threads.append(self)
+
+        self.stubs.Set(threading, 'Thread', Thread)
+
+        client = self._client(batch_interval=0.01)
+        for topic in ('a', 'b', 'c'):
+            client.prepare(topic=topic).cast({}, 'foo')
+        self.assertEqual(len(threads), 1)
+
+        threads[0].join(timeout=5)
+        self.assertFalse(threads[0].is_alive())
+        self.assertEqual(sorted([s[0].topic for s in self.sends]),
+                         ['a', 'b', 'c'])
+
+        client.cast({}, 'foo')
+        self.assertEqual(len(threads), 2)
+        threads[1].join(timeout=5)
+        self.assertEqual(len(self.sends), 4)
+
+
+class _FakeReplyWaiter(driver_base.ReplyWaiter):
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.timeouts = []
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        if isinstance(self.reply, Exception):
+            raise self.reply
+        return self.reply
+
+
+class TestPipeline(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestPipeline, self).setUp(conf=cfg.ConfigOpts())
+        self.conf.register_opts(rpc_client._client_opts)
+
+        self.transport = _FakeTransport(self.conf)
+        self.events = []
+        self.waiters = []
+        self.stubs.Set(self.transport, '_send_async', self._send_async)
+
+    def _send_async(self, target, ctxt, message, **kwargs):
+        self.events.append(('send', message['method']))
+        waiter = _FakeReplyWaiter(message['args'].get('reply'))
+        waiter_wait = waiter.wait
+
+        def wait(timeout=None):
+            self.events.append(('wait', message['method']))
+            return waiter_wait(timeout)
+
+        waiter.wait = wait
+        self.waiters.append(waiter)
+        return waiter
+
+    def _client(self, **kwargs):
+        return messaging.RPCClient(self.transport,
+                                   messaging.Target(topic='testtopic'),
+                                   **kwargs)
+
+    def test_pipeline(self):
+        client = self._client()
+
+        replies = client.pipeline({}, [('foo', dict(reply=1)),
+                                       ('bar', dict(reply=2)),
+                                       ('baz', {})])
+
+        self.assertEqual(replies, [1, 2, None])
+        self.assertEqual(self.events,
+                         [('send', 'foo'), ('send', 'bar'), ('send', 'baz'),
+                          ('wait', 'foo'), ('wait', 'bar'), ('wait', 'baz')])
+
+    def test_pipeline_timeout(self):
+        client = self._client(timeout=10)
+
+        client.pipeline({}, [('foo', {}), ('bar', {})])
+
+        for waiter in self.waiters:
+            self.assertEqual(len(waiter.timeouts), 1)
+            self.assertTrue(0 < waiter.timeouts[0] <= 10)
+
+    def test_pipeline_no_timeout(self):
+        self.config(rpc_response_timeout=None)
+        client = self._client()
+
+        client.pipeline({}, [('foo', {})])
+
+        self.assertEqual(self.waiters[0].timeouts, [None])
+
+    def test_pipeline_exception(self):
+        client = self._client()
+
+        self.assertRaises(ValueError, client.pipeline, {},
+                          [('foo', dict(reply=1)),
+                           ('bar', dict(reply=ValueError('test'))),
+                           ('baz', {})])
+        self.assertEqual(self.events[:3],
+                         [('send', 'foo'), ('send', 'bar'), ('send', 'baz')])
+
+    def test_pipeline_discarded_probes_released(self):
+        self.config(rpc_circuit_breaker_threshold=1,
+                    rpc_circuit_breaker_cooldown=0.0,
+                    rpc_circuit_breaker_probes=2)
+        client = self._client(circuit_breaker=True)
+        client._breaker.failed(((None, 'testtopic', None), None), True)
+
+        self.assertRaises(ValueError, client.pipeline, {},
+                          [('foo', dict(reply=ValueError('test'))),
+                           ('bar', {})])
+        self.assertEqual(client.pipeline({}, [('baz', dict(reply=1))]), [1])
+        self.assertEqual(client.pipeline({}, [('baz', dict(reply=2))]), [2])
+
+    def test_pipeline_send_error(self):
+        def _send_async(target, ctxt, message, **kwargs):
+            raise driver_base.TransportDriverError('test')
+        self.stubs.Set(self.transport, '_send_async', _send_async)
+
+        client = self._client()
+
+        self.assertRaises(messaging.ClientSendError, client.pipeline, {},
+                          [('foo', {})])
+
+    def test_pipeline_cached(self):
+        client = self._client(cache_methods=dict(foo=60))
+
+        client.pipeline({}, [('foo', dict(reply=1))])
+        replies = client.pipeline({}, [('foo', dict(reply=1)),
+                                       ('bar', dict(reply=2))])
+
+        self.assertEqual(replies, [1, 2])
+        self.assertEqual([e for e in self.events if e[0] == 'send'],
+                         [('send', 'foo'), ('send', 'bar')])
+
+    def test_pipeline_empty(self):
+        self.assertEqual(self._client().pipeline({}, []), [])
@@ -13,9 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import fixtures
+import mox
 import testscenarios
 
 from oslo import messaging
+from oslo.messaging._drivers import common as driver_common
+from oslo.messaging._drivers import context_cache
+from oslo.messaging.rpc import dispatcher as rpc_dispatcher
 from oslo.messaging import serializer as msg_serializer
 from tests import utils as test_utils
 
@@ -158,3 +163,234 @@ class TestSerializer(test_utils.BaseTestCase):
         retval = dispatcher(self.ctxt, dict(method='foo', args=self.args))
         if self.retval is not None:
             self.assertEqual(retval, 's' + self.retval)
+
+
+class TestEnvelope(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestEnvelope, self).setUp()
+        self.endpoint = _FakeEndpoint()
+        self.dispatcher = messaging.RPCDispatcher([self.endpoint], None)
+
+    def test_dispatch(self):
+        message = driver_common.serialize_msg(
+            dict(method='foo', args=dict(a=1)), '3.0')
+
+        self.mox.StubOutWithMock(self.endpoint, 'foo')
+        self.endpoint.foo(dict(user='bob'), a=1).AndReturn('bar')
+        self.mox.ReplayAll()
+
+        self.assertEqual(self.dispatcher(dict(user='bob'), message), 'bar')
+
+    def test_unsupported_version_not_decoded(self):
+        message = driver_common.serialize_msg(
+            dict(method='foo', version='2.0', args=dict(a=1)), '3.0')
+
+        self.mox.StubOutWithMock(driver_common, 'deserialize_msg')
+        self.mox.ReplayAll()
+
+        self.assertRaises(messaging.UnsupportedVersion,
+                          self.dispatcher, {}, message)
+
+    def test_batch(self):
+        batch = [dict(ctxt={}, message=dict(method='foo'))]
+        message = driver_common.serialize_msg(dict(batch=batch), '3.0')
+
+        self.mox.StubOutWithMock(self.endpoint, 'foo')
+        self.endpoint.foo({})
+        self.mox.ReplayAll()
+
+        self.dispatcher({}, message)
+
+
+class _CountingSerializer(msg_serializer.NoOpSerializer):
+
+    def __init__(self):
+        self.deserialized = []
+
+    def deserialize_entity(self, ctxt, entity):
+        self.deserialized.append(entity)
+        return 'd' + entity
+
+
+class TestLazyArgs(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestLazyArgs, self).setUp()
+        self.serializer = _CountingSerializer()
+
+    def _dispatch(self, endpoint, method='foo'):
+        dispatcher = messaging.RPCDispatcher([endpoint], self.serializer)
+        return dispatcher({}, dict(method=method, args=dict(a='a', b='b')))
+
+    def test_unused(self):
+        class TestEndpoint(object):
+            @messaging.lazy_args
+            def foo(self, ctxt, a, b):
+                return None
+
+        self._dispatch(TestEndpoint())
+        self.assertEqual(self.serializer.deserialized, [])
+
+    def test_used(self):
+        class TestEndpoint(object):
+            @messaging.lazy_args
+            def foo(self, ctxt, a, b):
+                return a.value + a.value + b.raw
+
+        self.assertEqual(self._dispatch(TestEndpoint()), 'dadab')
+        self.assertEqual(self.serializer.deserialized, ['a'])
+
+    def test_not_lazy(self):
+        class TestEndpoint(object):
+            @messaging.lazy_args
+            def foo(self, ctxt, a, b):
+                return None
+
+            def bar(self, ctxt, a, b):
+                return a + b
+
+        self.assertEqual(self._dispatch(TestEndpoint(), 'bar'), 'dadb')
+        self.assertEqual(sorted(self.serializer.deserialized), ['a', 'b'])
+
+    def test_lazy_endpoint(self):
+        class TestEndpoint(object):
+            lazy_args = True
+
+            def foo(self, ctxt, a, b):
+                return b.raw
+
+        self.assertEqual(self._dispatch(TestEndpoint()), 'b')
+        self.assertEqual(self.serializer.deserialized, [])
+
+
+class TestBatch(test_utils.BaseTestCase):
+
+    def test_batch(self):
+        endpoint = _FakeEndpoint()
+        dispatcher = messaging.RPCDispatcher([endpoint], None)
+
+        self.mox.StubOutWithMock(endpoint, 'foo')
+        self.mox.StubOutWithMock(endpoint, 'bar')
+        endpoint.foo(dict(user='a'), x=1)
+        endpoint.bar(dict(user='b')).AndRaise(ValueError('test'))
+        endpoint.foo(dict(user='a'), x=2)
+        self.mox.ReplayAll()
+
+        self.useFixture(fixtures.FakeLogger('oslo.messaging.rpc.dispatcher'))
+
+        batch = [
+            dict(ctxt=dict(user='a'), message=dict(method='foo',
+                                                   args=dict(x=1))),
+            dict(ctxt=dict(user='b'), message=dict(method='bar')),
+            dict(ctxt=dict(user='a'), message=dict(method='foo',
+                                                   args=dict(x=2))),
+        ]
+        self.assertTrue(dispatcher({}, dict(batch=batch)) is None)
+
+
+class _Context(object):
+
+    def __init__(self, ctxt):
+        self.user = ctxt['user']
+
+
+class TestContextFactory(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestContextFactory, self).setUp()
+        self.built = []
+
+    def _factory(self, ctxt):
+        self.built.append(ctxt)
+        return _Context(ctxt)
+
+    def _dispatch(self, dispatcher, ctxts):
+        return [dispatcher(c, dict(method='foo')) for c in ctxts]
+
+    def test_context_factory(self):
+        class TestEndpoint(object):
+            def foo(self, ctxt):
+                return ctxt
+
+        dispatcher = messaging.RPCDispatcher([TestEndpoint()], None,
+                                             context_factory=self._factory)
+        contexts = self._dispatch(dispatcher,
+                                  [dict(user='a'), dict(user='a')])
+
+        self.assertEqual([c.user for c in contexts], ['a', 'a'])
+        self.assertFalse(contexts[0] is contexts[1])
+        self.assertEqual(self.built, [dict(user='a'), dict(user='a')])
+
+    def test_context_cache(self):
+        class TestEndpoint(object):
+            def foo(self, ctxt):
+                return ctxt
+
+        dispatcher = messaging.RPCDispatcher([TestEndpoint()], None,
+                                             context_factory=self._factory,
+                                             context_cache_size=1)
+        ctxts = [dict(user='a', roles=['x', 'y'], catalog=[dict(type='z')]),
+                 dict(catalog=[dict(type='z')], roles=['x', 'y'], user='a'),
+                 dict(user='a', roles=['y', 'x'], catalog=[dict(type='z')]),
+                 dict(user='b'),
+                 dict(user='a', roles=['x', 'y'], catalog=[dict(type='z')])]
+        contexts = self._dispatch(dispatcher, ctxts)
+
+        self.assertTrue(contexts[0] is contexts[1])
+        self.assertFalse(contexts[0] is contexts[2])
+        self.assertFalse(contexts[0] is contexts[4])
+        self.assertEqual(self.built, [ctxts[0], ctxts[2], ctxts[3], ctxts[4]])
+
+    def test_context_id(self):
+        class TestEndpoint(object):
+            def foo(self, ctxt):
+                return ctxt
+
+        dispatcher = messaging.RPCDispatcher([TestEndpoint()], None,
+                                             context_factory=self._factory,
+                                             context_cache_size=2)
+        ctxts = [context_cache.DecodedContext('1', dict(user='a')),
+                 context_cache.DecodedContext('1', dict(user='a')),
+                 dict(user='a')]
+
+        self.mox.StubOutWithMock(rpc_dispatcher, '_freeze')
+        rpc_dispatcher._freeze(ctxts[2]).AndReturn('key')
+        self.mox.ReplayAll()
+
+        contexts = self._dispatch(dispatcher, ctxts)
+        self.assertTrue(contexts[0] is contexts[1])
+        self.assertEqual(self.built, [ctxts[0], ctxts[2]])
+
+    def test_unhashable_not_cached(self):
+        class TestEndpoint(object):
+            def foo(self, ctxt):
+                return ctxt
+
+        dispatcher = messaging.RPCDispatcher([TestEndpoint()], None,
+                                             context_factory=self._factory,
+                                             context_cache_size=1)
+        ctxts = [dict(user='a', roles=set(['x'])),
+                 dict(user='a', roles=set(['x']))]
+        contexts = self._dispatch(dispatcher, ctxts)
+
+        self.assertFalse(contexts[0] is contexts[1])
+        self.assertEqual(self.built, ctxts)
+
+    def test_serializer_gets_context(self):
+        class TestEndpoint(object):
+            def foo(self, ctxt, a):
+                return a
+
+        serializer = msg_serializer.NoOpSerializer()
+        self.mox.StubOutWithMock(serializer, 'deserialize_entity')
+        self.mox.StubOutWithMock(serializer, 'serialize_entity')
+        serializer.deserialize_entity(mox.IsA(_Context), 'a').AndReturn('da')
+        serializer.serialize_entity(mox.IsA(_Context), 'da').AndReturn('sda')
+        self.mox.ReplayAll()
+
+        dispatcher = messaging.RPCDispatcher([TestEndpoint()], serializer,
+                                             context_factory=self._factory)
+        self.assertEqual(dispatcher(dict(user='a'),
+                                    dict(method='foo', args=dict(a='a'))),
+                         'sda')
@@ -19,6 +19,7 @@ from oslo.config import cfg
 import testscenarios
 
 from oslo import messaging
+from oslo.messaging._drivers import chunking
 from tests import utils as test_utils
 
 load_tests = testscenarios.load_tests_apply_scenarios
@@ -212,6 +213,56 @@ class TestRPCServer(test_utils.BaseTestCase, ServerSetupMixin):
 
         self.assertEqual(endpoint.pings, ['dsfoo', 'dsbar'])
 
+    def test_cast_priority(self):
+        transport = messaging.get_transport(self.conf, url='fake:')
+
+        class TestEndpoint(object):
+            def __init__(self):
+                self.pings = []
+
+            def ping(self, ctxt, arg):
+                self.pings.append(arg)
+
+        endpoint = TestEndpoint()
+        client = self._setup_client(transport)
+
+        client.cast({}, 'ping', arg='bulk1')
+        client.prepare(priority=5).cast({}, 'ping', arg='urgent')
+        client.cast({}, 'ping', arg='bulk2')
+        client.prepare(priority=10).cast({}, 'ping', arg='control')
+
+        server_thread = self._setup_server(transport, endpoint)
+        self._stop_server(client, server_thread)
+
+        self.assertEqual(endpoint.pings,
+                         ['dscontrol', 'dsurgent', 'dsbulk1', 'dsbulk2'])
+
+    def test_cast_batch(self):
+        transport = messaging.get_transport(self.conf, url='fake:')
+
+        class TestEndpoint(object):
+            def __init__(self):
+                self.pings = []
+
+            def ping(self, ctxt, arg):
+                self.pings.append((ctxt['user'], arg))
+
+        endpoint = TestEndpoint()
+        server_thread = self._setup_server(transport, endpoint)
+        client = messaging.RPCClient(transport,
+                                     messaging.Target(topic='testtopic'),
+                                     serializer=self.serializer,
+                                     batch_casts=True,
+                                     batch_interval=None)
+
+        client.cast({'user': 'a'}, 'ping', arg='foo')
+        client.cast({'user': 'b'}, 'ping', arg='bar')
+        client.flush()
+
+        self._stop_server(client.prepare(batch_casts=False), server_thread)
+
+        self.assertEqual(endpoint.pings, [('a', 'dsfoo'), ('b', 'dsbar')])
+
     def test_call(self):
         transport = messaging.get_transport(self.conf, url='fake:')
 
@@ -226,6 +277,57 @@ class TestRPCServer(test_utils.BaseTestCase, ServerSetupMixin):
 
         self._stop_server(client, server_thread)
 
+    def test_call_envelope(self):
+        transport = messaging.get_transport(self.conf, url='fake:')
+
+        class TestEndpoint(object):
+            def ping(self, ctxt, arg):
+                return arg
+
+        server_thread = self._setup_server(transport, TestEndpoint())
+        client = self._setup_client(transport)
+        self.config(rpc_message_envelope=True)
+
+        self.assertEqual(client.call({}, 'ping', arg='foo'), 'dsdsfoo')
+        self.assertEqual(client.pipeline({}, [('ping', dict(arg='bar'))]),
+                         ['dsdsbar'])
+
+        self._stop_server(client, server_thread)
+
+    def test_call_chunked(self):
+        self.conf.register_opts(chunking._chunking_opts)
+        self.config(message_chunk_size=16)
+        transport = messaging.get_transport(self.conf, url='fake:')
+
+        class TestEndpoint(object):
+            def ping(self, ctxt, arg):
+                return arg
+
+        server_thread = self._setup_server(transport, TestEndpoint())
+        client = self._setup_client(transport)
+        self.config(rpc_message_envelope=True)
+
+        arg = 'x' * 1000
+        self.assertEqual(client.call({}, 'ping', arg=arg), 'dsds' + arg)
+
+        self._stop_server(client, server_thread)
+
+    def test_pipeline(self):
+        transport = messaging.get_transport(self.conf, url='fake:')
+
+        class TestEndpoint(object):
+            def ping(self, ctxt, arg):
+                return arg
+
+        server_thread = self._setup_server(transport, TestEndpoint())
+        client = self._setup_client(transport)
+
+        calls = [('ping', dict(arg=a)) for a in ('foo', 'bar', 'baz')]
+        self.assertEqual(client.pipeline({}, calls),
+                         ['dsdsfoo', 'dsdsbar', 'dsdsbaz'])
+
+        self._stop_server(client, server_thread)
+
     def test_direct_call(self):
         transport = messaging.get_transport(self.conf, url='fake:')
 
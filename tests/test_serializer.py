@@ -0,0 +1,150 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo import messaging
+from oslo.messaging import serializer as msg_serializer
+from tests import utils as test_utils
+
+
+class _Thing(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _SubThing(_Thing):
+    pass
+
+
+class _OldThing:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class TestRegistrySerializer(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestRegistrySerializer, self).setUp()
+        self.serializer = messaging.RegistrySerializer()
+        self.serializer.register_serializer(_Thing, self._serialize)
+        self.serializer.register_deserializer(dict, self._deserialize)
+        self.ctxt = dict(user='bob')
+
+    def _serialize(self, ctxt, entity):
+        self.assertEqual(ctxt, self.ctxt)
+        return {'thing': entity.name}
+
+    def _deserialize(self, ctxt, entity):
+        self.assertEqual(ctxt, self.ctxt)
+        if 'thing' not in entity:
+            return entity
+        return _Thing(entity['thing'])
+
+    def test_serialize_entity(self):
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt,
+                                                          _Thing('a')),
+                         {'thing': 'a'})
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt, 'a'),
+                         'a')
+
+    def test_deserialize_entity(self):
+        thing = self.serializer.deserialize_entity(self.ctxt, {'thing': 'a'})
+        self.assertTrue(isinstance(thing, _Thing))
+        self.assertEqual(thing.name, 'a')
+        self.assertEqual(self.serializer.deserialize_entity(self.ctxt,
+                                                            {'a': 1}),
+                         {'a': 1})
+        self.assertEqual(self.serializer.deserialize_entity(self.ctxt, 1), 1)
+
+    def test_subclass(self):
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt,
+                                                          _SubThing('a')),
+                         {'thing': 'a'})
+
+        self.serializer.register_serializer(_SubThing,
+                                            lambda ctxt, entity: 'sub')
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt,
+                                                          _SubThing('a')),
+                         'sub')
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt,
+                                                          _Thing('a')),
+                         {'thing': 'a'})
+
+    def test_old_style_class(self):
+        self.serializer.register_serializer(_OldThing,
+                                            lambda ctxt, entity: entity.name)
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt,
+                                                          _OldThing('a')),
+                         'a')
+        self.assertEqual(self.serializer.serialize_entity(self.ctxt, 'b'),
+                         'b')
+
+    def test_lookup_cached(self):
+        self.serializer.serialize_entity(self.ctxt, _SubThing('a'))
+        self.serializer.serialize_entity(self.ctxt, 1)
+
+        self.mox.StubOutWithMock(msg_serializer.inspect, 'getmro')
+        self.mox.ReplayAll()
+
+        self.serializer.serialize_entity(self.ctxt, _SubThing('b'))
+        self.serializer.serialize_args(self.ctxt, dict(a=_SubThing('c'), b=2))
+
+    def test_args(self):
+        args = dict(a=_Thing('a'), b=1, c=_SubThing('c'))
+        primitives = self.serializer.serialize_args(self.ctxt, args)
+        self.assertEqual(primitives,
+                         dict(a={'thing': 'a'}, b=1, c={'thing': 'c'}))
+
+        args = self.serializer.deserialize_args(self.ctxt, primitives)
+        self.assertEqual(sorted(args.keys()), ['a', 'b', 'c'])
+        self.assertEqual(args['a'].name, 'a')
+        self.assertEqual(args['b'], 1)
+        self.assertEqual(args['c'].name, 'c')
+
+
+class TestSerializeArgs(test_utils.BaseTestCase):
+
+    def test_serializer_args(self):
+        serializer = msg_serializer.NoOpSerializer()
+
+        self.mox.StubOutWithMock(serializer, 'serialize_entity')
+        self.mox.StubOutWithMock(serializer, 'deserialize_entity')
+        serializer.serialize_entity({}, 'a').AndReturn('sa')
+        serializer.deserialize_entity({}, 'sa').AndReturn('dsa')
+        self.mox.ReplayAll()
+
+        self.assertEqual(msg_serializer._serialize_args(serializer, {},
+                                                        dict(a='a')),
+                         dict(a='sa'))
+        self.assertEqual(msg_serializer._deserialize_args(serializer, {},
+                                                          dict(a='sa')),
+                         dict(a='dsa'))
+
+    def test_duck_typed_serializer_args(self):
+        class DuckSerializer(object):
+
+            def serialize_entity(self, ctxt, entity):
+                return 's' + entity
+
+            def deserialize_entity(self, ctxt, entity):
+                return 'd' + entity
+
+        serializer = DuckSerializer()
+        self.assertEqual(msg_serializer._serialize_args(serializer, {},
+                                                        dict(a='a')),
+                         dict(a='sa'))
+        self.assertEqual(msg_serializer._deserialize_args(serializer, {},
+                                                          dict(a='a')),
+                         dict(a='da'))
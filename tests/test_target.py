@@ -13,6 +13,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
+import pickle
+
 import testscenarios
 
 from oslo import messaging
@@ -125,6 +128,52 @@ class TargetReprTestCase(test_utils.BaseTestCase):
         self.assertEqual(str(target), '<Target ' + self.repr + '>')
 
 
+class TargetImmutableTestCase(test_utils.BaseTestCase):
+
+    def test_setattr(self):
+        target = messaging.Target(topic='testtopic')
+        self.assertRaises(AttributeError, setattr, target, 'topic', 'foo')
+        self.assertRaises(AttributeError, setattr, target, 'foo', 'bar')
+        self.assertRaises(AttributeError, delattr, target, 'topic')
+        self.assertEqual(target.topic, 'testtopic')
+
+    def test_hash(self):
+        a = messaging.Target(topic='testtopic', server='testserver')
+        b = messaging.Target(topic='testtopic')(server='testserver')
+        c = messaging.Target(topic='testtopic')
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len(set([a, b, c])), 2)
+        self.assertEqual({a: 1}[b], 1)
+
+    def test_unhashable(self):
+        target = messaging.Target(topic=['testtopic'])
+        self.assertRaises(TypeError, hash, target)
+        self.assertEqual(target(server='testserver').server, 'testserver')
+
+    def test_routing_key(self):
+        target = messaging.Target(exchange='testexchange', topic='testtopic',
+                                  namespace='testnamespace', version='1.1',
+                                  server='testserver')
+        self.assertEqual(target.routing_key,
+                         ('testexchange', 'testtopic', 'testserver'))
+
+    def test_call_interned(self):
+        target = messaging.Target(topic='testtopic')
+        self.assertTrue(target() is target)
+        self.assertTrue(target(server='testserver') is
+                        target(server='testserver'))
+
+    def test_call_unexpected(self):
+        target = messaging.Target(topic='testtopic')
+        self.assertRaises(TypeError, target, foo='bar')
+
+    def test_copy(self):
+        target = messaging.Target(topic='testtopic', fanout=True)
+        self.assertEqual(copy.copy(target), target)
+        self.assertEqual(copy.deepcopy(target), target)
+        self.assertEqual(pickle.loads(pickle.dumps(target)), target)
+
+
 _notset = object()
 
 
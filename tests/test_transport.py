@@ -36,6 +36,9 @@ class _FakeDriver(object):
     def send(self, *args, **kwargs):
         pass
 
+    def send_async(self, *args, **kwargs):
+        pass
+
     def listen(self, target):
         pass
 
@@ -238,7 +241,8 @@ class TestTransportMethodArgs(test_utils.BaseTestCase):
         t._driver.send('target', 'ctxt', 'message',
                        wait_for_reply=None,
                        timeout=None,
-                       envelope=False)
+                       envelope=None,
+                       priority=None)
         self.mox.ReplayAll()
 
         t._send('target', 'ctxt', 'message')
@@ -250,13 +254,28 @@ class TestTransportMethodArgs(test_utils.BaseTestCase):
         t._driver.send('target', 'ctxt', 'message',
                        wait_for_reply='wait_for_reply',
                        timeout='timeout',
-                       envelope='envelope')
+                       envelope='envelope',
+                       priority='priority')
         self.mox.ReplayAll()
 
         t._send('target', 'ctxt', 'message',
                 wait_for_reply='wait_for_reply',
                 timeout='timeout',
-                envelope='envelope')
+                envelope='envelope',
+                priority='priority')
+
+    def test_send_async(self):
+        t = transport.Transport(_FakeDriver(cfg.CONF))
+
+        self.mox.StubOutWithMock(t._driver, 'send_async')
+        t._driver.send_async('target', 'ctxt', 'message',
+                             envelope='envelope',
+                             priority='priority')
+        self.mox.ReplayAll()
+
+        t._send_async('target', 'ctxt', 'message',
+                      envelope='envelope',
+                      priority='priority')
 
     def test_listen(self):
         t = transport.Transport(_FakeDriver(cfg.CONF))
@@ -0,0 +1,112 @@
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import testscenarios
+
+from oslo.messaging import _utils as utils
+from tests import utils as test_utils
+
+load_tests = testscenarios.load_tests_apply_scenarios
+
+
+class LRUCacheTestCase(test_utils.BaseTestCase):
+
+    def test_get_and_put(self):
+        cache = utils.LRUCache(2)
+        self.assertTrue(cache.get('a') is None)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 2)
+
+        cache.put('a', 3)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+
+    def test_pop_and_clear(self):
+        cache = utils.LRUCache(3)
+        cache.put('a', 1)
+        cache.put('b', 2)
+
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertTrue(cache.pop('a') is None)
+        self.assertEqual(len(cache), 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.put('c', 3)
+        self.assertEqual(cache.keys(), ['c'])
+
+
+class VersionTestCase(test_utils.BaseTestCase):
+
+    def test_parse(self):
+        version = utils.Version.parse('1.2')
+        self.assertEqual(version.major, 1)
+        self.assertEqual(version.minor, 2)
+        self.assertEqual(str(version), '1.2')
+
+    def test_interned(self):
+        version = utils.Version.parse('3.14')
+        self.assertTrue(utils.Version.parse('3.14') is version)
+        self.assertTrue(utils.Version.parse(u'3.14') is version)
+        self.assertTrue(utils.Version.parse(version) is version)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, utils.Version.parse, 'a.b')
+
+
+class VersionIsCompatibleTestCase(test_utils.BaseTestCase):
+
+    scenarios = [
+        ('same', dict(imp_version='1.0', version='1.0', compatible=True)),
+        ('older_minor',
+         dict(imp_version='1.1', version='1.0', compatible=True)),
+        ('newer_minor',
+         dict(imp_version='1.0', version='1.1', compatible=False)),
+        ('older_major',
+         dict(imp_version='2.0', version='1.0', compatible=False)),
+        ('newer_major',
+         dict(imp_version='1.5', version='2.0', compatible=False)),
+        ('multi_digit',
+         dict(imp_version='1.10', version='1.9', compatible=True)),
+    ]
+
+    def test_version_is_compatible(self):
+        for i in range(2):
+            self.assertEqual(utils.version_is_compatible(self.imp_version,
+                                                         self.version),
+                             self.compatible)
+
+    def test_parsed_versions(self):
+        imp_version = utils.Version.parse(self.imp_version)
+        version = utils.Version.parse(self.version)
+        self.assertEqual(utils.version_is_compatible(imp_version, version),
+                         self.compatible)
+        self.assertEqual(imp_version.can_handle(version), self.compatible)
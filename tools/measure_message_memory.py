@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright 2013 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure the memory used by each incoming message a server holds.
+
+Creates a number of fake incoming messages, each with its own request
+context and message dicts, and reports the growth in peak RSS divided by the
+number of messages. With --no-slots, the messages keep their attributes in a
+per-instance __dict__ instead, for comparison.
+
+Each variant should be measured in a fresh process, e.g.:
+
+    python tools/measure_message_memory.py
+    python tools/measure_message_memory.py --no-slots
+"""
+
+import argparse
+import resource
+import sys
+
+from oslo.messaging._drivers import impl_fake
+
+
+class _DictIncomingMessage(object):
+
+    """A fake incoming message with its attributes in a __dict__.
+
+    A subclass of FakeIncomingMessage would keep its attributes in the slots
+    it inherits, so this has the attributes messages had without __slots__.
+    """
+
+    def __init__(self, listener, ctxt, message, reply_q):
+        self.conf = getattr(listener, 'conf', None)
+        self.listener = listener
+        self.ctxt = ctxt
+        self.message = message
+        self._reply_q = reply_q
+
+
+def _peak_rss():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on OS X
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000,
+                        help='the number of messages to create')
+    parser.add_argument('--no-slots', action='store_true',
+                        help='use messages which have a __dict__')
+    args = parser.parse_args(argv)
+
+    cls = _DictIncomingMessage if args.no_slots else \
+        impl_fake.FakeIncomingMessage
+
+    before = _peak_rss()
+    messages = [cls(None,
+                    dict(user='user', project='project', request_id=str(i)),
+                    dict(method='method', args=dict(arg=i)),
+                    None)
+                for i in range(args.count)]
+    after = _peak_rss()
+
+    print('%s: %d messages, %d bytes each' %
+          (cls.__name__, len(messages), (after - before) // len(messages)))
+
+
+if __name__ == '__main__':
+    main()